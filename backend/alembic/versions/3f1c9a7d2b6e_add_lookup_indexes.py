@@ -0,0 +1,62 @@
+"""Add lookup indexes
+
+Revision ID: 3f1c9a7d2b6e
+Revises: 0de2437bb593
+Create Date: 2026-10-17 10:12:31.418204
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "3f1c9a7d2b6e"
+down_revision = "0de2437bb593"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_reflections_unit_user_question",
+        "reflections",
+        ["unit_id", "user_id", "question_id"],
+    )
+    op.create_index("ix_reflections_user_id", "reflections", ["user_id"])
+    op.create_index(
+        "ix_enrollment_course_role",
+        "enrollment",
+        ["course_id", "course_semester", "role"],
+    )
+    op.create_index(
+        "ix_units_course_date",
+        "units",
+        ["course_id", "course_semester", "date_available"],
+    )
+    op.create_index(
+        "ix_reports_unit_course",
+        "reports",
+        ["unit_id", "course_id", "course_semester"],
+    )
+    op.create_index(
+        "ix_invitations_uid_course",
+        "invitations",
+        ["uid", "course_id", "course_semester"],
+    )
+    op.create_index(
+        "ix_course_question_course",
+        "course_question",
+        ["course_id", "course_semester"],
+    )
+    op.create_index("ix_notification_logs_sent_at", "notification_logs", ["sent_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_notification_logs_sent_at", table_name="notification_logs")
+    op.drop_index("ix_course_question_course", table_name="course_question")
+    op.drop_index("ix_invitations_uid_course", table_name="invitations")
+    op.drop_index("ix_reports_unit_course", table_name="reports")
+    op.drop_index("ix_units_course_date", table_name="units")
+    op.drop_index("ix_enrollment_course_role", table_name="enrollment")
+    op.drop_index("ix_reflections_user_id", table_name="reflections")
+    op.drop_index("ix_reflections_unit_user_question", table_name="reflections")
@@ -0,0 +1,32 @@
+"""Add change counters to courses and units
+
+Revision ID: 5a7c3e9b1d24
+Revises: c4d1e7a9f02b
+Create Date: 2026-10-17 17:41:12.508163
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "5a7c3e9b1d24"
+down_revision = "c4d1e7a9f02b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "courses",
+        sa.Column("version", sa.Integer(), server_default="1", nullable=False),
+    )
+    op.add_column(
+        "units",
+        sa.Column("version", sa.Integer(), server_default="1", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("units", "version")
+    op.drop_column("courses", "version")
@@ -0,0 +1,67 @@
+"""Add notification outbox
+
+Revision ID: 8b2e4d6f1a3c
+Revises: 3f1c9a7d2b6e
+Create Date: 2026-10-17 13:40:12.904117
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "8b2e4d6f1a3c"
+down_revision = "3f1c9a7d2b6e"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "notification_jobs",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_notification_jobs_id"), "notification_jobs", ["id"], unique=False
+    )
+    op.create_table(
+        "notification_outbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("job_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.String(), nullable=False),
+        sa.Column("course_id", sa.String(), nullable=False),
+        sa.Column("unit_ids", sa.JSON(), nullable=False),
+        sa.Column("recipient", sa.String(), nullable=False),
+        sa.Column("subject", sa.String(), nullable=False),
+        sa.Column("body", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+        sa.Column("last_error", sa.String(), nullable=True),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["job_id"], ["notification_jobs.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.uid"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_notification_outbox_id"), "notification_outbox", ["id"], unique=False
+    )
+    op.create_index(
+        "ix_notification_outbox_status_next",
+        "notification_outbox",
+        ["status", "next_attempt_at"],
+    )
+    op.create_index("ix_notification_outbox_job", "notification_outbox", ["job_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_notification_outbox_job", table_name="notification_outbox")
+    op.drop_index(
+        "ix_notification_outbox_status_next", table_name="notification_outbox"
+    )
+    op.drop_index(op.f("ix_notification_outbox_id"), table_name="notification_outbox")
+    op.drop_table("notification_outbox")
+    op.drop_index(op.f("ix_notification_jobs_id"), table_name="notification_jobs")
+    op.drop_table("notification_jobs")
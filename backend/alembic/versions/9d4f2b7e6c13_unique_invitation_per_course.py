@@ -0,0 +1,56 @@
+"""Unique invitation per course
+
+Revision ID: 9d4f2b7e6c13
+Revises: 5a7c3e9b1d24
+Create Date: 2026-10-17 19:12:05.914227
+
+"""
+
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger("alembic")
+
+# revision identifiers, used by Alembic.
+revision = "9d4f2b7e6c13"
+down_revision = "5a7c3e9b1d24"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Keep the first invitation of any duplicates that slipped past the old check-then-insert
+    removed = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "DELETE FROM invitations WHERE id NOT IN ("
+                "SELECT MIN(id) FROM invitations GROUP BY uid, course_id, course_semester)"
+            )
+        )
+        .rowcount
+    )
+    if removed:
+        logger.warning(
+            "Removed %d duplicate invitations before creating the unique index on "
+            "(uid, course_id, course_semester)",
+            removed,
+        )
+    op.drop_index("ix_invitations_uid_course", table_name="invitations")
+    op.create_index(
+        "ix_invitations_uid_course",
+        "invitations",
+        ["uid", "course_id", "course_semester"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_invitations_uid_course", table_name="invitations")
+    op.create_index(
+        "ix_invitations_uid_course",
+        "invitations",
+        ["uid", "course_id", "course_semester"],
+    )
@@ -0,0 +1,56 @@
+"""Unique reflection per question
+
+Revision ID: c4d1e7a9f02b
+Revises: 8b2e4d6f1a3c
+Create Date: 2026-10-17 15:02:47.331870
+
+"""
+
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger("alembic")
+
+# revision identifiers, used by Alembic.
+revision = "c4d1e7a9f02b"
+down_revision = "8b2e4d6f1a3c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Keep the first answer of any duplicates that slipped past the old check-then-insert
+    removed = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "DELETE FROM reflections WHERE id NOT IN ("
+                "SELECT MIN(id) FROM reflections GROUP BY unit_id, user_id, question_id)"
+            )
+        )
+        .rowcount
+    )
+    if removed:
+        logger.warning(
+            "Removed %d duplicate reflections before creating the unique index on "
+            "(unit_id, user_id, question_id)",
+            removed,
+        )
+    op.drop_index("ix_reflections_unit_user_question", table_name="reflections")
+    op.create_index(
+        "ix_reflections_unit_user_question",
+        "reflections",
+        ["unit_id", "user_id", "question_id"],
+        unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_reflections_unit_user_question", table_name="reflections")
+    op.create_index(
+        "ix_reflections_unit_user_question",
+        "reflections",
+        ["unit_id", "user_id", "question_id"],
+    )
@@ -0,0 +1,69 @@
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.config import Config
+
+from . import crud, model
+
+config = Config(".env")
+
+# Makes every user admin, for developers running the app locally
+ADMIN_OVERRIDE = config("isAdmin", cast=bool, default=False)
+
+
+class AuthContext:
+    """
+    The logged in user of a request, with their admin flag and course enrollments.
+
+    Created once per request by the `get_auth` dependency. The user and their enrollment in a course are
+    loaded together with one query the first time they are needed, and reused for the rest of the request.
+    """
+
+    def __init__(self, db: AsyncSession, request: Request):
+        self.db = db
+        user = request.session.get("user")
+        self.uid: Optional[str] = user.get("uid") if user else None
+        self._user: Optional[model.User] = None
+        self._user_loaded = False
+        self._enrollments: Dict[Tuple[str, str], Optional[model.Enrollment]] = {}
+
+    def require_login(self):
+        if self.uid is None:
+            raise HTTPException(401, detail="You are not logged in")
+
+    async def user(self) -> Optional[model.User]:
+        if self.uid is not None and not self._user_loaded:
+            self._user = await crud.get_user(self.db, self.uid)
+            self._user_loaded = True
+        return self._user
+
+    async def enrollment(
+        self, course_id: str, course_semester: str
+    ) -> Optional[model.Enrollment]:
+        if self.uid is None:
+            return None
+        key = (course_id, course_semester)
+        if key not in self._enrollments:
+            self._user, self._enrollments[key] = await crud.get_user_and_enrollment(
+                self.db, self.uid, course_id, course_semester
+            )
+            self._user_loaded = True
+        return self._enrollments[key]
+
+    async def is_admin(self) -> bool:
+        if ADMIN_OVERRIDE:
+            return True
+        user = await self.user()
+        return user is not None and bool(user.admin)
+
+    async def has_role(
+        self, course_id: str, course_semester: str, roles: List[str]
+    ) -> bool:
+        """
+        Returns True if the user is admin or is enrolled in the course with one of `roles`.
+        """
+        enrollment = await self.enrollment(course_id, course_semester)
+        if await self.is_admin():
+            return True
+        return enrollment is not None and enrollment.role in roles
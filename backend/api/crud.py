@@ -1,36 +1,215 @@
 from datetime import date, datetime, timedelta
+from itertools import groupby
+from typing import List, Optional, Tuple
 from fastapi import HTTPException
 
 from . import model
 from . import schemas
-from sqlalchemy.orm import Session
-from sqlalchemy import not_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import (
+    JSON,
+    and_,
+    delete,
+    distinct,
+    func,
+    insert,
+    literal,
+    not_,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from starlette.config import Config
 
+from .utils.cache import cache
+
 config = Config(".env")
 
+
+# Returns an INSERT for the dialect of the session, which supports ON CONFLICT on both Postgres and sqlite
+def _dialect_insert(db: AsyncSession, table):
+    if db.bind.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+# --- Cache ---
+
+
+# Cache keys of the users, courses, questions and enrollments that are looked up on almost every request
+def _user_key(uid: str):
+    return f"user:{uid}"
+
+
+def _course_key(course_id: str, course_semester: str):
+    return f"course:{course_id}:{course_semester}"
+
+
+def _questions_key(course_id: str, course_semester: str):
+    return f"course_questions:{course_id}:{course_semester}"
+
+
+def _enrollment_key(course_id: str, course_semester: str, uid: str):
+    return f"enrollment:{course_id}:{course_semester}:{uid}"
+
+
+# Returns the column values of a row, which is what the cache stores
+def _cache_values(row):
+    return {attr.key: getattr(row, attr.key) for attr in row.__mapper__.column_attrs}
+
+
+# Rebuilds a row from its cached column values and adds it to the session without querying the database
+async def _from_cache(db: AsyncSession, table, values: dict):
+    row = table(**values)
+    make_transient_to_detached(row)
+    return await db.merge(row, load=False)
+
+
+# Removes the cached course, its questions and its enrollments, called after any of them change
+async def invalidate_course(course_id: str, course_semester: str):
+    await cache.delete(
+        _course_key(course_id, course_semester),
+        _questions_key(course_id, course_semester),
+    )
+    await cache.delete_prefix(_enrollment_key(course_id, course_semester, ""))
+
+
+# --- Change counters ---
+
+
+# Bumps the version of a course, which changes the ETags of its /course and /units responses. The caller commits
+async def touch_course(db: AsyncSession, course_id: str, course_semester: str):
+    await db.execute(
+        update(model.Course)
+        .where(model.Course.id == course_id, model.Course.semester == course_semester)
+        .values(version=model.Course.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Bumps the version of a unit, which changes the ETags of the responses that include it. The caller commits
+async def touch_unit(db: AsyncSession, unit_id: int):
+    await db.execute(
+        update(model.Unit)
+        .where(model.Unit.id == unit_id)
+        .values(version=model.Unit.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Returns the version of a course and the sum of the versions of its units, which together change whenever
+# anything in /course or /units changes, or None if the course does not exist
+async def get_course_versions(
+    db: AsyncSession, course_id: str, course_semester: str
+) -> Optional[Tuple[int, int]]:
+    row = (
+        await db.execute(
+            select(model.Course.version, func.coalesce(func.sum(model.Unit.version), 0))
+            .outerjoin(
+                model.Unit,
+                and_(
+                    model.Unit.course_id == model.Course.id,
+                    model.Unit.course_semester == model.Course.semester,
+                ),
+            )
+            .where(
+                model.Course.id == course_id, model.Course.semester == course_semester
+            )
+            .group_by(model.Course.id, model.Course.semester, model.Course.version)
+        )
+    ).first()
+    return None if row is None else tuple(row)
+
+
+# Returns the version of a unit in a course, or None if the unit does not exist
+async def get_unit_version(
+    db: AsyncSession, unit_id: int, course_id: str, course_semester: str
+) -> Optional[int]:
+    return await db.scalar(
+        select(model.Unit.version).where(
+            model.Unit.id == unit_id,
+            *_in_course(course_id, course_semester, model.Unit),
+        )
+    )
+
+
 # --- User ---
 
 
-# Returns user based on uid
-def get_user(db: Session, uid: str):
-    return db.query(model.User).filter(model.User.uid == uid).first()
+# Returns user based on uid, from the cache if it was looked up recently
+async def get_user(db: AsyncSession, uid: str):
+    values = await cache.get(_user_key(uid))
+    if values is not None:
+        return await _from_cache(db, model.User, values)
+    user = await db.scalar(select(model.User).where(model.User.uid == uid))
+    if user is not None:
+        await cache.set(_user_key(uid), _cache_values(user))
+    return user
+
+
+# Returns user with enrollments (and their courses) and reflections loaded, used when serializing the user
+async def get_user_with_relations(db: AsyncSession, uid: str):
+    return await db.scalar(
+        select(model.User)
+        .where(model.User.uid == uid)
+        .options(
+            selectinload(model.User.enrollments).selectinload(model.Enrollment.course),
+            selectinload(model.User.reflections),
+        )
+    )
+
+
+# Returns the available units the user has not reflected on, in every course the user is a student in
+async def get_missing_units_for_user(db: AsyncSession, uid: str):
+    reflected = (
+        select(model.Reflection.id)
+        .where(
+            model.Reflection.unit_id == model.Unit.id,
+            model.Reflection.user_id == uid,
+        )
+        .exists()
+    )
+    result = await db.execute(
+        select(
+            model.Unit.id,
+            model.Unit.date_available,
+            model.Unit.course_id,
+            model.Unit.course_semester,
+        )
+        .join(
+            model.Enrollment,
+            and_(
+                model.Enrollment.course_id == model.Unit.course_id,
+                model.Enrollment.course_semester == model.Unit.course_semester,
+            ),
+        )
+        .where(
+            model.Enrollment.uid == uid,
+            model.Enrollment.role.not_in(["lecturer", "teaching assistant"]),
+            model.Unit.date_available <= date.today(),
+            not_(reflected),
+        )
+        .order_by(model.Unit.id)
+    )
+    return result.all()
 
 
 # Returns all units for a course
-def get_units_for_course(db: Session, course_id: str, course_semester: str):
-    return (
-        db.query(model.Unit)
-        .filter(
+async def get_units_for_course(db: AsyncSession, course_id: str, course_semester: str):
+    result = await db.scalars(
+        select(model.Unit).where(
             model.Unit.course_id == course_id,
             model.Unit.course_semester == course_semester,
         )
-        .all()
     )
+    return result.all()
 
 
 # Creates user from email
-def create_user(db: Session, uid: str, user_email: str, admin: bool = False):
+async def create_user(db: AsyncSession, uid: str, user_email: str, admin: bool = False):
     print("creating user")
     # For developers, we can create an admin user
     if uid in config("DEVELOPERS", cast=str, default="").split(","):
@@ -39,17 +218,17 @@ def create_user(db: Session, uid: str, user_email: str, admin: bool = False):
     db_user = model.User(uid=uid, email=user_email, admin=admin)
     print("creating user")
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
 # Enrolls user in a course
 async def create_enrollment(
-    db: Session, uid: str, course_id: str, course_semester: str, role: str
+    db: AsyncSession, uid: str, course_id: str, course_semester: str, role: str
 ):
-    db_user = get_user(db, uid)
-    db_course = get_course(db, course_id, course_semester)
+    db_user = await get_user(db, uid)
+    db_course = await get_course(db, course_id, course_semester)
     db_enrollment = model.Enrollment(
         uid=uid,
         course_id=course_id,
@@ -58,27 +237,31 @@ async def create_enrollment(
     )
     print("Creating enrollment")
     db.add(db_enrollment)
-    db.commit()
-    db.refresh(db_enrollment)
-    db.refresh(db_user)
-    db.refresh(db_course)
+    await touch_course(db, course_id, course_semester)
+    await db.commit()
+    await cache.delete(_enrollment_key(course_id, course_semester, uid))
+    await db.refresh(db_enrollment)
+    await db.refresh(db_user)
+    await db.refresh(db_course)
     return db_enrollment
 
 
 # Deletes a student's enrollment from a course
-def delete_enrollment(db: Session, uid: str, course_id: str, course_semester: str):
-    enrollment = (
-        db.query(model.Enrollment)
-        .filter(
+async def delete_enrollment(
+    db: AsyncSession, uid: str, course_id: str, course_semester: str
+):
+    enrollment = await db.scalar(
+        select(model.Enrollment).where(
             model.Enrollment.uid == uid,
             model.Enrollment.course_id == course_id,
             model.Enrollment.course_semester == course_semester,
         )
-        .first()
     )
     if enrollment:
-        db.delete(enrollment)
-        db.commit()
+        await db.delete(enrollment)
+        await touch_course(db, course_id, course_semester)
+        await db.commit()
+        await cache.delete(_enrollment_key(course_id, course_semester, uid))
         return enrollment
     else:
         raise HTTPException(status_code=404, detail="Enrollment not found")
@@ -87,275 +270,776 @@ def delete_enrollment(db: Session, uid: str, course_id: str, course_semester: st
 # --- Course ---
 
 
-# Creates course
-def create_course(db: Session, course: schemas.CourseCreate):
+# The questions a course gets when it is created without any
+DEFAULT_QUESTIONS = [
+    {
+        "question": "Teaching",
+        "comment": "What was your best learning success in this unit? Why?",
+    },
+    {
+        "question": "Difficult",
+        "comment": "What was your least understood concept in this unit? Why?",
+    },
+]
+
+
+# Creates a course with its questions, and enrolls lecturer_uid as lecturer if given, in one transaction.
+# The questions and their links to the course are written with one bulk INSERT each, so a failure, such as
+# the course already existing, leaves no orphan questions behind
+async def create_course(
+    db: AsyncSession, course: schemas.CourseCreate, lecturer_uid: Optional[str] = None
+):
     course_data = {key: value for key, value in course.items() if key != "questions"}
-    db_course = model.Course(**course_data)
+    questions = [
+        {"question": q["question"], "comment": q["comment"]}
+        for q in course["questions"] or DEFAULT_QUESTIONS
+    ]
 
-    questions = []
-    if len(course["questions"]) == 0:
-        questions = [
-            create_question(
-                db=db,
-                question="Teaching",
-                comment="What was your best learning success in this unit? Why?",
-            ),
-            create_question(
-                db=db,
-                question="Difficult",
-                comment="What was your least understood concept in this unit? Why?",
-            ),
-        ]
-    else:
-        for q in course["questions"]:
-            questions.append(
-                create_question(db=db, question=q["question"], comment=q["comment"])
-            )
-
-    for q in questions:
-        db_course.questions.append(q)
+    question_ids = (
+        await db.scalars(insert(model.Question).returning(model.Question.id), questions)
+    ).all()
 
     print("Creating course")
+    db_course = model.Course(**course_data)
     db.add(db_course)
-    db.commit()
-    db.refresh(db_course)
+    if lecturer_uid is not None:
+        db.add(
+            model.Enrollment(
+                uid=lecturer_uid,
+                course_id=db_course.id,
+                course_semester=db_course.semester,
+                role="lecturer",
+            )
+        )
+    await db.flush()
+
+    await db.execute(
+        insert(model.CourseQuestion),
+        [
+            {
+                "question_id": question_id,
+                "course_id": db_course.id,
+                "course_semester": db_course.semester,
+            }
+            for question_id in question_ids
+        ],
+    )
+    await db.commit()
+    await invalidate_course(db_course.id, db_course.semester)
     return db_course
 
 
-# Returns course based on course_id and course_semester
-def get_course(db: Session, course_id: str, course_semester: str):
-    return (
-        db.query(model.Course)
-        .filter(model.Course.id == course_id, model.Course.semester == course_semester)
+# Returns course based on course_id and course_semester, from the cache if it was looked up recently
+async def get_course(db: AsyncSession, course_id: str, course_semester: str):
+    key = _course_key(course_id, course_semester)
+    values = await cache.get(key)
+    if values is not None:
+        return await _from_cache(db, model.Course, values)
+    course = await db.scalar(
+        select(model.Course).where(
+            model.Course.id == course_id, model.Course.semester == course_semester
+        )
+    )
+    if course is not None:
+        await cache.set(key, _cache_values(course))
+    return course
+
+
+# Returns a course with its questions, enrollments and reports as plain dicts with the fields of schemas.Course,
+# read as column rows without building ORM objects, or None if the course does not exist
+async def get_course_rows(db: AsyncSession, course_id: str, course_semester: str):
+    course = (
+        (
+            await db.execute(
+                select(
+                    model.Course.id,
+                    model.Course.semester,
+                    model.Course.name,
+                    model.Course.responsible,
+                    model.Course.website,
+                ).where(
+                    model.Course.id == course_id,
+                    model.Course.semester == course_semester,
+                )
+            )
+        )
+        .mappings()
         .first()
     )
+    if course is None:
+        return None
 
+    questions = await db.execute(
+        select(model.Question.id, model.Question.question, model.Question.comment)
+        .join(model.CourseQuestion)
+        .where(*_in_course(course_id, course_semester, model.CourseQuestion))
+    )
+    users = await db.execute(
+        select(
+            model.Enrollment.course_id,
+            model.Enrollment.course_semester,
+            model.Enrollment.role,
+        ).where(*_in_course(course_id, course_semester, model.Enrollment))
+    )
+    reports = await db.execute(
+        select(
+            model.Report.number_of_answers,
+            model.Report.unit_id,
+            model.Report.course_id,
+            model.Report.course_semester,
+        ).where(*_in_course(course_id, course_semester, model.Report))
+    )
+    return {
+        **course,
+        "questions": [dict(row) for row in questions.mappings()],
+        "users": [dict(row) for row in users.mappings()],
+        "reports": [dict(row) for row in reports.mappings()],
+    }
+
+
+# Returns the questions that belong to a course, from the cache if they were looked up recently
+async def get_course_questions(db: AsyncSession, course_id: str, course_semester: str):
+    key = _questions_key(course_id, course_semester)
+    cached = await cache.get(key)
+    if cached is not None:
+        return [await _from_cache(db, model.Question, values) for values in cached]
+    result = await db.scalars(
+        select(model.Question)
+        .join(model.CourseQuestion)
+        .where(
+            model.CourseQuestion.course_id == course_id,
+            model.CourseQuestion.course_semester == course_semester,
+        )
+    )
+    questions = result.all()
+    await cache.set(key, [_cache_values(question) for question in questions])
+    return questions
 
-# Deletes from database
-def delete_records(db: Session, model, filters):
-    records = db.query(model).filter(*filters).all()
-    for record in records:
-        db.delete(record)
-    db.commit()
 
+# Deletes every matching row with one DELETE statement, without loading the rows. The caller commits
+async def delete_records(db: AsyncSession, model, filters):
+    await db.execute(
+        delete(model).where(*filters).execution_options(synchronize_session=False)
+    )
 
-# Deletes course from database, inlcuding all related records such as enrollments, units, invitations, and questions
-def delete_course(db: Session, course_id: str, course_semester: str):
-    delete_records(
-        db,
-        model.Enrollment,
-        [
-            model.Enrollment.course_id == course_id,
-            model.Enrollment.course_semester == course_semester,
-        ],
+
+# Filters the rows of a table that belong to a course
+def _in_course(course_id: str, course_semester: str, table):
+    return [table.course_id == course_id, table.course_semester == course_semester]
+
+
+# Deletes course from database, inlcuding all related records such as enrollments, units with their
+# reflections, reports and notification counts, invitations, and questions no other course uses.
+# Every table is cleared with one set-based DELETE, and everything is deleted in one transaction
+async def delete_course(db: AsyncSession, course_id: str, course_semester: str):
+    course = await get_course(db, course_id, course_semester)
+    if course is None:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    unit_ids = select(model.Unit.id).where(
+        *_in_course(course_id, course_semester, model.Unit)
     )
-    delete_records(
+    question_ids = (
+        await db.scalars(
+            select(model.CourseQuestion.question_id).where(
+                *_in_course(course_id, course_semester, model.CourseQuestion)
+            )
+        )
+    ).all()
+
+    await delete_records(db, model.Reflection, [model.Reflection.unit_id.in_(unit_ids)])
+    await delete_records(
         db,
-        model.Unit,
-        [
-            model.Unit.course_id == course_id,
-            model.Unit.course_semester == course_semester,
-        ],
+        model.UserUnitNotificationCount,
+        [model.UserUnitNotificationCount.unit_id.in_(unit_ids)],
     )
-    delete_records(
-        db,
+    for table in [
+        model.Report,
+        model.Unit,
+        model.Enrollment,
         model.Invitation,
-        [
-            model.Invitation.course_id == course_id,
-            model.Invitation.course_semester == course_semester,
-        ],
+        model.CourseQuestion,
+    ]:
+        await delete_records(db, table, _in_course(course_id, course_semester, table))
+    if question_ids:
+        await delete_records(
+            db,
+            model.Question,
+            [
+                model.Question.id.in_(question_ids),
+                model.Question.id.not_in(select(model.CourseQuestion.question_id)),
+            ],
+        )
+    await delete_records(
+        db,
+        model.Course,
+        [model.Course.id == course_id, model.Course.semester == course_semester],
     )
-    delete_records(db, model.Question, [~model.Question.courses.any()])
+    await db.commit()
+    await invalidate_course(course_id, course_semester)
+
+    return course
 
-    course = get_course(db, course_id, course_semester)
-    if course:
-        db.delete(course)
-        db.commit()
-        return course
+
+# Clones a course into a new semester: the course, its question links, and its units with dates shifted by
+# date_offset_days, each with an empty report. Every table is copied with one INSERT ... SELECT on the server,
+# and lecturer_uid is enrolled as lecturer, in one transaction. Returns the number of cloned units
+async def clone_course(
+    db: AsyncSession,
+    course_id: str,
+    course_semester: str,
+    new_semester: str,
+    date_offset_days: int,
+    lecturer_uid: str,
+) -> int:
+    await db.execute(
+        insert(model.Course).from_select(
+            ["id", "semester", "name", "responsible", "website"],
+            select(
+                model.Course.id,
+                literal(new_semester),
+                model.Course.name,
+                model.Course.responsible,
+                model.Course.website,
+            ).where(
+                model.Course.id == course_id, model.Course.semester == course_semester
+            ),
+        )
+    )
+    await db.execute(
+        insert(model.CourseQuestion).from_select(
+            ["question_id", "course_id", "course_semester"],
+            select(
+                model.CourseQuestion.question_id,
+                model.CourseQuestion.course_id,
+                literal(new_semester),
+            ).where(*_in_course(course_id, course_semester, model.CourseQuestion)),
+        )
+    )
+
+    if db.bind.dialect.name == "postgresql":
+        date_available = model.Unit.date_available + date_offset_days
     else:
-        raise HTTPException(status_code=404, detail="Course not found")
+        date_available = func.date(
+            model.Unit.date_available, f"{date_offset_days:+d} days"
+        )
+    units = await db.execute(
+        insert(model.Unit).from_select(
+            [
+                "hidden",
+                "title",
+                "date_available",
+                "course_id",
+                "course_semester",
+                "reflections_since_last_report",
+            ],
+            select(
+                model.Unit.hidden,
+                model.Unit.title,
+                date_available,
+                model.Unit.course_id,
+                literal(new_semester),
+                literal(0),
+            )
+            .where(*_in_course(course_id, course_semester, model.Unit))
+            .order_by(model.Unit.id),
+        )
+    )
+    await db.execute(
+        insert(model.Report).from_select(
+            [
+                "report_content",
+                "number_of_answers",
+                "unit_id",
+                "course_id",
+                "course_semester",
+            ],
+            select(
+                literal([], type_=JSON),
+                literal(0),
+                model.Unit.id,
+                model.Unit.course_id,
+                model.Unit.course_semester,
+            ).where(*_in_course(course_id, new_semester, model.Unit)),
+        )
+    )
+
+    db.add(
+        model.Enrollment(
+            uid=lecturer_uid,
+            course_id=course_id,
+            course_semester=new_semester,
+            role="lecturer",
+        )
+    )
+    await db.commit()
+    await invalidate_course(course_id, new_semester)
+
+    return units.rowcount
 
 
 # --- Enrollment ---
 
 
+# Returns the user and their enrollment in a course with one query, or from the cache if both were looked
+# up recently. The enrollment is None if the user is not enrolled and both are None if the user does not exist
+async def get_user_and_enrollment(
+    db: AsyncSession, uid: str, course_id: str, course_semester: str
+):
+    user_key = _user_key(uid)
+    enrollment_key = _enrollment_key(course_id, course_semester, uid)
+    user_values = await cache.get(user_key)
+    enrollment_values = await cache.get(enrollment_key)
+    if user_values is not None and enrollment_values is not None:
+        return (
+            await _from_cache(db, model.User, user_values),
+            await _from_cache(db, model.Enrollment, enrollment_values),
+        )
+
+    row = (
+        await db.execute(
+            select(model.User, model.Enrollment)
+            .outerjoin(
+                model.Enrollment,
+                and_(
+                    model.Enrollment.uid == model.User.uid,
+                    model.Enrollment.course_id == course_id,
+                    model.Enrollment.course_semester == course_semester,
+                ),
+            )
+            .where(model.User.uid == uid)
+        )
+    ).first()
+    if row is None:
+        return None, None
+    await cache.set(user_key, _cache_values(row.User))
+    if row.Enrollment is not None:
+        await cache.set(enrollment_key, _cache_values(row.Enrollment))
+    return row.User, row.Enrollment
+
+
 # Returns enrollment for a course based on course_id, course_semester, and uid
-def get_enrollment(db: Session, course_id: str, course_semester: str, uid: str):
-    return (
-        db.query(model.Enrollment)
-        .filter(
+async def get_enrollment(
+    db: AsyncSession, course_id: str, course_semester: str, uid: str
+):
+    return await db.scalar(
+        select(model.Enrollment).where(
             model.Enrollment.course_id == course_id,
             model.Enrollment.course_semester == course_semester,
             model.Enrollment.uid == uid,
         )
-        .first()
     )
 
 
+# Returns the ids of the courses the user is enrolled in as lecturer, in any semester
+async def get_lecturer_course_ids(db: AsyncSession, uid: str) -> List[str]:
+    return (
+        await db.scalars(
+            select(model.Enrollment.course_id)
+            .where(model.Enrollment.uid == uid, model.Enrollment.role == "lecturer")
+            .distinct()
+        )
+    ).all()
+
+
+# Imports a batch of roster rows into a course as enrollments, or as invitations if invite is True.
+# Missing users are created, and every table is written with one executemany in one transaction. Rows that
+# are already enrolled or invited are skipped by the unique indexes, so concurrent or retried imports of the
+# same roster do not create duplicates. Returns the uids that were not imported because they are already enrolled or invited
+async def import_roster_batch(
+    db: AsyncSession,
+    course_id: str,
+    course_semester: str,
+    rows: List[dict],
+    invite: bool = False,
+) -> List[str]:
+    developers = config("DEVELOPERS", cast=str, default="").split(",")
+    await db.execute(
+        _dialect_insert(db, model.User).on_conflict_do_nothing(index_elements=["uid"]),
+        [
+            {
+                "uid": row["uid"],
+                "email": row["email"],
+                "admin": row["uid"] in developers,
+            }
+            for row in rows
+        ],
+    )
+
+    uids = [row["uid"] for row in rows]
+    if invite:
+        imported = set(
+            (
+                await db.scalars(
+                    _dialect_insert(db, model.Invitation)
+                    .on_conflict_do_nothing()
+                    .returning(model.Invitation.uid),
+                    [
+                        {
+                            "uid": row["uid"],
+                            "course_id": course_id,
+                            "course_semester": course_semester,
+                            "role": row["role"],
+                        }
+                        for row in rows
+                    ],
+                )
+            ).all()
+        )
+    else:
+        imported = set(
+            (
+                await db.scalars(
+                    _dialect_insert(db, model.Enrollment)
+                    .on_conflict_do_nothing()
+                    .returning(model.Enrollment.uid),
+                    [
+                        {
+                            "uid": row["uid"],
+                            "course_id": course_id,
+                            "course_semester": course_semester,
+                            "role": row["role"],
+                        }
+                        for row in rows
+                    ],
+                )
+            ).all()
+        )
+        if imported:
+            await touch_course(db, course_id, course_semester)
+    await db.commit()
+
+    return [uid for uid in uids if uid not in imported]
+
+
 # --- Unit ---
 
 
-# Creates an unit
-def create_unit(
-    db: Session,
+# Creates an unit with an empty report
+async def create_unit(
+    db: AsyncSession,
     title: str,
     date_available: str,
     course_id: str,
     course_semester: str,
 ):
-    db_obj = model.Unit(
-        title=title,
-        date_available=date_available,
-        course_id=course_id,
-        course_semester=course_semester,
+    units = await create_units(
+        db,
+        course_id,
+        course_semester,
+        [{"title": title, "date_available": date_available}],
     )
+    return units[0]
 
-    db.add(db_obj)
-    db.commit()
-    db.refresh(db_obj)
 
-    new_unit = (
-        db.query(model.Unit)
-        .filter(
-            model.Unit.title == title and model.Unit.course_id == course_id,
-            model.Unit.course_semester == course_semester,
+# Creates units in a course, each with an empty report, with one INSERT for the units and one for the
+# reports in one transaction. The ids of the new units come from RETURNING
+async def create_units(
+    db: AsyncSession, course_id: str, course_semester: str, units: List[dict]
+):
+    db_units = (
+        await db.scalars(
+            insert(model.Unit).returning(model.Unit, sort_by_parameter_order=True),
+            [
+                {
+                    **unit,
+                    "course_id": course_id,
+                    "course_semester": course_semester,
+                }
+                for unit in units
+            ],
         )
-        .first()
-    )
-    report_obj = model.Report(
-        report_content=[],
-        course_id=course_id,
-        course_semester=course_semester,
-        unit_id=new_unit.id,
-    )
-    db.add(report_obj)
-    db.commit()
-    db.refresh(report_obj)
-    return db_obj
+    ).all()
+    db_reports = (
+        await db.scalars(
+            insert(model.Report).returning(model.Report, sort_by_parameter_order=True),
+            [
+                {
+                    "report_content": [],
+                    "unit_id": db_unit.id,
+                    "course_id": course_id,
+                    "course_semester": course_semester,
+                }
+                for db_unit in db_units
+            ],
+        )
+    ).all()
+    await touch_course(db, course_id, course_semester)
+    await db.commit()
+
+    # Sets the reports relationship, so the units can be serialized outside the session
+    reports = {db_report.unit_id: db_report for db_report in db_reports}
+    for db_unit in db_units:
+        set_committed_value(db_unit, "reports", [reports[db_unit.id]])
+    return db_units
 
 
 # Updates an unit
-def update_unit(
-    db: Session,
+async def update_unit(
+    db: AsyncSession,
     unit_id: int,
     title: str,
     date_available: str,
     course_id: str,
     course_semester: str,
 ):
-    db_obj = db.query(model.Unit).filter(model.Unit.id == unit_id).first()
+    db_obj = await db.scalar(select(model.Unit).where(model.Unit.id == unit_id))
     if db_obj:
+        # A unit moved to another course changes the units of both courses
+        if (db_obj.course_id, db_obj.course_semester) != (course_id, course_semester):
+            await touch_course(db, db_obj.course_id, db_obj.course_semester)
+            await touch_course(db, course_id, course_semester)
+        db_obj.version += 1
         db_obj.title = title
         db_obj.date_available = date_available
         db_obj.course_id = course_id
         db_obj.course_semester = course_semester
         db_obj.unit_id = unit_id
 
-        db.commit()
-        db.refresh(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
         return db_obj
     else:
         raise HTTPException(status_code=404, detail="Unit not found")
 
 
-# Deletes an unit
-def delete_unit(db: Session, unit_id: int, course_id: str, course_semester: str):
-    reflections = (
-        db.query(model.Reflection).filter(model.Reflection.unit_id == unit_id).all()
+# Deletes a unit with its reflections, reports and notification counts, with one DELETE per table in one transaction
+async def delete_unit(
+    db: AsyncSession, unit_id: int, course_id: str, course_semester: str
+):
+    unit = await get_unit(db, unit_id)
+    if unit is None:
+        raise HTTPException(status_code=404, detail="Unit not found")
+
+    await delete_records(db, model.Reflection, [model.Reflection.unit_id == unit_id])
+    await delete_records(
+        db,
+        model.UserUnitNotificationCount,
+        [model.UserUnitNotificationCount.unit_id == unit_id],
     )
-    report = get_report(db, course_id, unit_id, course_semester)
-    unit = db.query(model.Unit).filter(model.Unit.id == unit_id).first()
+    await delete_records(db, model.Report, [model.Report.unit_id == unit_id])
+    await delete_records(db, model.Unit, [model.Unit.id == unit_id])
+    await touch_course(db, unit.course_id, unit.course_semester)
+    await db.commit()
 
-    for reflection in reflections:
-        db.delete(reflection)
-    if report:
-        db.delete(report)
-    if unit:
-        db.delete(unit)
-        db.commit()
-        return unit
-    else:
-        raise HTTPException(status_code=404, detail="Unit not found")
+    return unit
 
 
 # Returns a single unit based on unit_id
-def get_unit(db: Session, unit_id: int):
-    return db.query(model.Unit).filter(model.Unit.id == unit_id).first()
+async def get_unit(db: AsyncSession, unit_id: int):
+    return await db.scalar(select(model.Unit).where(model.Unit.id == unit_id))
 
 
-# Returns multiple units that belongs to a course based on course_id, course_semester
-def get_units(db: Session, course_id: int, course_semester):
+# Returns a unit together with whether the question exists, in one query. Returns None if the unit does not exist
+async def get_unit_for_reflection(db: AsyncSession, unit_id: int, question_id: int):
+    question_exists = (
+        select(model.Question.id).where(model.Question.id == question_id).exists()
+    )
     return (
-        db.query(model.Unit)
-        .filter(
+        await db.execute(
+            select(model.Unit, question_exists.label("question_exists")).where(
+                model.Unit.id == unit_id
+            )
+        )
+    ).first()
+
+
+# Returns a unit together with the ids of its course's questions, in one query. Returns None if the unit
+# does not exist
+async def get_unit_with_question_ids(db: AsyncSession, unit_id: int):
+    rows = (
+        await db.execute(
+            select(model.Unit, model.CourseQuestion.question_id)
+            .outerjoin(
+                model.CourseQuestion,
+                and_(
+                    model.CourseQuestion.course_id == model.Unit.course_id,
+                    model.CourseQuestion.course_semester == model.Unit.course_semester,
+                ),
+            )
+            .where(model.Unit.id == unit_id)
+        )
+    ).all()
+    if not rows:
+        return None
+
+    return rows[0].Unit, {row.question_id for row in rows if row.question_id}
+
+
+# Returns multiple units that belongs to a course based on course_id, course_semester
+async def get_units(db: AsyncSession, course_id: int, course_semester):
+    result = await db.scalars(
+        select(model.Unit).where(
             model.Unit.course_id == course_id,
             model.Unit.course_semester == course_semester,
         )
-        .all()
     )
+    return result.all()
 
 
 # Returns all units
-def get_all_units(db: Session):
-    return db.query(model.Unit).all()
+async def get_all_units(db: AsyncSession):
+    return (await db.scalars(select(model.Unit))).all()
 
 
 # Returns all units that are available, regardless of course
-def get_all_available_units(db: Session):
+async def get_all_available_units(db: AsyncSession):
     current_date = datetime.utcnow().date()
-    return db.query(model.Unit).filter(model.Unit.date_available <= current_date).all()
+    result = await db.scalars(
+        select(model.Unit).where(model.Unit.date_available <= current_date)
+    )
+    return result.all()
+
+
+# Returns the units of a course together with the number of students that have reflected on each unit
+async def get_units_with_total_reflections(
+    db: AsyncSession, course_id: str, course_semester: str, include_hidden: bool = True
+):
+    query = (
+        select(model.Unit, func.count(distinct(model.Reflection.user_id)))
+        .outerjoin(model.Reflection, model.Reflection.unit_id == model.Unit.id)
+        .where(
+            model.Unit.course_id == course_id,
+            model.Unit.course_semester == course_semester,
+        )
+        .group_by(model.Unit.id)
+    )
+    if not include_hidden:
+        query = query.where(model.Unit.hidden == False)
+    return (await db.execute(query)).all()
+
+
+# Returns all reflections given in a unit
+async def get_unit_reflections(db: AsyncSession, unit_id: int):
+    result = await db.scalars(
+        select(model.Reflection).where(model.Reflection.unit_id == unit_id)
+    )
+    return result.all()
+
+
+# Streams every reflection of a course with its unit title and question, batch_size rows at a time from a
+# server-side cursor, so memory stays flat however many reflections the course has
+async def stream_course_reflections(
+    db: AsyncSession, course_id: str, course_semester: str, batch_size: int = 1000
+):
+    result = await db.stream(
+        select(
+            model.Reflection.unit_id,
+            model.Unit.title.label("unit_title"),
+            model.Reflection.question_id,
+            model.Question.comment.label("question"),
+            model.Reflection.user_id,
+            model.Reflection.timestamp,
+            model.Reflection.category,
+            model.Reflection.body,
+        )
+        .join(model.Unit, model.Unit.id == model.Reflection.unit_id)
+        .outerjoin(model.Question, model.Question.id == model.Reflection.question_id)
+        .where(*_in_course(course_id, course_semester, model.Unit))
+        .order_by(model.Reflection.unit_id, model.Reflection.id)
+        .execution_options(yield_per=batch_size)
+    )
+    async for reflection in result.mappings():
+        yield dict(reflection)
 
 
 # Creates a question that will be used in a unit reflection
-def create_question(db: Session, question: str, comment: str):
+async def create_question(db: AsyncSession, question: str, comment: str):
     db_obj = model.Question(question=question, comment=comment)
     print("Creating question")
     db.add(db_obj)
-    db.commit()
-    db.refresh(db_obj)
+    await db.commit()
+    await db.refresh(db_obj)
     return db_obj
 
 
 # --- Reflection ---
 
 
-# Creates a reflection
-def create_reflection(db: Session, reflection_data: dict):
-    db_obj = model.Reflection(**reflection_data, timestamp=datetime.now())
-    db.add(db_obj)
-    db.commit()
-    db.refresh(db_obj)
-
-    # Check if a reflection with the same unit_id and user_id already exists
-    existing_reflection_count = (
-        db.query(model.Reflection)
-        .filter(
-            model.Reflection.unit_id == reflection_data["unit_id"],
-            model.Reflection.user_id == reflection_data["user_id"],
+# Increments reflections_since_last_report of a unit if the given reflections are the user's first on it.
+# The counter is incremented by the database, so concurrent submissions do not overwrite each other's increment.
+# Under READ COMMITTED two answers of the same user to different questions would not see each other's
+# uncommitted row and would both count, so the unit row is locked first (FOR UPDATE is a no-op on SQLite,
+# which serializes writers anyway)
+async def _count_new_reflections(
+    db: AsyncSession, unit_id: int, user_id: str, reflection_ids: List[int]
+):
+    await db.execute(
+        select(model.Unit.id).where(model.Unit.id == unit_id).with_for_update()
+    )
+    earlier_reflection = (
+        select(model.Reflection.id)
+        .where(
+            model.Reflection.unit_id == unit_id,
+            model.Reflection.user_id == user_id,
+            model.Reflection.id.not_in(reflection_ids),
         )
-        .count()
+        .exists()
     )
-
-    # Increment reflections_since_last_report for the unit if this is the first reflection of its kind
-    if existing_reflection_count == 1:  # Includes the reflection we just added
-        unit = (
-            db.query(model.Unit)
-            .filter(model.Unit.id == reflection_data["unit_id"])
-            .first()
+    await db.execute(
+        update(model.Unit)
+        .where(model.Unit.id == unit_id, not_(earlier_reflection))
+        .values(
+            reflections_since_last_report=model.Unit.reflections_since_last_report + 1,
+            version=model.Unit.version + 1,
         )
-        if unit:
-            unit.reflections_since_last_report += 1
-            db.commit()
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Creates a reflection and counts it on the unit in the same transaction. A repeated answer to the same
+# question is rejected by the unique index on (unit_id, user_id, question_id) with an IntegrityError
+async def create_reflection(db: AsyncSession, reflection_data: dict):
+    db_obj = model.Reflection(**reflection_data, timestamp=date.today())
+    db.add(db_obj)
+    await db.flush()
+
+    await _count_new_reflections(db, db_obj.unit_id, db_obj.user_id, [db_obj.id])
+    await db.commit()
 
     return db_obj
 
 
+# Creates every answer of a user to a unit with one INSERT and counts them on the unit, in one transaction.
+# If any answer already exists, the IntegrityError rolls back all of them
+async def create_reflections(
+    db: AsyncSession, reflections: schemas.ReflectionBatchCreate
+):
+    timestamp = date.today()
+    db_objs = (
+        await db.scalars(
+            insert(model.Reflection).returning(model.Reflection),
+            [
+                {
+                    "body": answer.body,
+                    "user_id": reflections.user_id,
+                    "unit_id": reflections.unit_id,
+                    "question_id": answer.question_id,
+                    "timestamp": timestamp,
+                }
+                for answer in reflections.answers
+            ],
+        )
+    ).all()
+
+    await _count_new_reflections(
+        db,
+        reflections.unit_id,
+        reflections.user_id,
+        [db_obj.id for db_obj in db_objs],
+    )
+    await db.commit()
+
+    return db_objs
+
+
 # Resets the reflections count for a unit
-def reset_reflections_count(db: Session, unit_id: int):
-    unit = db.query(model.Unit).filter(model.Unit.id == unit_id).first()
+async def reset_reflections_count(db: AsyncSession, unit_id: int):
+    unit = await db.scalar(select(model.Unit).where(model.Unit.id == unit_id))
     if unit:
         unit.reflections_since_last_report = 0
-        db.commit()
+        unit.version += 1
+        await db.commit()
         print("Reflections count reset for Unit ID:", unit_id)
         return unit
     else:
@@ -364,21 +1048,23 @@ def reset_reflections_count(db: Session, unit_id: int):
 
 
 # Deletes a reflection the database
-def delete_reflection(db: Session, user_id: str, unit_id: int):
+async def delete_reflection(db: AsyncSession, user_id: str, unit_id: int):
     reflections = (
-        db.query(model.Reflection)
-        .filter(
-            model.Reflection.user_id == user_id, model.Reflection.unit_id == unit_id
+        await db.scalars(
+            select(model.Reflection).where(
+                model.Reflection.user_id == user_id,
+                model.Reflection.unit_id == unit_id,
+            )
         )
-        .all()
-    )
+    ).all()
 
     if not reflections:
         raise HTTPException(status_code=404, detail="Reflections not found")
 
     for reflection in reflections:
-        db.delete(reflection)
-    db.commit()
+        await db.delete(reflection)
+    await touch_unit(db, unit_id)
+    await db.commit()
     return {"user_id": user_id, "unit_id": unit_id}
 
 
@@ -386,99 +1072,116 @@ def delete_reflection(db: Session, user_id: str, unit_id: int):
 
 
 # Creates an invitation
-def create_invitation(db: Session, invitation: schemas.InvitationBase):
+async def create_invitation(db: AsyncSession, invitation: schemas.InvitationBase):
     db_obj = model.Invitation(**invitation)
     print("creating invitation")
     db.add(db_obj)
-    db.commit()
-    db.refresh(db_obj)
+    await db.commit()
+    await db.refresh(db_obj)
     return db_obj
 
 
 # Returns all invitations that match the uid
-def get_invitations(db: Session, uid: str):
-    return db.query(model.Invitation).filter(model.Invitation.uid == uid).all()
+async def get_invitations(db: AsyncSession, uid: str):
+    result = await db.scalars(
+        select(model.Invitation).where(model.Invitation.uid == uid)
+    )
+    return result.all()
 
 
 # TODO
-def get_priv_invitations_course(
-    db: Session, uid: str, course_id: str, course_semester: str
+async def get_priv_invitations_course(
+    db: AsyncSession, uid: str, course_id: str, course_semester: str
 ):
-    return (
-        db.query(model.Invitation)
-        .filter(
+    result = await db.scalars(
+        select(model.Invitation).where(
             model.Invitation.uid == uid,
             model.Invitation.course_id == course_id,
             model.Invitation.course_semester == course_semester,
             model.Invitation.role != "student",
         )
-        .all()
     )
+    return result.all()
 
 
 # Deletes an invitation to a course
-def delete_invitation(db: Session, id: int):
-    invitation = db.query(model.Invitation).filter(model.Invitation.id == id).first()
+async def delete_invitation(db: AsyncSession, id: int):
+    invitation = await db.scalar(
+        select(model.Invitation).where(model.Invitation.id == id)
+    )
     if invitation:
-        db.delete(invitation)
-        db.commit()
+        await db.delete(invitation)
+        await db.commit()
         return invitation
     else:
         raise HTTPException(status_code=404, detail="Invitation not found")
 
 
 # Returns the number of questions in a unit
-def get_number_of_unit_questions(db: Session, unit_id: int):
-    return (
-        db.query(model.Course.units)
-        .filter(model.Unit.id == unit_id)
-        .filter(model.Course.questions)
-        .count()
+async def get_number_of_unit_questions(db: AsyncSession, unit_id: int):
+    return await db.scalar(
+        select(func.count())
+        .select_from(model.CourseQuestion)
+        .join(
+            model.Unit,
+            (model.Unit.course_id == model.CourseQuestion.course_id)
+            & (model.Unit.course_semester == model.CourseQuestion.course_semester),
+        )
+        .where(model.Unit.id == unit_id)
     )
 
 
 # Returns a question used in a unit reflection
-def get_question(db: Session, question_id: int):
-    return db.query(model.Question).filter(model.Question.id == question_id).first()
+async def get_question(db: AsyncSession, question_id: int):
+    return await db.scalar(
+        select(model.Question).where(model.Question.id == question_id)
+    )
 
 
-# Returns a boolean indicating if a user has already reflected on a spesific question in a spesific unit
-def user_already_reflected_on_question(
-    db: Session, unit_id: int, user_id: int, question_id
+# Returns a report based on course_id, unit_id, and course_semester
+async def get_report(
+    db: AsyncSession, course_id: str, unit_id: int, course_semester: str
 ):
-    existing_reflection = (
-        db.query(model.Reflection)
-        .filter(
-            model.Reflection.unit_id == unit_id,
-            model.Reflection.user_id == user_id,
-            model.Reflection.question_id == question_id,
-        )
-        .first()
+    return await db.scalar(
+        select(model.Report)
+        .where(model.Report.unit_id == unit_id)
+        .where(model.Report.course_id == course_id)
+        .where(model.Report.course_semester == course_semester)
+        .limit(1)
     )
 
-    return existing_reflection is not None
-
 
-# Returns a report based on course_id, unit_id, and course_semester
-def get_report(db: Session, course_id: str, unit_id: int, course_semester: str):
-    return (
-        db.query(model.Report)
-        .filter(model.Report.unit_id == unit_id)
-        .filter(model.Report.course_id == course_id)
-        .filter(model.Report.course_semester == course_semester)
-        .first()
+# Streams the generated reports of a course with their unit title, from a server-side cursor
+async def stream_course_reports(
+    db: AsyncSession, course_id: str, course_semester: str, batch_size: int = 100
+):
+    result = await db.stream(
+        select(
+            model.Report.unit_id,
+            model.Unit.title.label("unit_title"),
+            model.Report.number_of_answers,
+            model.Report.report_content,
+        )
+        .join(model.Unit, model.Unit.id == model.Report.unit_id)
+        .where(*_in_course(course_id, course_semester, model.Report))
+        .order_by(model.Report.unit_id)
+        .execution_options(yield_per=batch_size)
     )
+    async for report in result.mappings():
+        # Reports are created empty with their unit, and only have content once they are generated
+        if isinstance(report["report_content"], dict) and report["report_content"]:
+            yield dict(report)
 
 
 # Saves or updates a report in the database
-def save_report(db: Session, report: schemas.ReportCreate) -> model.Report:
-    existing_report = (
-        db.query(model.Report)
-        .filter(
+async def save_report(db: AsyncSession, report: schemas.ReportCreate) -> model.Report:
+    existing_report = await db.scalar(
+        select(model.Report)
+        .where(
             model.Report.course_id == report.get("course_id"),
             model.Report.unit_id == report.get("unit_id"),
         )
-        .first()
+        .limit(1)
     )
 
     if existing_report:
@@ -488,134 +1191,240 @@ def save_report(db: Session, report: schemas.ReportCreate) -> model.Report:
     else:
         db_obj = model.Report(**report)
         db.add(db_obj)
+    await touch_unit(db, report.get("unit_id"))
 
-    db.commit()
-    db.refresh(db_obj)
+    await db.commit()
+    await db.refresh(db_obj)
     return db_obj
 
 
 # Checks if a notification has been sent within a specified cooldown period
-def check_recent_notification(db: Session, cooldown_days: int) -> bool:
+async def check_recent_notification(db: AsyncSession, cooldown_days: int) -> bool:
     cooldown_date = datetime.utcnow().date() - timedelta(days=cooldown_days)
     return (
-        db.query(model.NotificationLog)
-        .filter(model.NotificationLog.sent_at > cooldown_date)
-        .first()
+        await db.scalar(
+            select(model.NotificationLog)
+            .where(model.NotificationLog.sent_at > cooldown_date)
+            .limit(1)
+        )
         is not None
     )
 
 
 # Creates a new notification log entry in the database with the current UTC time
-def create_notification_log(db: Session):
+async def create_notification_log(db: AsyncSession):
     new_log = model.NotificationLog(sent_at=datetime.utcnow())
 
     db.add(new_log)
-    db.commit()
-    db.refresh(new_log)
+    await db.commit()
+    await db.refresh(new_log)
 
     return new_log
 
 
-# Adds a notification count for a specific user and unit
-def add_notification_count(db: Session, user_id: str, unit_id: int):
-    notification_entry = (
-        db.query(model.UserUnitNotificationCount)
-        .filter_by(user_id=user_id, unit_id=unit_id)
-        .first()
+# Adds one to the notification count of every (user_id, unit_id) pair with one bulk upsert,
+# without committing so the caller decides the transaction
+async def _increment_notification_counts(
+    db: AsyncSession, notified: List[Tuple[str, int]]
+):
+    if not notified:
+        return
+    upsert = _dialect_insert(db, model.UserUnitNotificationCount).on_conflict_do_update(
+        index_elements=["user_id", "unit_id"],
+        set_={
+            "notification_count": model.UserUnitNotificationCount.notification_count + 1
+        },
+    )
+    await db.execute(
+        upsert,
+        [
+            {"user_id": user_id, "unit_id": unit_id, "notification_count": 1}
+            for user_id, unit_id in notified
+        ],
     )
 
-    if notification_entry:
-        notification_entry.notification_count += 1
-    else:
-        notification_entry = model.UserUnitNotificationCount(
-            user_id=user_id, unit_id=unit_id, notification_count=1
-        )
-        db.add(notification_entry)
-
-    db.commit()
-
-    return notification_entry
 
+# Queues a notification round: creates a job with one outbox message per recipient, and saves the
+# notification counts and the notification log in the same transaction
+async def enqueue_notifications(db: AsyncSession, messages: List[dict]):
+    job = model.NotificationJob()
+    db.add(job)
+    await db.flush()
 
-# Retrieves the notification count for a specific user and unit
-def get_notification_count(db: Session, user_id: str, unit_id: int) -> int:
-    notification_entry = (
-        db.query(model.UserUnitNotificationCount)
-        .filter_by(user_id=user_id, unit_id=unit_id)
-        .first()
+    if messages:
+        await db.execute(
+            insert(model.NotificationOutbox),
+            [{**message, "job_id": job.id} for message in messages],
+        )
+    await _increment_notification_counts(
+        db,
+        [
+            (message["user_id"], unit_id)
+            for message in messages
+            for unit_id in message["unit_ids"]
+        ],
     )
+    db.add(model.NotificationLog(sent_at=datetime.utcnow()))
+    await db.commit()
+
+    return job
+
+
+# Claims up to batch_size pending outbox messages that are due. The claimed messages are leased
+# for lease_seconds, so other workers skip them and they are retried if this worker crashes
+async def claim_outbox_messages(
+    db: AsyncSession, batch_size: int, lease_seconds: int
+) -> List[model.NotificationOutbox]:
+    now = datetime.utcnow()
+    messages = (
+        await db.scalars(
+            select(model.NotificationOutbox)
+            .where(
+                model.NotificationOutbox.status == "pending",
+                model.NotificationOutbox.next_attempt_at <= now,
+            )
+            .order_by(model.NotificationOutbox.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+    ).all()
 
-    if notification_entry:
-        return notification_entry.notification_count
-    else:
-        return 0
+    for message in messages:
+        message.next_attempt_at = now + timedelta(seconds=lease_seconds)
+    await db.commit()
 
+    return messages
 
-# Retrieves all courses from the database
-def get_all_courses(db: Session):
-    return db.query(model.Course).all()
 
+# Saves the outcome of sending claimed outbox messages. A failed message is retried with exponential
+# backoff until max_attempts is reached, then it is marked as failed
+async def complete_outbox_messages(
+    db: AsyncSession,
+    results: List[Tuple[model.NotificationOutbox, Exception]],
+    max_attempts: int,
+    backoff_seconds: int,
+):
+    now = datetime.utcnow()
+    for message, error in results:
+        message.attempts += 1
+        if error is None:
+            message.status = "sent"
+            message.sent_at = now
+            message.last_error = None
+        else:
+            message.last_error = str(error)
+            if message.attempts >= max_attempts:
+                message.status = "failed"
+            else:
+                message.next_attempt_at = now + timedelta(
+                    seconds=backoff_seconds * 2 ** (message.attempts - 1)
+                )
+        db.add(message)
+    await db.commit()
+
+
+# Retrieves a notification job with the number of outbox messages per status and the failed messages
+async def get_notification_job_status(db: AsyncSession, job_id: int):
+    job = await db.get(model.NotificationJob, job_id)
+    if job is None:
+        return None
 
-# Retrieves all students enrolled in a specific course and semester
-def get_all_students_in_course(db: Session, course_id: str, course_semester: str):
-    users_in_course = (
-        db.query(model.User)
-        .join(model.Enrollment)
-        .filter(
-            model.Enrollment.course_id == course_id,
-            model.Enrollment.course_semester == course_semester,
-            model.Enrollment.role == "student",
-        )
-        .all()
+    counts = dict(
+        (
+            await db.execute(
+                select(model.NotificationOutbox.status, func.count())
+                .where(model.NotificationOutbox.job_id == job_id)
+                .group_by(model.NotificationOutbox.status)
+            )
+        ).all()
     )
+    failed = (
+        await db.scalars(
+            select(model.NotificationOutbox)
+            .where(
+                model.NotificationOutbox.job_id == job_id,
+                model.NotificationOutbox.status == "failed",
+            )
+            .order_by(model.NotificationOutbox.id)
+        )
+    ).all()
 
-    return users_in_course
+    return job, counts, failed
 
 
-# Retrieves units for which a user should be notified, based on a specific course and semester
-def get_units_to_notify(
-    db: Session,
-    user_id: str,
-    notification_limit: int,
-    course_id: str,
-    course_semester: str,
-):
-    subquery = (
-        db.query(model.Reflection.unit_id)
-        .filter(
+# Retrieves all courses from the database
+async def get_all_courses(db: AsyncSession):
+    return (await db.scalars(select(model.Course))).all()
+
+
+# Plans all reminder emails with one query: every student, per course, with the available units
+# they have not reflected on and have been reminded about fewer than notification_limit times
+async def get_notification_recipients(db: AsyncSession, notification_limit: int):
+    reflected = (
+        select(model.Reflection.id)
+        .where(
             model.Reflection.unit_id == model.Unit.id,
-            model.Reflection.user_id == user_id,
+            model.Reflection.user_id == model.User.uid,
         )
         .exists()
     )
 
-    available_units = (
-        db.query(model.Unit)
-        .filter(
-            model.Unit.course_id == course_id,
-            model.Unit.course_semester == course_semester,
-            model.Unit.hidden == False,
-            model.Unit.date_available <= date.today(),
-            not_(subquery),
-        )
-        .all()
-    )
-
-    units_to_notify = []
-    for unit in available_units:
-        notification_count = (
-            db.query(model.UserUnitNotificationCount)
-            .filter(
-                model.UserUnitNotificationCount.user_id == user_id,
-                model.UserUnitNotificationCount.unit_id == unit.id,
+    rows = (
+        await db.execute(
+            select(model.User.uid, model.User.email, model.Unit)
+            .join(model.Enrollment, model.Enrollment.uid == model.User.uid)
+            .join(
+                model.Unit,
+                and_(
+                    model.Unit.course_id == model.Enrollment.course_id,
+                    model.Unit.course_semester == model.Enrollment.course_semester,
+                ),
+            )
+            .outerjoin(
+                model.UserUnitNotificationCount,
+                and_(
+                    model.UserUnitNotificationCount.user_id == model.User.uid,
+                    model.UserUnitNotificationCount.unit_id == model.Unit.id,
+                ),
+            )
+            .where(
+                model.Enrollment.role == "student",
+                model.Unit.hidden == False,
+                model.Unit.date_available <= date.today(),
+                not_(reflected),
+                or_(
+                    model.UserUnitNotificationCount.notification_count == None,
+                    model.UserUnitNotificationCount.notification_count
+                    < notification_limit,
+                ),
+            )
+            .order_by(
+                model.Unit.course_id,
+                model.Unit.course_semester,
+                model.User.uid,
+                model.Unit.id,
             )
-            .first()
+        )
+    ).all()
+
+    recipients = []
+    for (course_id, course_semester, uid, email), group in groupby(
+        rows,
+        key=lambda row: (
+            row.Unit.course_id,
+            row.Unit.course_semester,
+            row.uid,
+            row.email,
+        ),
+    ):
+        recipients.append(
+            {
+                "uid": uid,
+                "email": email,
+                "course_id": course_id,
+                "course_semester": course_semester,
+                "units": [row.Unit for row in group],
+            }
         )
 
-        if (
-            not notification_count
-            or notification_count.notification_count < notification_limit
-        ):
-            units_to_notify.append(unit)
-
-    return units_to_notify
+    return recipients
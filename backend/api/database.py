@@ -1,5 +1,7 @@
 # import databases
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from starlette.config import Config
@@ -10,16 +12,28 @@ from starlette.datastructures import Secret
 config = Config(".env")
 
 if config("production", cast=bool, default=False):
-    DATABASE_URI = str(config("DATABASE_URI", cast=Secret))
-    engine = create_engine(DATABASE_URI)
+    DATABASE_URL = str(config("DATABASE_URI", cast=Secret))
+    engine = create_engine(DATABASE_URL)
+    # The API talks to the database through asyncpg, so queries do not block the event loop
+    async_engine = create_async_engine(
+        make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+    )
 else:
     if config("TEST", cast=bool, default=False):
         DATABASE_URL = "sqlite:///./test.db"
     else:
         DATABASE_URL = "sqlite:///./reflect.db"
     engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(
+        make_url(DATABASE_URL).set(drivername="sqlite+aiosqlite")
+    )
 
 
+# Synchronous sessions are only used for migrations and scripts, the API uses AsyncSessionLocal
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 Base = declarative_base()
@@ -1,23 +1,35 @@
 import json
-import os
 from datetime import datetime, date
 from typing import List
 
 import requests
 from requests.structures import CaseInsensitiveDict
 from api.utils.exceptions import DataProcessingError, OpenAIRequestError
+from api.utils.cache import cache
+from api.utils.etag import make_etag, not_modified
+from api.utils.responses import ORJSONResponse, rows_response
+from api.utils.export import (
+    EXPORT_FORMATS,
+    REPORT_FORMATS,
+    content_disposition,
+    gzip_stream,
+)
+from api.utils.roster import read_roster
 from prompting.enforceUniqueCategories import enforce_unique_categories
-from prompting.summary import createSummary
+from prompting.summary import createSummaryAsync
 from prompting.transformKeysToAnswers import transformKeysToAnswers
-from prompting.sort import sort
-from prompting.createCategories import createCategories
+from prompting.sort import sortAsync, sortPerQuestionAsync
+from prompting.createCategories import createCategoriesChunkedAsync
+from prompting.cache import responses as openai_responses
+from prompting.clients import clients as openai_clients
 
 from . import crud
+from .auth import AuthContext
 from . import model
 from . import schemas
 
 from authlib.integrations.starlette_client import OAuth, OAuthError
-from .database import SessionLocal, engine
+from .database import AsyncSessionLocal, engine
 from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
@@ -25,18 +37,19 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import JSONResponse
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from starlette.config import Config
 from starlette.datastructures import Secret
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.responses import RedirectResponse, Response, JSONResponse
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 
 model.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 config = Config(".env")
 oauth = OAuth(config)
 
@@ -47,6 +60,11 @@ CLIENT_SECRET = str(config("client_secret", cast=Secret))
 
 NOTIFICATION_COOLDOWN_DAYS = config("NOTIFICATION_COOLDOWN_DAYS", cast=int, default=1)
 NOTIFICATION_LIMIT = config("NOTIFICATION_LIMIT", cast=int, default=2)
+# Number of roster rows saved per transaction by /import_roster
+ROSTER_BATCH_SIZE = config("ROSTER_BATCH_SIZE", cast=int, default=500)
+# Generated reports sort the answers to each question in a request of its own, SORT_CONCURRENCY at a time
+SORT_PER_QUESTION = config("SORT_PER_QUESTION", cast=bool, default=True)
+SORT_CONCURRENCY = config("SORT_CONCURRENCY", cast=int, default=4)
 
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
 
@@ -58,19 +76,6 @@ app.add_middleware(
     allow_methods=["*"],
 )
 
-email_config = ConnectionConfig(
-    MAIL_USERNAME=config("MAIL_USERNAME", cast=str, default=""),
-    MAIL_PASSWORD=config("MAIL_PASSWORD", cast=str, default=""),
-    MAIL_FROM=config("MAIL_FROM", cast=str, default="test@test.no"),
-    MAIL_PORT=config("MAIL_PORT", cast=int, default=587),
-    MAIL_SERVER=config("MAIL_SERVER", cast=str, default=""),
-    MAIL_FROM_NAME="Reflection Tool",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=False,
-    VALIDATE_CERTS=False,
-)
-
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -87,14 +92,10 @@ else:
     BASE_URL = "http://127.0.0.1:5173"
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
 
-    finally:
-        db.close()
-
 
 oauth.register(
     name="feide",
@@ -130,18 +131,11 @@ def protect_route(request: Request):
         raise HTTPException(401, detail="You are not logged in")
 
 
-def is_admin(db, request):
-    if config("isAdmin", cast=bool, default=False):
-        return True
-
-    user = request.session.get("user")
-    if user is None:
-        return False
-    uid: str = user.get("uid")
-    user = crud.get_user(db, uid)
-    if user is None:
-        return False
-    return user.admin
+async def get_auth(request: Request, db: AsyncSession = Depends(get_db)) -> AuthContext:
+    """
+    Resolves the logged in user, their admin flag and enrollments once per request, see AuthContext.
+    """
+    return AuthContext(db, request)
 
 
 def check_is_admin(bearer_token):
@@ -172,6 +166,14 @@ def check_is_admin(bearer_token):
     return False
 
 
+@app.on_event("shutdown")
+async def close_openai_clients():
+    """
+    Closes the connections of the shared OpenAI clients.
+    """
+    await openai_clients.aclose()
+
+
 @app.on_event("startup")
 async def start_db():
     """
@@ -186,12 +188,13 @@ async def start_db():
     course_id: str = "TDT4100"
     semester: str = "fall2023"
     course_name: str = "Informasjonsteknologi grunnkurs"
-    db = SessionLocal()
-    course = crud.get_course(db, course_id=course_id, course_semester=semester)
+    db = AsyncSessionLocal()
+    course = await crud.get_course(db, course_id=course_id, course_semester=semester)
     if course:
+        await db.close()
         return
 
-    course = crud.create_course(
+    course = await crud.create_course(
         db,
         course={
             "name": course_name,
@@ -204,26 +207,26 @@ async def start_db():
     UID = config("UID", cast=str, default="test")
     EMAIL_USER = config("EMAIL_USER", cast=str, default="test@test.no")
 
-    user = crud.create_user(db, uid=UID, user_email=EMAIL_USER)
-    user0 = crud.create_user(db, uid="test2", user_email="test2@test.no")
-    user1 = crud.create_user(db, uid="test3", user_email="test3@test.no")
+    user = await crud.create_user(db, uid=UID, user_email=EMAIL_USER)
+    user0 = await crud.create_user(db, uid="test2", user_email="test2@test.no")
+    user1 = await crud.create_user(db, uid="test3", user_email="test3@test.no")
 
     units = [
-        crud.create_unit(
+        await crud.create_unit(
             db=db,
             title="State Machines",
             date_available=datetime(2022, 8, 23),
             course_id=course.id,
             course_semester=semester,
         ),
-        crud.create_unit(
+        await crud.create_unit(
             db=db,
             title="HTTP og JSON",
             date_available=datetime(2022, 8, 30),
             course_id=course.id,
             course_semester=semester,
         ),
-        crud.create_unit(
+        await crud.create_unit(
             db=db,
             title="MQTT Chat",
             date_available=datetime(2024, 9, 7),
@@ -232,11 +235,6 @@ async def start_db():
         ),
     ]
 
-    for u in units:
-        course.units.append(u)
-        u.course_id = course.id
-        u.course_semester = semester
-
     await crud.create_enrollment(
         db=db,
         course_id="TDT4100",
@@ -245,8 +243,8 @@ async def start_db():
         uid=UID,
     )
 
-    db.commit()
-    db.close()
+    await db.commit()
+    await db.close()
 
 
 @app.get("/login")
@@ -255,7 +253,7 @@ async def login(request: Request):
 
 
 @app.get("/auth")
-async def auth(request: Request, db: Session = Depends(get_db)):
+async def auth(request: Request, db: AsyncSession = Depends(get_db)):
     """
     This is the callback route for the OAuth2 authentication process.
     It retrieves the access token from the request and stores it in the user's session.
@@ -284,10 +282,10 @@ async def auth(request: Request, db: Session = Depends(get_db)):
         request.session["user"] = user
         email = user.get("mail")
         uid = user.get("uid")
-        db_user = crud.get_user(db, uid)
+        db_user = await crud.get_user(db, uid)
         if not db_user:
             print("creating user")
-            crud.create_user(
+            await crud.create_user(
                 db=db, uid=uid, user_email=email, admin=check_is_admin(bearer_token)
             )
         else:
@@ -305,46 +303,92 @@ async def logout(request: Request):
 
 @app.post("/reflection", response_model=schemas.Reflection)
 async def create_reflection(
-    request: Request, ref: schemas.ReflectionCreate, db: Session = Depends(get_db)
+    request: Request, ref: schemas.ReflectionCreate, db: AsyncSession = Depends(get_db)
 ):
     """
     Creates a reflection based on the data provided in the `ref` object.
     This saves the response a user has given to a question in a unit.
+
+    The unit and question are validated with one query, and the reflection is saved and counted on the unit
+    in one transaction. A second answer to the same question is rejected by a unique index.
     """
     protect_route(request)
 
-    unit = crud.get_unit(db, ref.unit_id)
-    if unit is None:
+    row = await crud.get_unit_for_reflection(db, ref.unit_id, ref.question_id)
+    if row is None:
         raise HTTPException(404, detail="Unit cannot be found")
+    unit, question_exists = row
 
-    if crud.get_question(db, ref.question_id) is None:
+    if not question_exists:
         raise HTTPException(404, detail="Question cannot be found")
 
     if unit.hidden:
         raise HTTPException(403, detail="Unit cannot be reflected when hidden")
 
-    if crud.user_already_reflected_on_question(
-        db, ref.unit_id, ref.user_id, ref.question_id
-    ):
+    if unit.date_available > date.today():
+        raise HTTPException(403, detail="This unit is not available")
+
+    try:
+        return await crud.create_reflection(db, reflection_data=ref.dict())
+    except IntegrityError:
         raise HTTPException(403, detail="You have already reflected this question")
 
+
+@app.post("/reflections", response_model=List[schemas.Reflection])
+async def create_reflections(
+    request: Request,
+    ref: schemas.ReflectionBatchCreate,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Creates all reflections of a user to a unit based on the data provided in the `ref` object.
+    This saves the answers a user has given to the questions of a unit in one request.
+
+    The answers are validated once against the questions of the unit's course and saved in one transaction,
+    so either every answer is saved or none of them are.
+    """
+    protect_route(request)
+
+    result = await crud.get_unit_with_question_ids(db, ref.unit_id)
+    if result is None:
+        raise HTTPException(404, detail="Unit cannot be found")
+    unit, question_ids = result
+
+    if not ref.answers:
+        raise HTTPException(400, detail="No answers were given")
+
+    answered = [answer.question_id for answer in ref.answers]
+    if len(set(answered)) != len(answered):
+        raise HTTPException(400, detail="A question can only be answered once")
+
+    if not set(answered) <= question_ids:
+        raise HTTPException(404, detail="Question cannot be found")
+
+    if unit.hidden:
+        raise HTTPException(403, detail="Unit cannot be reflected when hidden")
+
     if unit.date_available > date.today():
         raise HTTPException(403, detail="This unit is not available")
 
-    return crud.create_reflection(db, reflection_data=ref.dict())
+    try:
+        return await crud.create_reflections(db, ref)
+    except IntegrityError:
+        raise HTTPException(403, detail="You have already reflected this question")
 
 
 @app.delete("/delete_reflection", response_model=schemas.ReflectionDelete)
 async def delete_reflection(
-    request: Request, ref: schemas.ReflectionDelete, db: Session = Depends(get_db)
+    ref: schemas.ReflectionDelete,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Deletes a reflection based on the user ID, unit ID, and question ID provided in the `ref` object.
     """
-    protect_route(request)
+    auth.require_login()
 
-    if is_admin(db, request):
-        return crud.delete_reflection(db, ref.user_id, ref.unit_id)
+    if await auth.is_admin():
+        return await crud.delete_reflection(db, ref.user_id, ref.unit_id)
     else:
         raise HTTPException(
             403, detail="You do not have permission to delete this reflection"
@@ -355,26 +399,37 @@ async def delete_reflection(
 @app.get("/course", response_model=schemas.Course)
 async def course(
     request: Request,
+    response: Response,
     course_id: str,
     course_semester: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Retrieves a course based on the course ID and course semester provided.
+
+    Answers 304 to If-None-Match with the ETag of the course, which changes with the versions of the course
+    and its units, without loading the course.
     """
     protect_route(request)
 
-    course = crud.get_course(db, course_id=course_id, course_semester=course_semester)
-    if course is None:
+    versions = await crud.get_course_versions(db, course_id, course_semester)
+    if versions is None:
         raise HTTPException(404, detail="Course not found")
+    cached = not_modified(
+        request, response, make_etag("course", course_id, course_semester, *versions)
+    )
+    if cached is not None:
+        return cached
 
-    print("course found")
-    print(course)
-    return course
+    # Built from column rows and written with orjson, as validating every enrollment is slow for large courses
+    course = await crud.get_course_rows(db, course_id, course_semester)
+    if course is None:
+        raise HTTPException(404, detail="Course not found")
+    return rows_response(course, response)
 
 
 @app.get("/user", response_model=schemas.User)
-async def user(request: Request, db: Session = Depends(get_db)):
+async def user(request: Request, db: AsyncSession = Depends(get_db)):
     """
     Retrieves the user's data based on the user ID stored in the session.
 
@@ -384,31 +439,26 @@ async def user(request: Request, db: Session = Depends(get_db)):
 
     user = request.session.get("user")
     uid: str = user.get("uid")
-    user = crud.get_user(db, uid)
-
-    for enrollment in user.enrollments:
-        course = crud.get_course(db, enrollment.course_id, enrollment.course_semester)
-        enrollment.course_name = course.name
-        if enrollment.role not in ["lecturer", "teaching assistant"]:
-            today = datetime.now().date()
-            enrollment.missingUnits = [
-                {"id": unit.id, "date": unit.date_available}
-                for unit in crud.get_units_for_course(
-                    db, enrollment.course_id, enrollment.course_semester
-                )
-                if unit.date_available and unit.date_available <= today
-            ]
-            reflected_units = {reflection.unit_id for reflection in user.reflections}
-            enrollment.missingUnits = [
-                unit
-                for unit in enrollment.missingUnits
-                if unit["id"] not in reflected_units
-            ]
+    user = await crud.get_user_with_relations(db, uid)
 
     if user == None:
         request.session.pop("user")
         raise HTTPException(404, detail="User not found")
 
+    # Missing units for all courses are found in one query, instead of one per enrollment
+    missing_units = {}
+    for unit in await crud.get_missing_units_for_user(db, uid):
+        missing_units.setdefault((unit.course_id, unit.course_semester), []).append(
+            {"id": unit.id, "date": unit.date_available}
+        )
+
+    for enrollment in user.enrollments:
+        enrollment.course_name = enrollment.course.name
+        if enrollment.role not in ["lecturer", "teaching assistant"]:
+            enrollment.missingUnits = missing_units.get(
+                (enrollment.course_id, enrollment.course_semester), []
+            )
+
     if config("isAdmin", cast=bool, default=False):
         user.admin = True
 
@@ -417,73 +467,89 @@ async def user(request: Request, db: Session = Depends(get_db)):
 
 @app.post("/create_course", response_model=schemas.Enrollment)
 async def create_course(
-    request: Request, ref: schemas.CourseCreate, db: Session = Depends(get_db)
+    ref: schemas.CourseCreate,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
-    Creates a course based on the data provided in the `ref` object.
+    Creates a course based on the data provided in the `ref` object, and enrolls the user as lecturer.
+
+    The course, its questions and the enrollment are saved in one transaction with bulk inserts.
     """
-    protect_route(request)
-    user = request.session.get("user")
-    uid: str = user.get("uid")
+    auth.require_login()
+    uid = auth.uid
 
-    if not is_admin(db, request):
+    if not await auth.is_admin():
         raise HTTPException(403, detail="You are not an admin user")
     try:
-        crud.create_course(db, course=ref.dict())
-        return await crud.create_enrollment(
-            db,
-            role="lecturer",
-            course_id=ref.id,
-            course_semester=ref.semester,
-            uid=uid,
+        await crud.create_course(db, course=ref.dict(), lecturer_uid=uid)
+        return schemas.Enrollment(
+            uid=uid, course_id=ref.id, course_semester=ref.semester, role="lecturer"
         )
 
     except IntegrityError:
         raise HTTPException(409, detail="Course already exists")
 
 
+@app.post("/clone_course", response_model=schemas.Enrollment)
+async def clone_course(
+    ref: schemas.CourseClone,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Clones a course into `ref.new_semester` with the same questions and units, where the units are available
+    `ref.date_offset_days` days later than in the original course. The user is enrolled as lecturer.
+
+    The course is copied on the database server with INSERT ... SELECT statements in one transaction.
+    """
+    auth.require_login()
+    uid = auth.uid
+
+    if not await auth.is_admin():
+        raise HTTPException(403, detail="You are not an admin user")
+    if await crud.get_course(db, ref.id, ref.semester) is None:
+        raise HTTPException(404, detail="Course not found")
+    try:
+        await crud.clone_course(
+            db, ref.id, ref.semester, ref.new_semester, ref.date_offset_days, uid
+        )
+    except IntegrityError:
+        raise HTTPException(409, detail="Course already exists")
+
+    return schemas.Enrollment(
+        uid=uid, course_id=ref.id, course_semester=ref.new_semester, role="lecturer"
+    )
+
+
 # enroll self in course
 @app.post("/enroll", response_model=schemas.Enrollment)
 async def enroll(
-    request: Request, ref: schemas.EnrollmentCreate, db: Session = Depends(get_db)
+    ref: schemas.EnrollmentCreate,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Enrolls a user in a course based on the data provided in the `ref` object.
     This will also enroll a user if they have a private invitation to the course.
     """
-    protect_route(request)
+    auth.require_login()
 
-    course = crud.get_course(
+    course = await crud.get_course(
         db, course_id=ref.course_id, course_semester=ref.course_semester
     )
 
     if course == None:
         raise HTTPException(404, detail="Course not found")
 
-    user = request.session.get("user")
-    uid: str = user.get("uid")
-    if user is None:
-        raise HTTPException(401, detail="Cannot find your user")
-
-    invitations = crud.get_invitations(db, uid)
-    if invitations is not None:
-        priv_inv = crud.get_priv_invitations_course(
+    uid = auth.uid
+    if (
+        ref.role == "student"
+        or await crud.get_priv_invitations_course(
             db, uid, ref.course_id, ref.course_semester
         )
-        if len(priv_inv) != 0 or is_admin(db, request):
-            try:
-
-                return await crud.create_enrollment(
-                    db,
-                    role=ref.role,
-                    course_id=ref.course_id,
-                    course_semester=ref.course_semester,
-                    uid=uid,
-                )
-            except IntegrityError:
-                raise HTTPException(409, detail="User already enrolled in this course")
-
-    if ref.role == "student" or is_admin(db, request):
+        or await auth.is_admin()
+    ):
         try:
             return await crud.create_enrollment(
                 db,
@@ -502,79 +568,75 @@ async def enroll(
 @app.get("/units", response_model=List[schemas.Unit])
 async def get_units(
     request: Request,
+    response: Response,
     course_id: str,
     course_semester: str,
-    db: Session = Depends(get_db),
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Retrieves all units for a specific course based on the course ID and course semester provided.
     If a user is not enrolled in the course, they will be enrolled as a student.
 
     And if they are a lecturer or teaching assistant, they will see all units including the hidden ones.
+
+    Answers 304 to If-None-Match with the ETag of the units, which changes with the versions of the course
+    and its units.
     """
-    protect_route(request)
+    auth.require_login()
 
-    user = request.session.get("user")
-    uid: str = user.get("uid")
-    course = crud.get_course(db, course_id, course_semester)
-    if course is None:
+    versions = await crud.get_course_versions(db, course_id, course_semester)
+    if versions is None:
         raise HTTPException(404, detail="Course not found")
 
-    enrollment = crud.get_enrollment(db, course_id, course_semester, uid)
+    enrollment = await auth.enrollment(course_id, course_semester)
     if enrollment is None:
-        await crud.create_enrollment(
+        enrollment = await crud.create_enrollment(
             db,
             role="student",
             course_id=course_id,
             course_semester=course_semester,
-            uid=uid,
-        )
-        enrollment = crud.get_enrollment(db, course_id, course_semester, uid)
-        if enrollment is None:
-            raise HTTPException(401, detail="You are not enrolled in the course")
-
-    if is_admin(db, request) or enrollment.role in ["lecturer", "teaching assistant"]:
-        units = (
-            db.query(model.Unit)
-            .filter(
-                model.Unit.course_id == course_id,
-                model.Unit.course_semester == course_semester,
-            )
-            .all()
-        )
-        units = [unit.to_dict() for unit in units]
-        return units
-    else:
-        units = (
-            db.query(model.Unit)
-            .filter(
-                model.Unit.course_id == course_id,
-                model.Unit.course_semester == course_semester,
-                model.Unit.hidden == False,
-            )
-            .all()
+            uid=auth.uid,
         )
+        versions = await crud.get_course_versions(db, course_id, course_semester)
+
+    # Lecturers and teaching assistants also see the hidden units
+    include_hidden = await auth.is_admin() or enrollment.role in [
+        "lecturer",
+        "teaching assistant",
+    ]
+    cached = not_modified(
+        request,
+        response,
+        make_etag("units", course_id, course_semester, *versions, include_hidden),
+    )
+    if cached is not None:
+        return cached
 
-        units = [unit.to_dict() for unit in units]
-        return units
+    units = await crud.get_units_with_total_reflections(
+        db, course_id, course_semester, include_hidden=include_hidden
+    )
+    return [unit.to_dict(total_reflections) for unit, total_reflections in units]
 
 
 @app.post("/create_unit", response_model=schemas.Unit)
 async def create_unit(
-    request: Request, ref: schemas.UnitCreate, db: Session = Depends(get_db)
+    ref: schemas.UnitCreate,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Creates a new unit with the unit-details from the 'ref' object, if the user-details provided in `ref` is admin.
     """
-    protect_route(request)
+    auth.require_login()
 
-    user = request.session.get("user")
-    uid: str = user.get("uid")
-    enrollment = crud.get_enrollment(db, ref.course_id, ref.course_semester, uid)
+    enrollment = await auth.enrollment(ref.course_id, ref.course_semester)
     if enrollment is None:
         raise HTTPException(401, detail="You are not enrolled in the course")
-    if is_admin(db, request) or enrollment.role in ["lecturer", "teaching assistant"]:
-        return crud.create_unit(
+    if await auth.has_role(
+        ref.course_id, ref.course_semester, ["lecturer", "teaching assistant"]
+    ):
+        return await crud.create_unit(
             db=db,
             title=ref.title,
             date_available=ref.date_available,
@@ -586,29 +648,62 @@ async def create_unit(
     )
 
 
+@app.post("/create_units", response_model=List[schemas.Unit])
+async def create_units(
+    ref: schemas.UnitsCreate,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Creates every unit in `ref.units` for a course at once, for example the schedule of a semester,
+    if the user is admin or lecturer or teaching assistant in the course.
+
+    The units and their empty reports are saved with one insert each in one transaction.
+    """
+    auth.require_login()
+
+    enrollment = await auth.enrollment(ref.course_id, ref.course_semester)
+    if enrollment is None:
+        raise HTTPException(401, detail="You are not enrolled in the course")
+    if not ref.units:
+        raise HTTPException(400, detail="No units were given")
+    if await auth.has_role(
+        ref.course_id, ref.course_semester, ["lecturer", "teaching assistant"]
+    ):
+        return await crud.create_units(
+            db,
+            ref.course_id,
+            ref.course_semester,
+            [unit.dict() for unit in ref.units],
+        )
+    raise HTTPException(
+        403, detail="You do not have permission to edit a unit for this course"
+    )
+
+
 @app.patch("/update_unit/{unit_id}", response_model=schemas.UnitCreate)
 async def update_unit(
     unit_id: int,
-    request: Request,
     ref: schemas.UnitCreate,
-    db: Session = Depends(get_db),
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Updates the details of an existing unit identified by `unit_id` with new information
     provided in the `ref` object, which includes the unit's title and date available.
     """
-    protect_route(request)
+    auth.require_login()
 
-    user = request.session.get("user")
-    uid: str = user.get("uid")
-    unit = crud.get_unit(db, unit_id)
+    unit = await crud.get_unit(db, unit_id)
     if not unit:
         raise HTTPException(404, detail="Unit not found")
-    enrollment = crud.get_enrollment(db, unit.course_id, unit.course_semester, uid)
+    enrollment = await auth.enrollment(unit.course_id, unit.course_semester)
     if enrollment is None:
         raise HTTPException(401, detail="You are not enrolled in the course")
-    if is_admin(db, request) or enrollment.role in ["lecturer", "teaching assistant"]:
-        return crud.update_unit(
+    if await auth.has_role(
+        unit.course_id, unit.course_semester, ["lecturer", "teaching assistant"]
+    ):
+        return await crud.update_unit(
             db=db,
             unit_id=unit_id,
             title=ref.title,
@@ -625,60 +720,54 @@ async def update_unit(
 async def delete_unit(
     unit_id: int,
     ref: schemas.UnitDelete,
-    request: Request,
-    db: Session = Depends(get_db),
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Deletes a specific unit based on the unit ID, course ID, and course semester provided, if user-details from 'ref' object is admin.
     """
-    user = request.session.get("user")
-    uid: str = user.get("uid")
-    unit = crud.get_unit(db, unit_id)
+    auth.require_login()
+
+    unit = await crud.get_unit(db, unit_id)
     if not unit:
         raise HTTPException(404, detail="Unit not found")
-    enrollment = crud.get_enrollment(db, unit.course_id, unit.course_semester, uid)
-    if is_admin(db, request) or enrollment.role in ["lecturer"]:
-        return crud.delete_unit(db, unit_id, ref.course_id, ref.course_semester)
+    if await auth.has_role(unit.course_id, unit.course_semester, ["lecturer"]):
+        return await crud.delete_unit(db, unit_id, ref.course_id, ref.course_semester)
     raise HTTPException(
         403, detail="You do not have permission to delete a unit for this course"
     )
 
 
-# For deleting a unit after it has been created
-class FileResponseWithDeletion(FileResponse):
-    def __init__(self, path: str, filename: str, **kwargs):
-        super().__init__(path, filename=filename, **kwargs)
-
-    async def __call__(self, scope, receive, send):
-        await super().__call__(scope, receive, send)
-        os.remove(self.path)
-
-
 @app.get("/download")
 async def download_file(
     request: Request,
     ref: schemas.AutomaticReport = Depends(),
-    db: Session = Depends(get_db),
+    format: str = "json",
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Retrieves a report stored in the database based on course id, unit id, and course semester provided in the `ref` object.
-    Downloads the provided report file.
+    Downloads the report as a JSON, CSV or Markdown file, based on `format`.
+
+    The file is streamed from memory in chunks, so no file is written to disk.
     """
-    protect_route(request)
+    auth.require_login()
 
-    user = request.session.get("user")
-    uid: str = user.get("uid")
-    enrollment = crud.get_enrollment(db, ref.course_id, ref.course_semester, uid)
-    if is_admin(db, request) or enrollment.role in ["lecturer"]:
-        report = await get_report(
-            request,
-            params=schemas.AutomaticReport(
-                course_id=ref.course_id,
-                course_semester=ref.course_semester,
-                unit_id=ref.unit_id,
-            ),
-            db=db,
+    if format not in REPORT_FORMATS:
+        raise HTTPException(
+            400, detail=f"Format must be one of {', '.join(REPORT_FORMATS)}"
+        )
+
+    if await auth.has_role(ref.course_id, ref.course_semester, ["lecturer"]):
+        report = await crud.get_report(
+            db,
+            course_id=ref.course_id,
+            unit_id=ref.unit_id,
+            course_semester=ref.course_semester,
         )
+        if report is None:
+            raise HTTPException(status_code=404, detail="Report not found")
 
         try:
             report_dict = report.to_dict()
@@ -688,93 +777,163 @@ async def download_file(
                 detail=f"An error occurred while generating the report, you may have not generated a report yet. Error: {str(e)}",
             )
 
-        if config("SERVERLESS", cast=bool, default=False):
-            return json.dumps(report_dict, indent=4)
+        extension, media_type, stream_report = REPORT_FORMATS[format]
+        filename = f"report-{ref.course_id}-{ref.course_semester}-unit{ref.unit_id}.{extension}"
+        return StreamingResponse(
+            stream_report(report_dict),
+            media_type=media_type,
+            headers={"Content-Disposition": content_disposition(filename)},
+        )
 
-        with open("report.txt", "w") as f:
-            f.write(json.dumps(report_dict, indent=4))
+    return Response(status_code=403)
 
-        path = os.getcwd() + "/report.txt"
-        return FileResponseWithDeletion(path, filename="report.txt")
 
-    return Response(status_code=403)
+# Example: /export?course_id=TDT4100&course_semester=fall2023&format=csv&include_reports=true&gzip=true
+@app.get("/export")
+async def export_course(
+    course_id: str,
+    course_semester: str,
+    format: str = "ndjson",
+    include_reports: bool = False,
+    gzip: bool = False,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Downloads every reflection of a course, and its generated reports if `include_reports` is set, as NDJSON or CSV.
+    Only lecturers of the course and admins can export it.
+
+    The rows are read in batches from a server-side cursor and streamed as they are read, so memory stays flat for
+    large courses. With `gzip` the file is compressed while it is streamed.
+    """
+    auth.require_login()
+
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(
+            400, detail=f"Format must be one of {', '.join(EXPORT_FORMATS)}"
+        )
+    if await crud.get_course(db, course_id, course_semester) is None:
+        raise HTTPException(404, detail="Course not found")
+    if not await auth.has_role(course_id, course_semester, ["lecturer"]):
+        raise HTTPException(403, detail="You are not a lecturer in this course")
+
+    extension, media_type, export = EXPORT_FORMATS[format]
+
+    async def stream():
+        # The response is streamed after the endpoint returns, so it reads from its own session
+        async with AsyncSessionLocal() as export_db:
+            reflections = crud.stream_course_reflections(
+                export_db, course_id, course_semester
+            )
+            reports = (
+                crud.stream_course_reports(export_db, course_id, course_semester)
+                if include_reports
+                else None
+            )
+            chunks = export(reflections, reports)
+            if gzip:
+                chunks = gzip_stream(chunks)
+            async for chunk in chunks:
+                yield chunk
+
+    filename = f"export-{course_id}-{course_semester}.{extension}"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": content_disposition(filename)},
+    )
 
 
 def to_dict(obj):
     return {c.name: getattr(obj, c.name) for c in obj.__table__.columns}
 
 
+async def unit_data(
+    db: AsyncSession,
+    course_id: str,
+    course_semester: str,
+    unit_id: int,
+    include_hidden: bool,
+):
+    """
+    Returns a unit of a course with its reports, and the questions of the course.
+    A hidden unit is only returned with `include_hidden`.
+    """
+    unit = await db.scalar(
+        select(model.Unit)
+        .where(
+            model.Unit.id == unit_id,
+            model.Unit.course_id == course_id,
+            model.Unit.course_semester == course_semester,
+        )
+        .options(selectinload(model.Unit.reports))
+    )
+    if unit is None or (unit.hidden and not include_hidden):
+        raise HTTPException(404, detail="Unit not found")
+
+    questions = [
+        to_dict(question)
+        for question in await crud.get_course_questions(db, course_id, course_semester)
+    ]
+    return {
+        "unit": unit,
+        "unit_questions": questions,
+    }
+
+
 # Example: /unit_data?course_id=TDT4100&course_semester=fall2023&unit_id=1
 @app.get("/unit_data", response_model=schemas.UnitData)
 async def get_unit_data(
     request: Request,
+    response: Response,
     course_id: str,
     course_semester: str,
     unit_id: int,
-    db: Session = Depends(get_db),
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Retrieves a specific unit based on the course ID, course semester, and unit ID provided.
+
+    Answers 304 to If-None-Match with the ETag of the unit, which changes with the unit's version.
     """
-    protect_route(request)
+    auth.require_login()
 
-    user = request.session.get("user")
-    email: str = user.get("uid")
-    course = crud.get_course(db, course_id, course_semester)
+    course = await crud.get_course(db, course_id, course_semester)
     if course is None:
         raise HTTPException(404, detail="Course not found")
-    enrollment = crud.get_enrollment(db, course_id, course_semester, email)
+    enrollment = await auth.enrollment(course_id, course_semester)
     if enrollment is None:
         raise HTTPException(401, detail="You are not enrolled in the course")
-    unit = (
-        db.query(model.Unit)
-        .filter(
-            model.Unit.id == unit_id,
-            model.Unit.course_id == course_id,
-            model.Unit.course_semester == course_semester,
-        )
-        .first()
+    # Lecturers and teaching assistants also see the hidden units
+    include_hidden = await auth.has_role(
+        course_id, course_semester, ["lecturer", "teaching assistant"]
     )
-    if unit:
-        questions = [to_dict(question) for question in course.questions]
-
-        if is_admin(db, request) or enrollment.role in [
-            "lecturer",
-            "teaching assistant",
-        ]:
-            return {
-                "unit": unit,
-                "unit_questions": questions,
-            }
-        else:
-            unit = (
-                db.query(model.Unit)
-                .filter(
-                    model.Unit.course_id == course_id,
-                    model.Unit.course_semester == course_semester,
-                    model.Unit.id == unit_id,
-                    model.Unit.hidden == False,
-                )
-                .first()
-            )
-            if unit:
-                return {
-                    "unit": unit,
-                    "unit_questions": questions,
-                }
 
-    raise HTTPException(404, detail="Unit not found")
+    version = await crud.get_unit_version(db, unit_id, course_id, course_semester)
+    if version is not None:
+        etag = make_etag("unit_data", unit_id, version, include_hidden)
+        cached = not_modified(request, response, etag)
+        if cached is not None:
+            return cached
+
+    return await unit_data(db, course_id, course_semester, unit_id, include_hidden)
 
 
 # This can be uncommented to test the functionality for development purposes
 # @app.post("/save_report", response_model=schemas.ReportCreate)
 async def save_report_endpoint(
-    request: Request, ref: schemas.ReportCreate, db: Session = Depends(get_db)
+    ref: schemas.ReportCreate,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
-    if not is_admin(db, request):
+    if not await auth.is_admin():
         raise HTTPException(403, detail="You are not an admin user")
     try:
-        return crud.save_report(db, report=ref.model_dump())
+        return await crud.save_report(db, report=ref.model_dump())
     except IntegrityError as e:
         raise HTTPException(
             409, detail="An error occurred while saving the report: " + str(e)
@@ -784,14 +943,26 @@ async def save_report_endpoint(
 @app.get("/report")
 async def get_report(
     request: Request,
+    response: Response,
     params: schemas.AutomaticReport = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Retrieve a report from the database based on the provided parameters such as course id, unit id, and course semester.
+
+    Answers 304 to If-None-Match with the ETag of the report, which changes with the version of its unit.
     """
     protect_route(request)
-    report = crud.get_report(
+    version = await crud.get_unit_version(
+        db, params.unit_id, params.course_id, params.course_semester
+    )
+    if version is not None:
+        etag = make_etag("report", params.unit_id, version)
+        cached = not_modified(request, response, etag)
+        if cached is not None:
+            return cached
+
+    report = await crud.get_report(
         db,
         course_id=params.course_id,
         unit_id=params.unit_id,
@@ -799,39 +970,129 @@ async def get_report(
     )
     if report is None:
         raise HTTPException(status_code=404, detail="Report not found")
-    return report
+    return rows_response(to_dict(report), response)
 
 
 @app.post("/create_invitation", response_model=schemas.Invitation)
 async def create_invitation(
-    request: Request, ref: schemas.InvitationBase, db: Session = Depends(get_db)
+    ref: schemas.InvitationBase,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Creates an invitation to an user for a course based on user-details and course-details provided in the `ref` object.
     """
-    protect_route(request)
-    user = request.session.get("user")
-    uid: str = user.get("uid")
-    user = crud.get_user(db, uid)
-    if user is None:
+    auth.require_login()
+    enrollment = await auth.enrollment(ref.course_id, ref.course_semester)
+    if await auth.user() is None:
         raise HTTPException(401, detail="Cannot find your user")
-    enrollment = crud.get_enrollment(db, ref.course_id, ref.course_semester, uid)
     if enrollment is None:
         raise HTTPException(401, detail="You are not enrolled in the course")
-    if not is_admin(db, request) or not enrollment.role in [
+    if not await auth.is_admin() or not enrollment.role in [
         "lecturer",
         "teaching assistant",
     ]:
         raise HTTPException(403, detail="You are not allowed to invite to this course")
     try:
-        return crud.create_invitation(db, invitation=ref.dict())
+        return await crud.create_invitation(db, invitation=ref.dict())
     except IntegrityError:
         raise HTTPException(409, detail="invitation already exists")
 
 
+@app.post("/import_roster")
+async def import_roster(
+    request: Request,
+    course_id: str,
+    course_semester: str,
+    target: str = "enrollment",
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Imports a roster of users into a course, as enrollments or, with `target=invitation`, as invitations.
+
+    The request body is a CSV file with a header row, or NDJSON when sent with `Content-Type: application/x-ndjson`.
+    Every row has a `uid`, and optionally an `email` and a `role`, which defaults to "student".
+    The body is streamed and saved in batches of ROSTER_BATCH_SIZE rows, creating any missing users. Rows that are
+    invalid or already enrolled/invited are reported by line number instead of aborting the import.
+    """
+    auth.require_login()
+
+    if target not in ["enrollment", "invitation"]:
+        raise HTTPException(400, detail="target must be 'enrollment' or 'invitation'")
+
+    if await crud.get_course(db, course_id, course_semester) is None:
+        raise HTTPException(404, detail="Course not found")
+
+    if not await auth.has_role(course_id, course_semester, ["lecturer"]):
+        raise HTTPException(
+            403, detail="You are not allowed to import users to this course"
+        )
+
+    content_type = request.headers.get("content-type", "")
+    ndjson = "ndjson" in content_type or "jsonl" in content_type
+
+    imported = 0
+    rows = []
+    seen = set()
+    batch = []
+
+    async def save_batch():
+        nonlocal imported
+        lines = {row["uid"]: line for line, row in batch}
+        conflicts = await crud.import_roster_batch(
+            db,
+            course_id,
+            course_semester,
+            [row for _, row in batch],
+            invite=target == "invitation",
+        )
+        imported += len(batch) - len(conflicts)
+        for conflict in conflicts:
+            rows.append(
+                {
+                    "line": lines[conflict],
+                    "uid": conflict,
+                    "status": "conflict",
+                    "message": "Already "
+                    + ("invited to" if target == "invitation" else "enrolled in")
+                    + " this course",
+                }
+            )
+        batch.clear()
+
+    async for line, row, error in read_roster(request.stream(), ndjson=ndjson):
+        if error is not None:
+            rows.append({"line": line, "status": "invalid", "message": error})
+        elif row["uid"] in seen:
+            rows.append(
+                {
+                    "line": line,
+                    "uid": row["uid"],
+                    "status": "conflict",
+                    "message": "Duplicate row in roster",
+                }
+            )
+        else:
+            seen.add(row["uid"])
+            batch.append((line, row))
+            if len(batch) >= ROSTER_BATCH_SIZE:
+                await save_batch()
+    if batch:
+        await save_batch()
+
+    rows.sort(key=lambda row: row["line"])
+    return {
+        "imported": imported,
+        "conflicts": len([row for row in rows if row["status"] == "conflict"]),
+        "invalid": len([row for row in rows if row["status"] == "invalid"]),
+        "rows": rows,
+    }
+
+
 # get all invitations by user
 @app.get("/get_invitations", response_model=List[schemas.Invitation])
-async def get_invitations(request: Request, db: Session = Depends(get_db)):
+async def get_invitations(request: Request, db: AsyncSession = Depends(get_db)):
     """
     Retrieves all invitations for a user based on the user ID stored in the session.
     """
@@ -840,31 +1101,35 @@ async def get_invitations(request: Request, db: Session = Depends(get_db)):
     user = request.session.get("user")
     uid: str = user.get("uid")
 
-    return crud.get_invitations(db, uid)
+    return await crud.get_invitations(db, uid)
 
 
 # delete invitation
 @app.delete("/delete_invitation/{id}")
-async def delete_invitation(request: Request, id: int, db: Session = Depends(get_db)):
+async def delete_invitation(
+    request: Request, id: int, db: AsyncSession = Depends(get_db)
+):
     """
     Deletes an invitation based on the invitation ID provided.
     """
     protect_route(request)
 
-    return crud.delete_invitation(db, id=id)
+    return await crud.delete_invitation(db, id=id)
 
 
 @app.post("/send-notifications")
-async def send_notifications(db: Session = Depends(get_db)):
+async def send_notifications(db: AsyncSession = Depends(get_db)):
     """
-    Sends reminder notifications to students about units they need to provide feedback for.
+    Queues reminder notifications to students about units they need to provide feedback for.
 
-    This function iterates over all courses and their enrolled students, identifying units
-    for which students have not yet reached the notification limit. It then sends a reminder
-    email to each student about their pending units, updating the notification count for each unit
-    per student.
+    The recipients are planned with a single query over all courses and their enrolled students,
+    identifying units for which students have not yet reached the notification limit. One reminder email
+    per student and course is written to the notification outbox in the same transaction as the updated
+    notification counts, and the notification worker (`python -m api.worker`) sends them with retries.
+
+    Returns 202 with the id of the notification job, its progress is available from /notification-jobs/{job_id}.
     """
-    if crud.check_recent_notification(db, NOTIFICATION_COOLDOWN_DAYS):
+    if await crud.check_recent_notification(db, NOTIFICATION_COOLDOWN_DAYS):
         print(
             "Notification already sent in the last", NOTIFICATION_COOLDOWN_DAYS, "days"
         )
@@ -875,54 +1140,89 @@ async def send_notifications(db: Session = Depends(get_db)):
             + " days.",
         )
 
-    results = []
-    courses = crud.get_all_courses(db)
+    recipients = await crud.get_notification_recipients(db, NOTIFICATION_LIMIT)
+    job = await crud.enqueue_notifications(
+        db,
+        [
+            {
+                "user_id": recipient["uid"],
+                "course_id": recipient["course_id"],
+                "unit_ids": [unit.id for unit in recipient["units"]],
+                "recipient": recipient["email"],
+                "subject": f"{recipient['course_id']} - Missing Reflection",
+                "body": format_email(
+                    recipient["uid"], recipient["course_id"], recipient["units"]
+                ),
+            }
+            for recipient in recipients
+        ],
+    )
+
+    return JSONResponse(
+        status_code=202, content={"job_id": job.id, "recipients": len(recipients)}
+    )
 
-    for course in courses:
-        students = crud.get_all_students_in_course(db, course.id, course.semester)
 
-        for student in students:
-            units = crud.get_units_to_notify(
-                db, student.uid, NOTIFICATION_LIMIT, course.id, course.semester
+@app.get("/notification-jobs/{job_id}")
+async def get_notification_job(
+    job_id: int,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Returns the progress of a notification job: the number of queued reminder emails that are pending,
+    sent and failed, and the error of every email that failed after all retries.
+
+    Only admins and lecturers can see a job, and lecturers only see the failures in their own courses.
+    """
+    auth.require_login()
+    lecturer_course_ids = None
+    if not await auth.is_admin():
+        lecturer_course_ids = await crud.get_lecturer_course_ids(db, auth.uid)
+        if not lecturer_course_ids:
+            raise HTTPException(
+                403, detail="You are not allowed to see notification jobs"
             )
 
-            if len(units) == 0:
-                continue
-
-            try:
-                message = MessageSchema(
-                    subject=f"{course.id} - Missing Reflection",
-                    recipients=[student.email],
-                    body=format_email(student.uid, course.id, units),
-                    subtype="html",
-                )
-
-                fm = FastMail(email_config)
-                await fm.send_message(message)
-
-                for unit in units:
-                    crud.add_notification_count(db, student.uid, unit.id)
-
-                results.append(
-                    {
-                        "course": course.id,
-                        "units": [unit.id for unit in units],
-                        "email": student.email,
-                        "status": "success",
-                    }
-                )
-            except Exception as e:
-                results.append(
-                    {
-                        "course": course.id,
-                        "units": [unit.id for unit in units],
-                        "email": student.email,
-                        "status": "error",
-                        "message": str(e),
-                    }
-                )
-    crud.create_notification_log(db=db)
-    return JSONResponse(status_code=200, content=results)
+    status = await crud.get_notification_job_status(db, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Notification job not found")
+    job, counts, failed = status
+    if lecturer_course_ids is not None:
+        failed = [
+            message for message in failed if message.course_id in lecturer_course_ids
+        ]
+
+    return {
+        "job_id": job.id,
+        "created_at": job.created_at.isoformat(),
+        "total": sum(counts.values()),
+        "pending": counts.get("pending", 0),
+        "sent": counts.get("sent", 0),
+        "failed": counts.get("failed", 0),
+        "done": counts.get("pending", 0) == 0,
+        "failures": [
+            {
+                "course": message.course_id,
+                "units": message.unit_ids,
+                "attempts": message.attempts,
+                "message": message.last_error,
+            }
+            for message in failed
+        ],
+    }
+
+
+@app.get("/cache_stats")
+async def get_cache_stats(auth: AuthContext = Depends(get_auth)):
+    """
+    Returns the hits and misses of the cache in front of the user, course and enrollment lookups
+    of this worker, and of the cache of OpenAI responses. Only admins can see them.
+    """
+    auth.require_login()
+    if not await auth.is_admin():
+        raise HTTPException(403, detail="You are not an admin user")
+    return {**cache.stats(), "openai_responses": openai_responses.stats()}
 
 
 def format_email(student_id: str, course_id: str, units: List[model.Unit]):
@@ -959,6 +1259,9 @@ async def analyze_feedback(ref: schemas.ReflectionJSON):
     3. Sorting the feedback into the identified categories.
     4. Transforming sorted keys into actual answers for a readable format.
     5. Generating a summary of the categorized feedback.
+
+    The OpenAI API is awaited with the async versions of the prompting functions, so the event loop keeps
+    serving other requests while a report is generated.
     """
 
     # Adds a key to each student feedback dict to identify the student and filter out irrelevant information
@@ -976,25 +1279,44 @@ async def analyze_feedback(ref: schemas.ReflectionJSON):
         )
     ]
 
-    categories = createCategories(
-        ref.api_key, ref.questions, student_feedback_dicts, ref.use_cheap_model
-    )
-
-    sorted_feedback = sort(
+    use_cache = not ref.bypass_cache
+    categories = await createCategoriesChunkedAsync(
         ref.api_key,
         ref.questions,
-        categories,
         student_feedback_dicts,
         ref.use_cheap_model,
+        use_cache=use_cache,
     )
 
+    if ref.sort_per_question:
+        sorted_feedback = await sortPerQuestionAsync(
+            ref.api_key,
+            ref.questions,
+            categories,
+            student_feedback_dicts,
+            ref.use_cheap_model,
+            concurrency=SORT_CONCURRENCY,
+            use_cache=use_cache,
+        )
+    else:
+        sorted_feedback = await sortAsync(
+            ref.api_key,
+            ref.questions,
+            categories,
+            student_feedback_dicts,
+            ref.use_cheap_model,
+            use_cache=use_cache,
+        )
+
     sorted_feedback = enforce_unique_categories(sorted_feedback)
 
     stringAnswered = transformKeysToAnswers(
         sorted_feedback, ref.questions, student_feedback_dicts
     )
 
-    summary = createSummary(ref.api_key, stringAnswered, ref.use_cheap_model)
+    summary = await createSummaryAsync(
+        ref.api_key, stringAnswered, ref.use_cheap_model, use_cache=use_cache
+    )
     stringAnswered["Summary"] = summary["summary"]
 
     return stringAnswered
@@ -1002,7 +1324,7 @@ async def analyze_feedback(ref: schemas.ReflectionJSON):
 
 @app.delete("/unenroll_course")
 async def unenroll_course(
-    request: Request, ref: schemas.EnrollmentBase, db: Session = Depends(get_db)
+    request: Request, ref: schemas.EnrollmentBase, db: AsyncSession = Depends(get_db)
 ):
     """
     Unenrolls the user from a course based on the course ID and course semester provided in the `ref` object.
@@ -1011,43 +1333,47 @@ async def unenroll_course(
     try:
         user = request.session.get("user")
         uid = user.get("uid")
-        return crud.delete_enrollment(db, uid, ref.course_id, ref.course_semester)
+        return await crud.delete_enrollment(db, uid, ref.course_id, ref.course_semester)
     except IntegrityError:
         raise HTTPException(409, detail="Course already exists")
 
 
 @app.delete("/delete_course")
 async def delete_course(
-    request: Request, ref: schemas.CourseBase, db: Session = Depends(get_db)
+    ref: schemas.CourseBase,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Deletes a course based on the course ID and course semester provided in the `ref` object.
     """
-    protect_route(request)
-    if not is_admin(db, request):
+    auth.require_login()
+    if not await auth.is_admin():
         raise HTTPException(403, detail="You are not an admin user")
     try:
-        return crud.delete_course(db, ref.id, ref.semester)
+        return await crud.delete_course(db, ref.id, ref.semester)
     except IntegrityError:
         raise HTTPException(409, detail="Course already exists")
 
 
 @app.post("/generate_report")
 async def generate_report_endpoint(
-    request: Request, ref: schemas.AutomaticReport, db: Session = Depends(get_db)
+    ref: schemas.AutomaticReport,
+    auth: AuthContext = Depends(get_auth),
+    db: AsyncSession = Depends(get_db),
 ):
     """
     Generates and saves a report for a specific unit based on the course ID, course semester, and unit ID provided in the `ref` object.
     """
-    if not is_admin(db, request):
+    if not await auth.is_admin():
         raise HTTPException(403, detail="You are not an admin user")
     try:
-        unit_data = await get_unit_data(
-            request, ref.course_id, ref.course_semester, ref.unit_id, db
+        data = await unit_data(
+            db, ref.course_id, ref.course_semester, ref.unit_id, include_hidden=True
         )
 
-        questions = [q["comment"] for q in unit_data["unit_questions"]]
-        reflections = unit_data["unit"].reflections
+        questions = [q["comment"] for q in data["unit_questions"]]
+        reflections = await crud.get_unit_reflections(db, ref.unit_id)
 
         student_answers = {}
         for reflection in reflections:
@@ -1066,13 +1392,13 @@ async def generate_report_endpoint(
             questions=questions,
             student_feedback=student_feedback,
             use_cheap_model=True,
+            sort_per_question=SORT_PER_QUESTION,
         )
 
         analyze = await analyze_feedback(feedback)
 
         try:
             await save_report_endpoint(
-                request,
                 ref=schemas.AnalyzeReportCreate(
                     number_of_answers=len(student_feedback),
                     report_content=analyze,
@@ -1080,9 +1406,10 @@ async def generate_report_endpoint(
                     course_id=ref.course_id,
                     course_semester=ref.course_semester,
                 ),
+                auth=auth,
                 db=db,
             )
-            crud.reset_reflections_count(db, ref.unit_id)
+            await crud.reset_reflections_count(db, ref.unit_id)
         except:
             raise HTTPException(500, detail="An error occurred while saving the report")
         return HTTPException(200, detail="Report generated and saved successfully")
@@ -4,15 +4,18 @@ from sqlalchemy import (
     Boolean,
     Column,
     Date,
+    DateTime,
     Enum,
     ForeignKey,
+    Index,
     Integer,
     String,
+    Text,
     UniqueConstraint,
 )
 from sqlalchemy.orm import relationship, class_mapper
 from sqlalchemy.schema import ForeignKeyConstraint
-from datetime import date
+from datetime import date, datetime
 
 enum_values = Enum("lecturer", "teaching assistant", "student", name="enrollment_roles")
 
@@ -40,6 +43,8 @@ class Course(Base):
     semester = Column(String, primary_key=True)
     responsible = Column(String, default="")
     website = Column(String, default="")
+    # Bumped when the units or enrollments of the course change, used in the ETags of /course and /units
+    version = Column(Integer, default=1, server_default="1", nullable=False)
     units = relationship("Unit", back_populates="course")
     reports = relationship("Report", back_populates="course")
     users = relationship("Enrollment", back_populates="course")
@@ -61,6 +66,8 @@ class Enrollment(Base):
         ForeignKeyConstraint(
             [course_id, course_semester], [Course.id, Course.semester]
         ),
+        # Students of a course are looked up by course and role, not by uid
+        Index("ix_enrollment_course_role", course_id, course_semester, role),
         {},
     )
 
@@ -78,18 +85,21 @@ class Unit(Base):
         ForeignKeyConstraint(
             [course_id, course_semester], [Course.id, Course.semester]
         ),
+        Index("ix_units_course_date", course_id, course_semester, date_available),
         {},
     )
     course = relationship("Course", back_populates="units")
     reflections = relationship("Reflection", back_populates="unit")
     reflections_since_last_report = Column(Integer, default=0)
+    # Bumped when the unit, its report or its number of reflections change, used in the ETags of its responses
+    version = Column(Integer, default=1, server_default="1", nullable=False)
     reports = relationship("Report", back_populates="unit")
 
-    # Has its own to_dict method to include the number of reflections since last report
-    def to_dict(self):
-        unique_user_ids = {reflection.user_id for reflection in self.reflections}
+    # Has its own to_dict method to include the number of students that have reflected on the unit
+    # The total is counted by the database (see crud.get_units_with_total_reflections)
+    def to_dict(self, total_reflections: int):
         return {
-            "total_reflections": len(unique_user_ids),
+            "total_reflections": total_reflections,
             **{
                 c.key: getattr(self, c.key)
                 for c in class_mapper(self.__class__).columns
@@ -123,6 +133,17 @@ class Reflection(Base):
     unit_id = Column(Integer, ForeignKey("units.id"))
     unit = relationship("Unit", back_populates="reflections")
     question_id = Column(Integer, ForeignKey("questions.id"))
+    __table_args__ = (
+        # A user can only answer each question of a unit once
+        Index(
+            "ix_reflections_unit_user_question",
+            unit_id,
+            user_id,
+            question_id,
+            unique=True,
+        ),
+        Index("ix_reflections_user_id", user_id),
+    )
 
 
 class Report(Base):
@@ -142,6 +163,7 @@ class Report(Base):
         ForeignKeyConstraint(
             [course_id, course_semester], [Course.id, Course.semester]
         ),
+        Index("ix_reports_unit_course", unit_id, course_id, course_semester),
         {},
     )
     course = relationship("Course", back_populates="reports")
@@ -181,6 +203,14 @@ class Invitation(Base):
         ForeignKeyConstraint(
             [course_id, course_semester], [Course.id, Course.semester]
         ),
+        # A user can only be invited to each course once
+        Index(
+            "ix_invitations_uid_course",
+            uid,
+            course_id,
+            course_semester,
+            unique=True,
+        ),
         {},
     )
     role = Column(String, primary_key=False)
@@ -195,6 +225,8 @@ class CourseQuestion(Base):
         ForeignKeyConstraint(
             [course_id, course_semester], [Course.id, Course.semester]
         ),
+        # The primary key starts with question_id, so lookups by course need their own index
+        Index("ix_course_question_course", course_id, course_semester),
         {},
     )
 
@@ -203,7 +235,7 @@ class NotificationLog(Base):
     __tablename__ = "notification_logs"
 
     id = Column(Integer, primary_key=True, index=True)
-    sent_at = Column(Date, default=date.today)
+    sent_at = Column(Date, default=date.today, index=True)
 
 
 class UserUnitNotificationCount(Base):
@@ -216,3 +248,43 @@ class UserUnitNotificationCount(Base):
     notification_count = Column(Integer, default=0, nullable=False)
 
     __table_args__ = (UniqueConstraint("user_id", "unit_id", name="_user_unit_uc"),)
+
+
+class NotificationJob(Base):
+    __tablename__ = "notification_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    messages = relationship("NotificationOutbox", back_populates="job")
+
+
+class NotificationOutbox(Base):
+    """
+    A reminder email waiting to be sent by the notification worker.
+
+    Rows are written in the same transaction as the notification counts, and the worker moves them
+    from "pending" to "sent", or to "failed" once max attempts are used up.
+    """
+
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("notification_jobs.id"), nullable=False)
+    job = relationship("NotificationJob", back_populates="messages")
+    user_id = Column(String, ForeignKey("users.uid"), nullable=False)
+    course_id = Column(String, nullable=False)
+    unit_ids = Column(JSON, nullable=False)
+    recipient = Column(String, nullable=False)
+    subject = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String, default="pending", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(String)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        # The worker polls for pending messages that are due
+        Index("ix_notification_outbox_status_next", status, next_attempt_at),
+        Index("ix_notification_outbox_job", job_id),
+    )
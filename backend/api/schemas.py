@@ -31,6 +31,17 @@ class ReflectionCreate(ReflectionBase):
     pass
 
 
+class ReflectionAnswer(BaseModel):
+    question_id: int
+    body: str
+
+
+class ReflectionBatchCreate(BaseModel):
+    user_id: str
+    unit_id: int
+    answers: List[ReflectionAnswer]
+
+
 class ReflectionDetail(ReflectionBase):
     id: int
     category: str
@@ -54,6 +65,18 @@ class UnitCreate(UnitBase):
     pass
 
 
+class UnitScheduleItem(BaseModel):
+    title: str
+    date_available: date
+    hidden: bool = False
+
+
+class UnitsCreate(BaseModel):
+    course_id: str
+    course_semester: str
+    units: List[UnitScheduleItem]
+
+
 class UnitDelete(BaseModel):
     course_id: str
     course_semester: str
@@ -121,6 +144,11 @@ class CourseCreate(CourseBase):
     questions: List[Question] = []
 
 
+class CourseClone(CourseBase):
+    new_semester: str
+    date_offset_days: int = 0
+
+
 class EnrollmentBase(BaseModel):
     course_id: str
     course_semester: str
@@ -247,3 +275,7 @@ class ReflectionJSON(BaseModel):
     questions: List[str]
     student_feedback: List[ReflectionJSONFormat]
     use_cheap_model: bool
+    # Sorts the answers to each question in a request of its own, see prompting.sort.sortPerQuestionAsync
+    sort_per_question: bool = False
+    # Sends every request to the OpenAI API, instead of reading the responses of identical requests from the cache
+    bypass_cache: bool = False
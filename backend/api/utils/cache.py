@@ -0,0 +1,107 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.config import Config
+
+config = Config(".env")
+
+
+class CacheBackend(ABC):
+    """
+    Interface of the cache in front of the rarely changing crud lookups.
+
+    Values are plain dicts and lists, so a backend shared between workers, such as Redis, can store
+    them serialized. Every backend counts its hits and misses.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the value stored under key, or None if it is missing or has expired.
+        """
+
+    @abstractmethod
+    async def set(self, key: str, value: Any): ...
+
+    @abstractmethod
+    async def delete(self, *keys: str): ...
+
+    @abstractmethod
+    async def delete_prefix(self, prefix: str):
+        """
+        Deletes every key that starts with prefix.
+        """
+
+    @abstractmethod
+    async def clear(self): ...
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class MemoryCache(CacheBackend):
+    """
+    An in-process cache where every entry expires ttl seconds after it was set, and the least recently
+    used entry is evicted when more than max_entries are stored.
+
+    Each worker process has its own MemoryCache, so an invalidation in one worker is not seen by the
+    others, and they can serve a stale value for at most ttl seconds.
+    """
+
+    def __init__(self, ttl: float = 60, max_entries: int = 10000):
+        super().__init__()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, key: str, value: Any):
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def delete_prefix(self, prefix: str):
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            del self._entries[key]
+
+    async def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **super().stats(),
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+        }
+
+
+# The cache used by crud, set CACHE_TTL_SECONDS=0 to disable it
+cache: CacheBackend = MemoryCache(
+    ttl=config("CACHE_TTL_SECONDS", cast=float, default=60),
+    max_entries=config("CACHE_MAX_ENTRIES", cast=int, default=10000),
+)
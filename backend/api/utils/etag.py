@@ -0,0 +1,37 @@
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+# Browsers keep the response, but ask the API with If-None-Match whether it changed before using it again
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """
+    Returns a weak ETag for a response that is fully determined by parts, such as ids and change counters.
+    """
+    digest = hashlib.sha1("\0".join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest[:24]}"'
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(",")
+    )
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    Returns a 304 response if the client sent If-None-Match with etag, so the endpoint can return it without
+    building the response. Otherwise sets the ETag on the response of the endpoint and returns None.
+    """
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
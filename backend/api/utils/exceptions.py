@@ -1,3 +1,9 @@
+import json
+from contextlib import contextmanager
+
+from openai import OpenAIError, RateLimitError
+
+
 class OpenAIRequestError(Exception):
     """Exception raised when an OpenAI API request fails."""
 
@@ -10,3 +16,23 @@ class DataProcessingError(Exception):
 
     def __init__(self, message: str):
         self.message = message
+
+
+@contextmanager
+def openai_errors():
+    """
+    Raises the errors of a request to the OpenAI API, and of reading its response, as OpenAIRequestError
+    or DataProcessingError.
+    """
+    try:
+        yield
+    except DataProcessingError:
+        raise
+    except RateLimitError as e:
+        raise OpenAIRequestError(f"Rate limit exceeded: {str(e)}")
+    except OpenAIError as e:
+        raise OpenAIRequestError(f"OpenAI API error: {str(e)}")
+    except json.JSONDecodeError as e:
+        raise DataProcessingError(f"JSON decoding error: {str(e)}")
+    except Exception as e:
+        raise OpenAIRequestError(f"An unexpected error occurred: {str(e)}")
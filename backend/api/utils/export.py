@@ -0,0 +1,226 @@
+import csv
+import io
+import json
+import zlib
+from itertools import chain
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+# Chunks smaller than this are joined before they are sent, so large reports are streamed in a few writes
+CHUNK_SIZE = 64 * 1024
+
+
+def content_disposition(filename: str) -> str:
+    """
+    Returns a Content-Disposition header that downloads the response as filename.
+    Names that are not plain ASCII are sent encoded as described in RFC 6266.
+    """
+    quoted = quote(filename)
+    if quoted == filename:
+        return f'attachment; filename="{filename}"'
+    return f"attachment; filename*=utf-8''{quoted}"
+
+
+def _chunked(parts: Iterable[str]) -> Iterator[bytes]:
+    """
+    Joins the small strings of parts into UTF-8 encoded chunks of about CHUNK_SIZE bytes.
+    """
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def _report_answers(report: dict) -> Iterator[tuple]:
+    """
+    Yields (question, category, answer) for every answer in the report_content of report.
+    """
+    for question, categories in (report.get("report_content") or {}).items():
+        for category, answers in categories.items():
+            for answer in answers:
+                yield question, category, answer
+
+
+def _csv_line(row: Iterable) -> str:
+    line = io.StringIO()
+    csv.writer(line).writerow(row)
+    return line.getvalue()
+
+
+def _csv_lines(rows: Iterable[Iterable]) -> Iterator[str]:
+    """
+    Formats every row as a line of CSV, without building the whole file in memory.
+    """
+    for row in rows:
+        yield _csv_line(row)
+
+
+def report_json(report: dict) -> Iterator[bytes]:
+    return _chunked(json.JSONEncoder(indent=4).iterencode(report))
+
+
+def report_csv(report: dict) -> Iterator[bytes]:
+    """
+    One row per answer with its question and category, the summary is the first row.
+    """
+    header = [
+        ["question", "category", "answer"],
+        ["Summary", "", report.get("Summary") or ""],
+    ]
+    return _chunked(_csv_lines(chain(header, _report_answers(report))))
+
+
+def report_markdown(report: dict) -> Iterator[bytes]:
+    """
+    The summary, followed by a section per question with the answers grouped by category.
+    """
+
+    def lines():
+        yield f"# Report for {report['course_id']} {report['course_semester']}, unit {report['unit_id']}\n\n"
+        yield f"Number of answers: {report['number_of_answers']}\n\n"
+        if report.get("Summary"):
+            yield f"## Summary\n\n{report['Summary']}\n\n"
+        for question, categories in (report.get("report_content") or {}).items():
+            yield f"## {question}\n\n"
+            for category, answers in categories.items():
+                yield f"### {category}\n\n"
+                for answer in answers:
+                    yield "- " + " ".join(str(answer).splitlines()) + "\n"
+                yield "\n"
+
+    return _chunked(lines())
+
+
+# The formats /download supports, by name: (file extension, media type, function that streams the report)
+REPORT_FORMATS = {
+    "json": ("json", "application/json", report_json),
+    "csv": ("csv", "text/csv; charset=utf-8", report_csv),
+    "markdown": ("md", "text/markdown; charset=utf-8", report_markdown),
+}
+
+
+# Columns of the CSV course export. Reports have one row with their summary, and one row per answer with its
+# question and category
+EXPORT_COLUMNS = [
+    "type",
+    "unit_id",
+    "unit_title",
+    "question_id",
+    "question",
+    "user_id",
+    "timestamp",
+    "category",
+    "body",
+]
+
+
+async def _achunked(parts: AsyncIterable[str]) -> AsyncIterator[bytes]:
+    """
+    Joins the small strings of parts into UTF-8 encoded chunks of about CHUNK_SIZE bytes.
+    """
+    buffer = []
+    size = 0
+    async for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer).encode("utf-8")
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def _split_summary(report: dict) -> Tuple[Optional[str], dict]:
+    """
+    Returns the summary and the categorized answers of a report, which stores the summary among the questions.
+    """
+    content = dict(report["report_content"])
+    return content.pop("Summary", None), content
+
+
+def course_export_ndjson(
+    reflections: AsyncIterable[dict],
+    reports: Optional[AsyncIterable[dict]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    One JSON object per line for every reflection, followed by one for every report.
+    """
+
+    async def lines():
+        async for reflection in reflections:
+            yield json.dumps({"type": "reflection", **reflection}, default=str) + "\n"
+        if reports is None:
+            return
+        async for report in reports:
+            summary, content = _split_summary(report)
+            yield json.dumps(
+                {
+                    "type": "report",
+                    **{key: report[key] for key in report if key != "report_content"},
+                    "Summary": summary,
+                    "report_content": content,
+                },
+                default=str,
+            ) + "\n"
+
+    return _achunked(lines())
+
+
+def course_export_csv(
+    reflections: AsyncIterable[dict],
+    reports: Optional[AsyncIterable[dict]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    One row per reflection, followed by the rows of every report, with the columns of EXPORT_COLUMNS.
+    """
+
+    async def lines():
+        yield _csv_line(EXPORT_COLUMNS)
+        async for reflection in reflections:
+            yield _csv_line(
+                [
+                    "reflection",
+                    *(reflection.get(column) for column in EXPORT_COLUMNS[1:]),
+                ]
+            )
+        if reports is None:
+            return
+        async for report in reports:
+            summary, content = _split_summary(report)
+            unit = [report["unit_id"], report["unit_title"]]
+            yield _csv_line(["report", *unit, "", "Summary", "", "", "", summary or ""])
+            for question, category, answer in _report_answers(
+                {"report_content": content}
+            ):
+                yield _csv_line(
+                    ["report", *unit, "", question, "", "", category, answer]
+                )
+
+    return _achunked(lines())
+
+
+async def gzip_stream(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """
+    Compresses a stream of chunks into a gzip file, one chunk at a time.
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# The formats of the course export, by name: (file extension, media type, function that streams the export)
+EXPORT_FORMATS = {
+    "ndjson": ("ndjson", "application/x-ndjson", course_export_ndjson),
+    "csv": ("csv", "text/csv; charset=utf-8", course_export_csv),
+}
@@ -0,0 +1,106 @@
+import asyncio
+from email.message import EmailMessage
+from email.utils import formataddr
+from typing import List, Optional
+
+import aiosmtplib
+from fastapi_mail import ConnectionConfig
+from starlette.config import Config
+
+config = Config(".env")
+
+email_config = ConnectionConfig(
+    MAIL_USERNAME=config("MAIL_USERNAME", cast=str, default=""),
+    MAIL_PASSWORD=config("MAIL_PASSWORD", cast=str, default=""),
+    MAIL_FROM=config("MAIL_FROM", cast=str, default="test@test.no"),
+    MAIL_PORT=config("MAIL_PORT", cast=int, default=587),
+    MAIL_SERVER=config("MAIL_SERVER", cast=str, default=""),
+    MAIL_FROM_NAME="Reflection Tool",
+    MAIL_STARTTLS=False,
+    MAIL_SSL_TLS=False,
+    USE_CREDENTIALS=False,
+    VALIDATE_CERTS=False,
+)
+
+
+class MailDispatcher:
+    """
+    Sends emails concurrently over a bounded pool of reused SMTP connections.
+
+    Each worker opens one connection and keeps sending the messages it takes from a shared queue,
+    so thousands of reminders do not pay for a new SMTP handshake per email. At most `concurrency`
+    connections are open at the same time.
+    """
+
+    def __init__(self, config: ConnectionConfig, concurrency: int = 5):
+        self.config = config
+        self.concurrency = max(1, concurrency)
+
+    def create_message(self, recipient: str, subject: str, html: str) -> EmailMessage:
+        """
+        Builds an HTML email from the sender configured in `config`.
+        """
+        message = EmailMessage()
+        message["From"] = formataddr(
+            (self.config.MAIL_FROM_NAME, self.config.MAIL_FROM)
+        )
+        message["To"] = recipient
+        message["Subject"] = subject
+        message.set_content(html, subtype="html")
+        return message
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=self.config.MAIL_SERVER,
+            port=self.config.MAIL_PORT,
+            timeout=self.config.TIMEOUT,
+            use_tls=self.config.MAIL_SSL_TLS,
+            start_tls=self.config.MAIL_STARTTLS,
+            validate_certs=self.config.VALIDATE_CERTS,
+            local_hostname=self.config.LOCAL_HOSTNAME,
+        )
+        await smtp.connect()
+        if self.config.USE_CREDENTIALS:
+            await smtp.login(
+                self.config.MAIL_USERNAME,
+                self.config.MAIL_PASSWORD.get_secret_value(),
+            )
+        return smtp
+
+    async def send_all(self, messages: List[EmailMessage]) -> List[Optional[Exception]]:
+        """
+        Sends every message and returns, in the same order, None for each message that was
+        delivered to the SMTP server and the raised exception for each message that was not.
+
+        A failed message closes its connection, the worker opens a new one for the next message.
+        """
+        results: List[Optional[Exception]] = [None] * len(messages)
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(len(messages)):
+            queue.put_nowait(index)
+
+        async def worker():
+            smtp = None
+            try:
+                while not queue.empty():
+                    index = queue.get_nowait()
+                    try:
+                        if smtp is None or not smtp.is_connected:
+                            smtp = await self._connect()
+                        await smtp.send_message(messages[index])
+                    except Exception as e:
+                        results[index] = e
+                        if smtp is not None:
+                            smtp.close()
+                            smtp = None
+            finally:
+                if smtp is not None and smtp.is_connected:
+                    try:
+                        await smtp.quit()
+                    except aiosmtplib.SMTPException:
+                        smtp.close()
+
+        await asyncio.gather(
+            *(worker() for _ in range(min(self.concurrency, len(messages))))
+        )
+        return results
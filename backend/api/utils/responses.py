@@ -0,0 +1,25 @@
+from typing import Any
+
+import orjson
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    Renders JSON with orjson, which is several times faster than json.dumps for large responses.
+    Dates and datetimes are written as ISO 8601 strings, like FastAPI's own encoder.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def rows_response(content: Any, response: Response) -> ORJSONResponse:
+    """
+    Returns content, built from plain rows, as JSON without validating it through the response_model,
+    with the headers an endpoint set on its `response` parameter, such as the ETag.
+    """
+    json_response = ORJSONResponse(content)
+    json_response.headers.raw.extend(response.headers.raw)
+    return json_response
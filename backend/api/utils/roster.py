@@ -0,0 +1,63 @@
+import csv
+import json
+from typing import AsyncIterator, Optional, Tuple
+
+ROSTER_ROLES = ["lecturer", "teaching assistant", "student"]
+
+
+async def _read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Splits a stream of bytes into decoded lines without reading the whole stream into memory.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8-sig").rstrip("\r")
+
+
+async def read_roster(
+    chunks: AsyncIterator[bytes], ndjson: bool = False
+) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """
+    Reads a roster of users, one per line, from a CSV file with a header row or from NDJSON.
+
+    Every row has a `uid`, and optionally an `email` and a `role`, which defaults to "student".
+    Yields (line number, row, None) for every valid row and (line number, None, error) for every
+    invalid row, so one bad row does not stop the import. Blank lines are skipped.
+    """
+    header = None
+    line_number = 0
+    async for line in _read_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+
+        if ndjson:
+            try:
+                values = json.loads(line)
+            except ValueError:
+                yield line_number, None, "Invalid JSON"
+                continue
+            if not isinstance(values, dict):
+                yield line_number, None, "Expected a JSON object"
+                continue
+        else:
+            fields = next(csv.reader([line]))
+            if header is None:
+                header = [field.strip().lower() for field in fields]
+                continue
+            values = dict(zip(header, fields))
+
+        uid = str(values.get("uid") or "").strip()
+        role = str(values.get("role") or "student").strip()
+        if not uid:
+            yield line_number, None, "Missing uid"
+        elif role not in ROSTER_ROLES:
+            yield line_number, None, f"Invalid role '{role}'"
+        else:
+            email = str(values.get("email") or "").strip()
+            yield line_number, {"uid": uid, "email": email, "role": role}, None
@@ -0,0 +1,88 @@
+"""
+Notification worker: sends the reminder emails queued in the notification outbox by /send-notifications.
+
+Run from the backend folder:
+
+    python -m api.worker           # keeps polling the outbox
+    python -m api.worker --once    # drains the outbox and exits
+"""
+
+import argparse
+import asyncio
+import logging
+
+from starlette.config import Config
+
+from api import crud
+from api.database import AsyncSessionLocal
+from api.utils.mail import MailDispatcher, email_config
+
+config = Config(".env")
+
+logger = logging.getLogger(__name__)
+
+# Number of SMTP connections used in parallel when sending notifications
+MAIL_CONCURRENCY = config("MAIL_CONCURRENCY", cast=int, default=5)
+OUTBOX_BATCH_SIZE = config("OUTBOX_BATCH_SIZE", cast=int, default=100)
+# A failed email is retried after OUTBOX_BACKOFF_SECONDS, doubled for every attempt
+OUTBOX_MAX_ATTEMPTS = config("OUTBOX_MAX_ATTEMPTS", cast=int, default=5)
+OUTBOX_BACKOFF_SECONDS = config("OUTBOX_BACKOFF_SECONDS", cast=int, default=30)
+# Claimed emails are retried by another worker if they are not completed within the lease
+OUTBOX_LEASE_SECONDS = config("OUTBOX_LEASE_SECONDS", cast=int, default=300)
+OUTBOX_POLL_SECONDS = config("OUTBOX_POLL_SECONDS", cast=int, default=10)
+
+
+async def drain_outbox(
+    dispatcher: MailDispatcher,
+    session_factory=AsyncSessionLocal,
+    batch_size: int = OUTBOX_BATCH_SIZE,
+    max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    backoff_seconds: int = OUTBOX_BACKOFF_SECONDS,
+    lease_seconds: int = OUTBOX_LEASE_SECONDS,
+) -> int:
+    """
+    Sends outbox messages batch by batch until no message is due, and returns the number of send attempts.
+    """
+    attempted = 0
+    while True:
+        async with session_factory() as db:
+            messages = await crud.claim_outbox_messages(db, batch_size, lease_seconds)
+            if not messages:
+                return attempted
+
+            errors = await dispatcher.send_all(
+                [
+                    dispatcher.create_message(
+                        recipient=message.recipient,
+                        subject=message.subject,
+                        html=message.body,
+                    )
+                    for message in messages
+                ]
+            )
+            await crud.complete_outbox_messages(
+                db, list(zip(messages, errors)), max_attempts, backoff_seconds
+            )
+            attempted += len(messages)
+
+
+async def run(once: bool = False):
+    dispatcher = MailDispatcher(email_config, concurrency=MAIL_CONCURRENCY)
+    while True:
+        attempted = await drain_outbox(dispatcher)
+        if attempted:
+            logger.info("Attempted to send %d notification emails", attempted)
+        if once:
+            return
+        await asyncio.sleep(OUTBOX_POLL_SECONDS)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)-5.5s [%(name)s] %(message)s"
+    )
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--once", action="store_true", help="drain the outbox once and exit"
+    )
+    asyncio.run(run(parser.parse_args().once))
@@ -0,0 +1,183 @@
+"""
+Benchmarks deleting a seeded, semester-sized course.
+
+Compares the old way of deleting (loading every row into the session and deleting it one by one)
+with the set-based DELETE statements of crud.delete_course and crud.delete_unit. Every run deletes
+a different course of the same size. Run from the backend folder:
+
+    python -m benchmark.bulk_delete
+    python -m benchmark.bulk_delete --database-url postgresql://user:pw@host/db
+"""
+
+import argparse
+import asyncio
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event, func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from api import crud, model
+from benchmark.seed import DEFAULT_DATABASE_URL, create_benchmark_engine, seed
+
+SEMESTER = "fall2023"
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def legacy_delete_records(db: Session, table, filters):
+    for record in db.scalars(select(table).where(*filters)).all():
+        db.delete(record)
+    db.commit()
+
+
+def legacy_delete_unit(db: Session, unit_id: int):
+    for reflection in db.scalars(
+        select(model.Reflection).where(model.Reflection.unit_id == unit_id)
+    ).all():
+        db.delete(reflection)
+    for report in db.scalars(
+        select(model.Report).where(model.Report.unit_id == unit_id)
+    ).all():
+        db.delete(report)
+    db.delete(db.get(model.Unit, unit_id))
+    db.commit()
+
+
+def legacy_delete_course(db: Session, course_id: str):
+    """
+    The row-by-row delete_course that crud.py used before, which leaves the reflections behind.
+    """
+    for table in [model.Enrollment, model.Unit, model.Invitation]:
+        legacy_delete_records(
+            db,
+            table,
+            [table.course_id == course_id, table.course_semester == SEMESTER],
+        )
+    legacy_delete_records(db, model.Question, [~model.Question.courses.any()])
+    db.delete(db.get(model.Course, (course_id, SEMESTER)))
+    db.commit()
+
+
+def reflections_left(engine, course_id: str) -> int:
+    with engine.connect() as connection:
+        return connection.scalar(
+            select(func.count())
+            .select_from(model.Reflection)
+            .where(
+                model.Reflection.user_id.like(f"student{int(course_id[3:]) - 4100}_%")
+            )
+        )
+
+
+def first_unit(engine, course_id: str) -> int:
+    with engine.connect() as connection:
+        return connection.scalar(
+            select(func.min(model.Unit.id)).where(model.Unit.course_id == course_id)
+        )
+
+
+async def measure(name, engine, statement_engine, course_id, delete):
+    """
+    Runs delete(), awaiting it if it is a coroutine, and prints its latency, the number of statements
+    it sent through statement_engine and the reflections of the course that are left afterwards.
+    """
+    with count_statements(statement_engine) as statements:
+        began = time.perf_counter()
+        result = delete()
+        if asyncio.iscoroutine(result):
+            await result
+        elapsed = time.perf_counter() - began
+    print(
+        f"{name:28} {elapsed * 1000:>10.1f} ms {len(statements):>8} statements "
+        f"{reflections_left(engine, course_id):>8} reflections left in course"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--students", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = create_benchmark_engine(args.database_url)
+    url = make_url(args.database_url)
+    async_engine = create_async_engine(
+        url.set(
+            drivername=(
+                "sqlite+aiosqlite"
+                if url.drivername.startswith("sqlite")
+                else "postgresql+asyncpg"
+            )
+        )
+    )
+    AsyncSessionLocal = async_sessionmaker(
+        bind=async_engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+    counts = seed(engine, students_per_course=args.students)
+    print(
+        f"Seeded {counts['reflections'] // counts['courses']} reflections per course\n"
+    )
+
+    async def delete_unit(course_id):
+        async with AsyncSessionLocal() as db:
+            await crud.delete_unit(
+                db, first_unit(engine, course_id), course_id, SEMESTER
+            )
+
+    async def delete_course(course_id):
+        async with AsyncSessionLocal() as db:
+            await crud.delete_course(db, course_id, SEMESTER)
+
+    with Session(engine) as db:
+        await measure(
+            "row by row delete_unit",
+            engine,
+            engine,
+            "TDT4100",
+            lambda: legacy_delete_unit(db, first_unit(engine, "TDT4100")),
+        )
+    await measure(
+        "set-based delete_unit",
+        engine,
+        async_engine.sync_engine,
+        "TDT4101",
+        lambda: delete_unit("TDT4101"),
+    )
+
+    with Session(engine) as db:
+        await measure(
+            "row by row delete_course",
+            engine,
+            engine,
+            "TDT4102",
+            lambda: legacy_delete_course(db, "TDT4102"),
+        )
+    await measure(
+        "set-based delete_course",
+        engine,
+        async_engine.sync_engine,
+        "TDT4103",
+        lambda: delete_course("TDT4103"),
+    )
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
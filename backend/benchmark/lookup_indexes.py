@@ -0,0 +1,184 @@
+"""
+Benchmarks the hot lookup paths of api/crud.py with and without the secondary indexes
+declared in api/model.py.
+
+Prints the query plan and the mean/p95 latency of every lookup, then drops the secondary
+indexes and measures again. Run from the backend folder:
+
+    python -m benchmark.lookup_indexes
+    python -m benchmark.lookup_indexes --database-url postgresql://user:pw@host/db
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import and_, exists, not_, select, text
+
+from api import model
+from benchmark.seed import DEFAULT_DATABASE_URL, create_benchmark_engine, seed
+
+
+def lookups(rng, counts):
+    """
+    Returns (name, statement factory) pairs that mirror the filters used in crud.py.
+    Every factory draws new parameters so that repeated runs do not hit the same rows.
+    """
+    courses = counts["courses"]
+    units = counts["units"]
+    students = counts["enrollment"] // courses
+
+    def course():
+        return f"TDT{4100 + rng.randrange(courses)}", "fall2023"
+
+    def student(course_id):
+        return f"student{int(course_id[3:]) - 4100}_{rng.randrange(students)}"
+
+    def user_already_reflected_on_question():
+        course_id, _ = course()
+        return select(model.Reflection.id).where(
+            model.Reflection.unit_id == rng.randrange(1, units + 1),
+            model.Reflection.user_id == student(course_id),
+            model.Reflection.question_id == 1,
+        )
+
+    def reflections_for_user():
+        course_id, _ = course()
+        return select(model.Reflection).where(
+            model.Reflection.user_id == student(course_id)
+        )
+
+    def reflections_for_unit():
+        return select(model.Reflection).where(
+            model.Reflection.unit_id == rng.randrange(1, units + 1)
+        )
+
+    def get_report():
+        course_id, semester = course()
+        return select(model.Report).where(
+            model.Report.unit_id == rng.randrange(1, units + 1),
+            model.Report.course_id == course_id,
+            model.Report.course_semester == semester,
+        )
+
+    def get_units():
+        course_id, semester = course()
+        return select(model.Unit).where(
+            model.Unit.course_id == course_id,
+            model.Unit.course_semester == semester,
+        )
+
+    def get_all_students_in_course():
+        course_id, semester = course()
+        return (
+            select(model.User)
+            .join(model.Enrollment)
+            .where(
+                model.Enrollment.course_id == course_id,
+                model.Enrollment.course_semester == semester,
+                model.Enrollment.role == "student",
+            )
+        )
+
+    def get_invitations():
+        course_id, _ = course()
+        return select(model.Invitation).where(
+            model.Invitation.uid == student(course_id)
+        )
+
+    def get_units_to_notify():
+        course_id, semester = course()
+        reflected = exists().where(
+            and_(
+                model.Reflection.unit_id == model.Unit.id,
+                model.Reflection.user_id == student(course_id),
+            )
+        )
+        return select(model.Unit).where(
+            model.Unit.course_id == course_id,
+            model.Unit.course_semester == semester,
+            model.Unit.hidden == False,
+            not_(reflected),
+        )
+
+    return [
+        ("user_already_reflected_on_question", user_already_reflected_on_question),
+        ("reflections by user (/user)", reflections_for_user),
+        ("reflections by unit (/units)", reflections_for_unit),
+        ("get_report", get_report),
+        ("get_units", get_units),
+        ("get_all_students_in_course", get_all_students_in_course),
+        ("get_invitations", get_invitations),
+        ("get_units_to_notify", get_units_to_notify),
+    ]
+
+
+def explain(connection, statement):
+    compiled = statement.compile(
+        dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+    )
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+        return [row[-1] for row in rows]
+    rows = connection.execute(text(f"EXPLAIN ANALYZE {compiled}")).all()
+    return [row[0] for row in rows]
+
+
+def measure(engine, cases, iterations, show_plans):
+    results = {}
+    with engine.connect() as connection:
+        for name, factory in cases:
+            if show_plans:
+                print(f"\n-- {name}")
+                for line in explain(connection, factory()):
+                    print(f"   {line}")
+            timings = []
+            for _ in range(iterations):
+                statement = factory()
+                began = time.perf_counter()
+                connection.execute(statement).all()
+                timings.append((time.perf_counter() - began) * 1000)
+            timings.sort()
+            results[name] = (
+                statistics.mean(timings),
+                timings[int(len(timings) * 0.95) - 1],
+            )
+    return results
+
+
+def drop_secondary_indexes(engine):
+    for table in model.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.drop(engine, checkfirst=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--students", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_benchmark_engine(args.database_url)
+    counts = seed(engine, students_per_course=args.students)
+    print(f"Seeded {counts['reflections']} reflections")
+
+    cases = lookups(random.Random(1), counts)
+    print("\n== Query plans with secondary indexes")
+    indexed = measure(engine, cases, args.iterations, show_plans=True)
+
+    drop_secondary_indexes(engine)
+    print("\n== Query plans without secondary indexes")
+    unindexed = measure(engine, cases, args.iterations, show_plans=True)
+
+    print(f"\n{'lookup':40} {'indexed mean/p95 ms':>22} {'no index mean/p95 ms':>22}")
+    for name, _ in cases:
+        print(
+            f"{name:40} {indexed[name][0]:>10.2f} /{indexed[name][1]:>9.2f} "
+            f"{unindexed[name][0]:>10.2f} /{unindexed[name][1]:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
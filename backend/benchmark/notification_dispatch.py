@@ -0,0 +1,140 @@
+"""
+Benchmarks sending reminder emails to a local aiosmtpd server.
+
+Compares the old way of sending (a new FastMail connection per student, one after another)
+with MailDispatcher at different concurrency levels. Run from the backend folder:
+
+    python -m benchmark.notification_dispatch --recipients 5000
+"""
+
+import argparse
+import asyncio
+import socket
+import time
+
+from aiosmtpd.controller import Controller
+from fastapi_mail import ConnectionConfig, FastMail, MessageSchema
+
+from api.utils.mail import MailDispatcher
+
+
+class CountingHandler:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.messages = 0
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        # Simulates the round trip to a remote mail server
+        await asyncio.sleep(self.latency)
+        self.messages += 1
+        self.sessions.add(session)
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def mail_config(port: int) -> ConnectionConfig:
+    return ConnectionConfig(
+        MAIL_USERNAME="",
+        MAIL_PASSWORD="",
+        MAIL_FROM="test@test.no",
+        MAIL_PORT=port,
+        MAIL_SERVER="127.0.0.1",
+        MAIL_FROM_NAME="Reflection Tool",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=False,
+        VALIDATE_CERTS=False,
+    )
+
+
+BODY = (
+    "<p>Dear student,</p><p>This is a reminder to answer the recent learning unit.</p>"
+)
+
+
+async def send_one_connection_per_message(config, recipients):
+    for recipient in recipients:
+        message = MessageSchema(
+            subject="TDT4100 - Missing Reflection",
+            recipients=[recipient],
+            body=BODY,
+            subtype="html",
+        )
+        await FastMail(config).send_message(message)
+
+
+async def send_with_dispatcher(config, recipients, concurrency):
+    dispatcher = MailDispatcher(config, concurrency=concurrency)
+    errors = await dispatcher.send_all(
+        [
+            dispatcher.create_message(recipient, "TDT4100 - Missing Reflection", BODY)
+            for recipient in recipients
+        ]
+    )
+    assert not any(errors), next(error for error in errors if error)
+
+
+def run(name, handler, coroutine):
+    handler.messages = 0
+    handler.sessions = set()
+    began = time.perf_counter()
+    asyncio.run(coroutine)
+    elapsed = time.perf_counter() - began
+    print(
+        f"{name:36} {elapsed:>8.2f}s {handler.messages / elapsed:>10.0f} msg/s "
+        f"{len(handler.sessions):>6} connections"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--recipients", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=20,
+        help="Delay added by the SMTP server to every message, to mimic a remote server",
+    )
+    parser.add_argument(
+        "--skip-baseline",
+        action="store_true",
+        help="Do not run the one-connection-per-message baseline",
+    )
+    args = parser.parse_args()
+
+    handler = CountingHandler(args.latency_ms / 1000)
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    config = mail_config(controller.port)
+    recipients = [f"student{i}@stud.ntnu.no" for i in range(args.recipients)]
+
+    print(
+        f"Sending {args.recipients} reminders to a local aiosmtpd server "
+        f"with {args.latency_ms:g} ms latency\n"
+    )
+    try:
+        if not args.skip_baseline:
+            run(
+                "FastMail, new connection per email",
+                handler,
+                send_one_connection_per_message(config, recipients),
+            )
+        for concurrency in args.concurrency:
+            run(
+                f"MailDispatcher, concurrency {concurrency}",
+                handler,
+                send_with_dispatcher(config, recipients, concurrency),
+            )
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Benchmarks the overhead of a call to the OpenAI API against a local fake OpenAI compatible server.
+
+Compares the old way (a new OpenAI client, and so a new connection pool, for every call) with the shared
+clients of prompting.clients. The fake server answers over plain HTTP, so the TLS handshake that a new
+client also pays against api.openai.com is not part of the numbers. Run from the backend folder:
+
+    python -m benchmark.openai_clients --calls 500
+"""
+
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from openai import AsyncOpenAI, OpenAI
+
+from prompting.clients import ClientRegistry
+
+COMPLETION = {
+    "id": "chatcmpl-benchmark",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-3.5-turbo-1106",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": '{"summary": "Benchmark"}'},
+            "finish_reason": "stop",
+        }
+    ],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+}
+
+MESSAGES = [
+    {
+        "role": "system",
+        "content": "You are a helpful assistant designed to output JSON.",
+    },
+    {"role": "user", "content": "Summarize the feedback."},
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class FakeOpenAI:
+    """
+    An OpenAI compatible server that answers every chat completion with COMPLETION, and records the
+    client address of every request to count the connections that were opened.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = set()
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.chat_completions)
+
+    async def chat_completions(self, request: Request):
+        self.connections.add((request.client.host, request.client.port))
+        await asyncio.sleep(self.latency)
+        return COMPLETION
+
+    def start(self, port: int) -> uvicorn.Server:
+        server = uvicorn.Server(
+            uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="warning")
+        )
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.01)
+        return server
+
+
+def new_client_per_call(base_url, calls):
+    for _ in range(calls):
+        client = OpenAI(api_key="benchmark", base_url=base_url)
+        client.chat.completions.create(model="gpt-3.5-turbo-1106", messages=MESSAGES)
+
+
+def shared_client(base_url, calls):
+    registry = ClientRegistry(base_url=base_url)
+    for _ in range(calls):
+        client = registry.get("benchmark")
+        client.chat.completions.create(model="gpt-3.5-turbo-1106", messages=MESSAGES)
+
+
+async def new_async_client_per_call(base_url, calls):
+    for _ in range(calls):
+        async with AsyncOpenAI(api_key="benchmark", base_url=base_url) as client:
+            await client.chat.completions.create(
+                model="gpt-3.5-turbo-1106", messages=MESSAGES
+            )
+
+
+async def shared_async_client(base_url, calls):
+    registry = ClientRegistry(base_url=base_url)
+    for _ in range(calls):
+        client = registry.get_async("benchmark")
+        await client.chat.completions.create(
+            model="gpt-3.5-turbo-1106", messages=MESSAGES
+        )
+    await registry.aclose()
+
+
+def run(name, server, calls, function, *args):
+    server.connections = set()
+    began = time.perf_counter()
+    result = function(*args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+    elapsed = time.perf_counter() - began
+    print(
+        f"{name:28} {elapsed * 1000 / calls:>8.2f} ms/call "
+        f"{len(server.connections):>6} connections"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0,
+        help="Delay added by the fake server to every completion, 0 measures only the overhead",
+    )
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.latency_ms / 1000)
+    server = fake.start(free_port())
+    base_url = f"http://127.0.0.1:{server.config.port}/v1"
+
+    print(
+        f"{args.calls} chat completions against a local fake OpenAI server "
+        f"with {args.latency_ms:g} ms latency\n"
+    )
+    try:
+        run(
+            "OpenAI per call",
+            fake,
+            args.calls,
+            new_client_per_call,
+            base_url,
+            args.calls,
+        )
+        run("Shared OpenAI", fake, args.calls, shared_client, base_url, args.calls)
+        run(
+            "AsyncOpenAI per call",
+            fake,
+            args.calls,
+            new_async_client_per_call,
+            base_url,
+            args.calls,
+        )
+        run(
+            "Shared AsyncOpenAI",
+            fake,
+            args.calls,
+            shared_async_client,
+            base_url,
+            args.calls,
+        )
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
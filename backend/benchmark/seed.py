@@ -0,0 +1,190 @@
+"""
+Seeds a database with a large, semester-sized data set for the benchmarks in this package.
+
+Rows are written with executemany-style Core inserts so that seeding 100k+ reflections
+only takes a few seconds on sqlite.
+"""
+
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, insert
+
+from api import model
+
+DEFAULT_DATABASE_URL = "sqlite:///./benchmark.db"
+
+
+def create_benchmark_engine(database_url: str = DEFAULT_DATABASE_URL):
+    if database_url.startswith("sqlite"):
+        return create_engine(database_url, connect_args={"check_same_thread": False})
+    return create_engine(database_url)
+
+
+def seed(
+    engine,
+    courses: int = 4,
+    units_per_course: int = 25,
+    students_per_course: int = 1000,
+    answer_rate: float = 0.6,
+    random_seed: int = 0,
+):
+    """
+    Drops and recreates every table, then fills it with courses, units, students, reflections,
+    reports, invitations and notification counts.
+
+    Parameters:
+    - engine: The SQLAlchemy engine to seed.
+    - courses (int): Number of courses to create.
+    - units_per_course (int): Number of weekly units in every course.
+    - students_per_course (int): Number of students enrolled in every course.
+    - answer_rate (float): Share of (student, unit) pairs that have been reflected on.
+    - random_seed (int): Seed for the random generator, so runs are reproducible.
+
+    Returns:
+    - dict: The number of rows inserted per table.
+    """
+    rng = random.Random(random_seed)
+    model.Base.metadata.drop_all(engine)
+    model.Base.metadata.create_all(engine)
+
+    start = date.today() - timedelta(weeks=units_per_course // 2)
+    rows = {
+        "users": [],
+        "courses": [],
+        "questions": [],
+        "course_question": [],
+        "enrollment": [],
+        "units": [],
+        "reports": [],
+        "reflections": [],
+        "invitations": [],
+        "user_unit_notification_counts": [],
+    }
+
+    unit_id = 0
+    question_id = 0
+    reflection_id = 0
+    for c in range(courses):
+        course_id = f"TDT{4100 + c}"
+        semester = "fall2023"
+        rows["courses"].append(
+            {"id": course_id, "semester": semester, "name": f"Course {c}"}
+        )
+
+        course_questions = []
+        for question, comment in [
+            ("Teaching", "What was your best learning success in this unit? Why?"),
+            ("Difficult", "What was your least understood concept in this unit? Why?"),
+        ]:
+            question_id += 1
+            course_questions.append(question_id)
+            rows["questions"].append(
+                {"id": question_id, "question": question, "comment": comment}
+            )
+            rows["course_question"].append(
+                {
+                    "question_id": question_id,
+                    "course_id": course_id,
+                    "course_semester": semester,
+                }
+            )
+
+        course_units = []
+        for u in range(units_per_course):
+            unit_id += 1
+            course_units.append(unit_id)
+            rows["units"].append(
+                {
+                    "id": unit_id,
+                    "title": f"Unit {u + 1}",
+                    "hidden": False,
+                    "date_available": start + timedelta(weeks=u),
+                    "course_id": course_id,
+                    "course_semester": semester,
+                    "reflections_since_last_report": 0,
+                }
+            )
+            rows["reports"].append(
+                {
+                    "id": unit_id,
+                    "report_content": [],
+                    "number_of_answers": 0,
+                    "unit_id": unit_id,
+                    "course_id": course_id,
+                    "course_semester": semester,
+                }
+            )
+
+        for s in range(students_per_course):
+            uid = f"student{c}_{s}"
+            rows["users"].append(
+                {"uid": uid, "email": f"{uid}@stud.ntnu.no", "admin": False}
+            )
+            rows["enrollment"].append(
+                {
+                    "uid": uid,
+                    "course_id": course_id,
+                    "course_semester": semester,
+                    "role": "student",
+                }
+            )
+            if s % 50 == 0:
+                rows["invitations"].append(
+                    {
+                        "uid": uid,
+                        "course_id": course_id,
+                        "course_semester": semester,
+                        "role": "teaching assistant",
+                    }
+                )
+            for u in course_units:
+                if rng.random() < answer_rate:
+                    for q in course_questions:
+                        reflection_id += 1
+                        rows["reflections"].append(
+                            {
+                                "id": reflection_id,
+                                "body": f"Answer from {uid} to question {q}",
+                                "timestamp": date.today(),
+                                "user_id": uid,
+                                "unit_id": u,
+                                "question_id": q,
+                            }
+                        )
+                elif rng.random() < 0.5:
+                    rows["user_unit_notification_counts"].append(
+                        {"user_id": uid, "unit_id": u, "notification_count": 1}
+                    )
+
+    tables = model.Base.metadata.tables
+    with engine.begin() as connection:
+        for table_name, table_rows in rows.items():
+            for i in range(0, len(table_rows), 10_000):
+                connection.execute(
+                    insert(tables[table_name]), table_rows[i : i + 10_000]
+                )
+
+    return {table_name: len(table_rows) for table_name, table_rows in rows.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a benchmark database")
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--courses", type=int, default=4)
+    parser.add_argument("--units", type=int, default=25)
+    parser.add_argument("--students", type=int, default=1000)
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    counts = seed(
+        create_benchmark_engine(args.database_url),
+        courses=args.courses,
+        units_per_course=args.units,
+        students_per_course=args.students,
+    )
+    for table_name, count in counts.items():
+        print(f"{table_name:32} {count:>8}")
+    print(f"Seeded in {time.perf_counter() - began:.1f}s")
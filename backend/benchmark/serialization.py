@@ -0,0 +1,152 @@
+"""
+Benchmarks building the JSON of /course and /report for a large seeded course.
+
+Compares the old way (loading ORM objects, validating them through the response_model or jsonable_encoder
+and dumping them with json.dumps) with column rows written with orjson, which /course and /report use now.
+Run from the backend folder:
+
+    python -m benchmark.serialization
+    python -m benchmark.serialization --students 1500 --database-url postgresql://user:pw@host/db
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, selectinload
+
+from api import crud, model, schemas
+from api.utils.responses import ORJSONResponse
+from benchmark.seed import DEFAULT_DATABASE_URL, create_benchmark_engine, seed
+
+COURSE_ID = "TDT4100"
+SEMESTER = "fall2023"
+
+course_adapter = TypeAdapter(schemas.Course)
+
+
+def seed_report(engine, answers: int):
+    """
+    Fills the report of the first unit with answers answers per question, sorted into categories.
+    """
+    content = {
+        question: {
+            f"Category {category}": [
+                f"Answer {answer} about {question.lower()} in category {category}"
+                for answer in range(category, answers, 10)
+            ]
+            for category in range(10)
+        }
+        for question in ["What went well?", "What was difficult?"]
+    }
+    content["Summary"] = "Most students found the unit useful. " * 20
+    with Session(engine) as db:
+        report = db.scalar(select(model.Report).where(model.Report.unit_id == 1))
+        report.report_content = content
+        report.number_of_answers = answers
+        db.commit()
+
+
+async def legacy_course(db: AsyncSession) -> bytes:
+    """
+    The old /course: the course with its relations as ORM objects, validated through schemas.Course.
+    """
+    course = await db.scalar(
+        select(model.Course)
+        .where(model.Course.id == COURSE_ID, model.Course.semester == SEMESTER)
+        .options(
+            selectinload(model.Course.questions),
+            selectinload(model.Course.users),
+            selectinload(model.Course.reports),
+        )
+    )
+    return course_adapter.dump_json(
+        course_adapter.validate_python(course, from_attributes=True)
+    )
+
+
+async def rows_course(db: AsyncSession) -> bytes:
+    return ORJSONResponse(await crud.get_course_rows(db, COURSE_ID, SEMESTER)).body
+
+
+async def legacy_report(db: AsyncSession) -> bytes:
+    """
+    The old /report: the ORM object through jsonable_encoder and json.dumps.
+    """
+    report = await crud.get_report(db, COURSE_ID, 1, SEMESTER)
+    return json.dumps(jsonable_encoder(report)).encode("utf-8")
+
+
+async def rows_report(db: AsyncSession) -> bytes:
+    """
+    The new /report: the columns of the report, as main.to_dict returns them, written with orjson.
+    """
+    report = await crud.get_report(db, COURSE_ID, 1, SEMESTER)
+    return ORJSONResponse(
+        {
+            column.name: getattr(report, column.name)
+            for column in report.__table__.columns
+        }
+    ).body
+
+
+async def measure(name, session_factory, build, repeat):
+    """
+    Builds the response repeat times, each in a new session, and prints the median latency and its size.
+    """
+    timings = []
+    for _ in range(repeat):
+        async with session_factory() as db:
+            began = time.perf_counter()
+            body = await build(db)
+            timings.append(time.perf_counter() - began)
+    timings.sort()
+    print(
+        f"{name:24} {timings[len(timings) // 2] * 1000:>8.2f} ms {len(body) / 1000:>8.1f} kB"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL)
+    parser.add_argument("--students", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_benchmark_engine(args.database_url)
+    url = make_url(args.database_url)
+    async_engine = create_async_engine(
+        url.set(
+            drivername=(
+                "sqlite+aiosqlite"
+                if url.drivername.startswith("sqlite")
+                else "postgresql+asyncpg"
+            )
+        )
+    )
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession)
+
+    seed(engine, courses=1, students_per_course=args.students)
+    seed_report(engine, args.students)
+    print(f"Seeded a course with {args.students} students\n")
+
+    await measure(
+        "/course response_model", AsyncSessionLocal, legacy_course, args.repeat
+    )
+    await measure("/course rows + orjson", AsyncSessionLocal, rows_course, args.repeat)
+    await measure(
+        "/report jsonable_encoder", AsyncSessionLocal, legacy_report, args.repeat
+    )
+    await measure("/report rows + orjson", AsyncSessionLocal, rows_report, args.repeat)
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
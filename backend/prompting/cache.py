@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+from typing import Any, Dict, Optional
+
+from starlette.config import Config
+
+config = Config(".env")
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Stores the responses of the OpenAI API in a SQLite file, by a hash of the model, the prompts and the
+    temperature of the request. The prompting functions send their requests with temperature 0, so the
+    same prompt gets the same response, and regenerating a report for unchanged reflections, or retrying
+    it after a later step failed, does not pay for the same requests again.
+
+    Responses expire ttl seconds after they were stored, and the least recently used responses are evicted
+    when they take up more than max_bytes. Set ttl to 0 to disable the cache.
+
+    The cache never fails a request: if the file cannot be read, a response is sent for again, and if it
+    cannot be written, the response is not stored. Both are logged and counted as errors.
+    """
+
+    def __init__(
+        self, path: str, ttl: float = 7 * 24 * 3600, max_bytes: int = 100_000_000
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(completion: Dict[str, Any]) -> Optional[str]:
+        """
+        Returns the key of the arguments of a chat completion, or None if the response is not deterministic.
+        """
+        if completion.get("temperature") != 0:
+            return None
+        prompts = {
+            message["role"]: message["content"] for message in completion["messages"]
+        }
+        content = json.dumps(
+            [
+                completion["model"],
+                prompts.get("system"),
+                prompts.get("user"),
+                completion["temperature"],
+            ]
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, content TEXT, size INTEGER, created REAL, accessed REAL)"
+        )
+        return db
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the response stored under key, or None if it is missing or has expired.
+        """
+        now = time.time()
+        try:
+            with closing(self._connect()) as db, db:
+                row = db.execute(
+                    "SELECT content FROM responses WHERE key = ? AND created > ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is not None:
+                    db.execute(
+                        "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+                    )
+        except sqlite3.Error as e:
+            logger.warning(
+                "Could not read the OpenAI response cache %s: %s", self.path, e
+            )
+            self.errors += 1
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, key: str, content: str):
+        """
+        Stores content under key, and evicts the expired and the least recently used responses.
+        """
+        now = time.time()
+        try:
+            self._store(key, content, now)
+        except sqlite3.Error as e:
+            logger.warning(
+                "Could not write the OpenAI response cache %s: %s", self.path, e
+            )
+            self.errors += 1
+
+    def _store(self, key: str, content: str, now: float):
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, content, len(content.encode()), now, now),
+            )
+            self.evictions += db.execute(
+                "DELETE FROM responses WHERE created <= ?", (now - self.ttl,)
+            ).rowcount
+            excess = (
+                db.execute("SELECT SUM(size) FROM responses").fetchone()[0]
+                - self.max_bytes
+            )
+            if excess > 0:
+                evicted = []
+                for evicted_key, size in db.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ):
+                    if excess <= 0:
+                        break
+                    evicted.append((evicted_key,))
+                    excess -= size
+                db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+                self.evictions += len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+
+# Serverless deployments can only write to the temporary directory
+if config("SERVERLESS", cast=bool, default=False):
+    DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "llm_cache.db")
+else:
+    DEFAULT_PATH = "llm_cache.db"
+
+# The cache used by the prompting functions, set LLM_CACHE_TTL_SECONDS=0 to disable it
+responses = ResponseCache(
+    path=config("LLM_CACHE_PATH", default=DEFAULT_PATH),
+    ttl=config("LLM_CACHE_TTL_SECONDS", cast=float, default=7 * 24 * 3600),
+    max_bytes=config("LLM_CACHE_MAX_MB", cast=float, default=100) * 1_000_000,
+)
+
+
+def cached_completion(
+    client, completion: Dict[str, Any], use_cache: bool = True
+) -> Any:
+    """
+    Sends the chat completion with client, and returns the JSON of its response. The response is read from
+    the response cache if the same request was sent before, unless use_cache is False, and is stored in it
+    otherwise.
+    """
+    key = ResponseCache.key(completion) if responses.ttl > 0 else None
+    content = responses.get(key) if key and use_cache else None
+    if content is None:
+        response = client.chat.completions.create(**completion)
+        content = response.choices[0].message.content
+        response_json = json.loads(content)
+        if key:
+            responses.set(key, content)
+        return response_json
+    return json.loads(content)
+
+
+async def cached_completion_async(
+    client, completion: Dict[str, Any], use_cache: bool = True
+) -> Any:
+    """
+    Same as cached_completion, for an AsyncOpenAI client. The cache is read and written in a thread, so the
+    event loop is not blocked by the disk.
+    """
+    key = ResponseCache.key(completion) if responses.ttl > 0 else None
+    content = await asyncio.to_thread(responses.get, key) if key and use_cache else None
+    if content is None:
+        response = await client.chat.completions.create(**completion)
+        content = response.choices[0].message.content
+        response_json = json.loads(content)
+        if key:
+            await asyncio.to_thread(responses.set, key, content)
+        return response_json
+    return json.loads(content)
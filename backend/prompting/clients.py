@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import weakref
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+import openai
+from openai import AsyncOpenAI, OpenAI
+from starlette.config import Config
+
+config = Config(".env")
+
+logger = logging.getLogger(__name__)
+
+# API key and base URL of a client
+ClientKey = Tuple[str, Optional[str]]
+
+# The connection limits class of the HTTP library the OpenAI SDK is built on
+Limits = type(openai.DEFAULT_CONNECTION_LIMITS)
+
+
+def _close_in_loop(loop: asyncio.AbstractEventLoop, close: Callable[[], Awaitable]):
+    """
+    Runs close in the event loop the connections of an async client belong to, from any thread. The
+    connections of a closed loop cannot be closed anymore.
+    """
+    if not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(close(), loop)
+
+
+class ClientRegistry:
+    """
+    Keeps one OpenAI and one AsyncOpenAI client per API key and base URL, so every call with the same key
+    reuses the connection pool, and the TLS sessions, of the previous calls instead of opening new ones.
+
+    Lecturers send their own API key with every report, so at most max_clients keys are kept, and the
+    least recently used client is evicted when a new key is seen. An evicted client can still be in the
+    middle of a request of a concurrent caller, so it is not closed right away: its connections are closed
+    when the last caller is done with it and the client is garbage collected.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        timeout: float = 120,
+        connect_timeout: float = 10,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        max_clients: int = 32,
+    ):
+        self.base_url = base_url
+        self.timeout = openai.Timeout(timeout, connect=connect_timeout)
+        self.limits = Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.max_clients = max_clients
+        self._clients: "OrderedDict[ClientKey, OpenAI]" = OrderedDict()
+        # Async clients hold connections of the event loop they were created in, so every loop has its own
+        self._async_clients: (
+            "OrderedDict[Tuple[ClientKey, asyncio.AbstractEventLoop], AsyncOpenAI]"
+        ) = OrderedDict()
+
+    def get(self, api_key: str, base_url: Optional[str] = None) -> OpenAI:
+        """
+        Returns the OpenAI client for api_key, created the first time the key is used.
+        """
+        key = (api_key, base_url or self.base_url)
+        client = self._clients.get(key)
+        if client is None:
+            http_client = openai.DefaultHttpxClient(limits=self.limits)
+            client = OpenAI(
+                api_key=api_key,
+                base_url=key[1],
+                timeout=self.timeout,
+                http_client=http_client,
+            )
+            weakref.finalize(client, http_client.close)
+            self._clients[key] = client
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        self._clients.move_to_end(key)
+        return client
+
+    def get_async(self, api_key: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+        """
+        Returns the AsyncOpenAI client for api_key in the running event loop, created the first time the
+        key is used in the loop.
+        """
+        loop = asyncio.get_running_loop()
+        key = ((api_key, base_url or self.base_url), loop)
+        client = self._async_clients.get(key)
+        if client is None:
+            self._drop_closed_loops()
+            http_client = openai.DefaultAsyncHttpxClient(limits=self.limits)
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=key[0][1],
+                timeout=self.timeout,
+                http_client=http_client,
+            )
+            weakref.finalize(client, _close_in_loop, loop, http_client.aclose)
+            self._async_clients[key] = client
+            if len(self._async_clients) > self.max_clients:
+                self._async_clients.popitem(last=False)
+        self._async_clients.move_to_end(key)
+        return client
+
+    def _drop_closed_loops(self):
+        closed = [key for key in self._async_clients if key[1].is_closed()]
+        for key in closed:
+            del self._async_clients[key]
+        if closed:
+            logger.info(
+                "Dropped %d OpenAI clients of closed event loops, their connections are "
+                "released when they are garbage collected",
+                len(closed),
+            )
+
+    async def aclose(self):
+        """
+        Closes the clients and their connections, used when the application shuts down. Async clients of
+        other event loops are closed in their own loop.
+        """
+        loop = asyncio.get_running_loop()
+        for client in self._clients.values():
+            client.close()
+        for (_, client_loop), client in self._async_clients.items():
+            if client_loop is loop:
+                await client.close()
+            else:
+                _close_in_loop(client_loop, client.close)
+        self._clients.clear()
+        self._async_clients.clear()
+
+
+# The clients used by the prompting functions
+clients = ClientRegistry(
+    base_url=config("OPENAI_BASE_URL", default=None) or None,
+    timeout=config("OPENAI_TIMEOUT_SECONDS", cast=float, default=120),
+    connect_timeout=config("OPENAI_CONNECT_TIMEOUT_SECONDS", cast=float, default=10),
+    max_connections=config("OPENAI_MAX_CONNECTIONS", cast=int, default=20),
+    max_keepalive_connections=config(
+        "OPENAI_MAX_KEEPALIVE_CONNECTIONS", cast=int, default=10
+    ),
+)
+
+
+def openai_client(api_key: str) -> OpenAI:
+    return clients.get(api_key)
+
+
+def async_openai_client(api_key: str) -> AsyncOpenAI:
+    return clients.get_async(api_key)
@@ -1,9 +1,135 @@
-from openai import OpenAI, OpenAIError, RateLimitError
+import asyncio
 import json
-from api.utils.exceptions import DataProcessingError, OpenAIRequestError
+from api.utils.exceptions import DataProcessingError, openai_errors
+from prompting.cache import cached_completion, cached_completion_async
+from prompting.clients import async_openai_client, openai_client
 
+# Context window of each model, in tokens
+CONTEXT_WINDOWS = {"gpt-3.5-turbo-1106": 16385, "gpt-4-0125-preview": 128000}
 
-def createCategories(api_key, questions, student_feedback, use_cheap_model=True):
+# Share of the context window the feedback of one shard may fill, the rest is left for the instructions and
+# the response, and for text that has more tokens than estimated
+FEEDBACK_SHARE = 0.5
+
+
+def _model(use_cheap_model):
+    if use_cheap_model:
+        return "gpt-3.5-turbo-1106"
+    return "gpt-4-0125-preview"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of text, at about four characters per token.
+    """
+    return len(text) // 4 + 1
+
+
+def estimate_chunk_size(student_feedback, use_cheap_model=True) -> int:
+    """
+    Returns the number of students whose feedback fits in one categorization prompt, from the estimated
+    number of tokens of the feedback of an average student.
+    """
+    budget = CONTEXT_WINDOWS[_model(use_cheap_model)] * FEEDBACK_SHARE
+    tokens = estimate_tokens(json.dumps(student_feedback, indent=2))
+    tokens_per_student = tokens / len(student_feedback)
+    return max(1, int(budget // tokens_per_student))
+
+
+def question_categories(categories, questions, index):
+    """
+    Returns the categories createCategories found for questions[index]. They are listed under the question,
+    under "Question<number>", or in the order of the questions, otherwise every category is returned.
+    """
+    if isinstance(categories, dict):
+        categories = categories.get("Category", categories)
+    if isinstance(categories, dict):
+        if questions[index] in categories:
+            return categories[questions[index]]
+        if f"Question{index + 1}" in categories:
+            return categories[f"Question{index + 1}"]
+        if len(categories) == len(questions):
+            return list(categories.values())[index]
+    return categories
+
+
+def _completion(questions, student_feedback, use_cheap_model):
+    """
+    Returns the arguments of the chat completion that finds the themes of the feedback.
+    """
+    model = _model(use_cheap_model)
+
+    if len(student_feedback) == 0:
+        raise DataProcessingError("The student feedback data is empty.")
+
+    if not questions:
+        raise DataProcessingError("The questions list is empty.")
+
+    json_string = json.dumps(student_feedback, indent=2)
+
+    # Process questions to handle compound questions
+    formatted_questions = []
+    for question in questions:
+        parts = question.rsplit("? ", 1)
+        if len(parts) > 1:
+            formatted_question = " AND ".join(parts[:-1]) + "? " + parts[-1]
+        else:
+            formatted_question = question
+        formatted_questions.append(f'"{formatted_question}"')
+
+    questions_string = "; ".join(formatted_questions)
+
+    # Prepare prompt
+    prompt = (
+        """
+        Analyze the feedback data from students regarding a learning unit to provide a teacher with a thorough overview. The feedback student_feedback is a list structured as follows:
+        - answers: List[str] is a list of strings that represent the answers of the student for each question; answers[0] is answer for question 1, answers[1] is answer for question 2 and so on.
+        - key is a int representing the key of a student's feedback. 
+        Here are the students' feedback:
+        """
+        + json_string
+        + """
+        The questions asked to the students are as follows:
+        """
+        + questions_string
+        + """Based on this information, I request the following:
+
+        1. Create a summary that highlights the most repeated themes from the students' feedback. You do not need to mention how many belong to each theme.
+
+        Please format the response as follows:
+        Category: {
+        Question1: [
+            theme,
+            theme,
+            etc.
+        ],
+        Question2: [
+            theme,
+            theme,
+            etc.
+        ],
+        ...
+        }
+        """
+    )
+
+    return dict(
+        model=model,
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a helpful assistant designed to output JSON. Your job is to help the teacher to sort what kind of information is important and what is not so the teacher can prepare for the next lecture.",
+            },
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0,
+    )
+
+
+def createCategories(
+    api_key, questions, student_feedback, use_cheap_model=True, use_cache=True
+):
     """
     Analyzes students' feedback on a learning unit to provide a summary of the most repeated themes
     for a teacher. It uses OpenAI's API to generate a categorization based on the feedback data.
@@ -13,100 +139,157 @@ def createCategories(api_key, questions, student_feedback, use_cheap_model=True)
     - questions (list): A list of strings representing the questions asked to students.
     - student_feedback (str, dict): The feedback data from students. Can be a dictionary or a JSON string.
     - use_cheap_model (bool, optional): Flag to decide whether to use a cheaper model or not. Defaults to True.
+    - use_cache (bool, optional): Flag to decide whether to read the response from the response cache when the
+      same request was sent before. Defaults to True.
 
     Returns:
     - dict: A dictionary with the summary of themes per question based on the students' feedback.
     """
-    try:
-        if use_cheap_model:
-            model = "gpt-3.5-turbo-1106"
-        else:
-            model = "gpt-4-0125-preview"
-
-        if len(student_feedback) == 0:
-            raise DataProcessingError("The student feedback data is empty.")
-
-        if not questions:
-            raise DataProcessingError("The questions list is empty.")
-
-        json_string = json.dumps(student_feedback, indent=2)
-
-        # Process questions to handle compound questions
-        formatted_questions = []
-        for question in questions:
-            parts = question.rsplit("? ", 1)
-            if len(parts) > 1:
-                formatted_question = " AND ".join(parts[:-1]) + "? " + parts[-1]
-            else:
-                formatted_question = question
-            formatted_questions.append(f'"{formatted_question}"')
-
-        questions_string = "; ".join(formatted_questions)
-
-        # Prepare prompt
-        prompt = (
-            """
-            Analyze the feedback data from students regarding a learning unit to provide a teacher with a thorough overview. The feedback student_feedback is a list structured as follows:
-            - answers: List[str] is a list of strings that represent the answers of the student for each question; answers[0] is answer for question 1, answers[1] is answer for question 2 and so on.
-            - key is a int representing the key of a student's feedback. 
-            Here are the students' feedback:
-            """
-            + json_string
-            + """
-            The questions asked to the students are as follows:
-            """
-            + questions_string
-            + """Based on this information, I request the following:
-
-            1. Create a summary that highlights the most repeated themes from the students' feedback. You do not need to mention how many belong to each theme.
-        
-            Please format the response as follows:
-            Category: {
-            Question1: [
-                theme,
-                theme,
-                etc.
-            ],
-            Question2: [
-                theme,
-                theme,
-                etc.
-            ],
-            ...
-            }
-            """
+    with openai_errors():
+        completion = _completion(questions, student_feedback, use_cheap_model)
+        return cached_completion(openai_client(api_key), completion, use_cache)
+
+
+async def createCategoriesAsync(
+    api_key, questions, student_feedback, use_cheap_model=True, use_cache=True
+):
+    """
+    Async version of createCategories.
+    """
+    with openai_errors():
+        completion = _completion(questions, student_feedback, use_cheap_model)
+        return await cached_completion_async(
+            async_openai_client(api_key), completion, use_cache
         )
 
-        # Initialize OpenAI client
-        client = OpenAI(api_key=api_key)
-
-        # Call the API
-        response = client.chat.completions.create(
-            model=model,
-            response_format={"type": "json_object"},
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant designed to output JSON. Your job is to help the teacher to sort what kind of information is important and what is not so the teacher can prepare for the next lecture.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0,
+
+def _reduce_completion(candidates, use_cheap_model):
+    """
+    Returns the arguments of the chat completion that merges the themes found in the shards of the feedback.
+    """
+    prompt = (
+        """
+        The feedback from students regarding a learning unit was split into parts, and the most repeated themes were found in each part. Here are the themes of all the parts, listed under the question they belong to:
+        """
+        + json.dumps(candidates, indent=2)
+        + """
+        Based on this information, I request the following:
+
+        1. Merge the themes that mean the same into one theme, and keep the themes that are repeated in several parts. Return the themes under the same questions, in the same order.
+
+        Please format the response as follows:
+        Category: {
+        Question1: [
+            theme,
+            theme,
+            etc.
+        ],
+        Question2: [
+            theme,
+            theme,
+            etc.
+        ],
+        ...
+        }
+        """
+    )
+
+    return dict(
+        model=_model(use_cheap_model),
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a helpful assistant designed to output JSON. Your job is to help the teacher to sort what kind of information is important and what is not so the teacher can prepare for the next lecture.",
+            },
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0,
+    )
+
+
+def _merge_themes(questions, shards):
+    """
+    Returns the themes every shard found for each question, without the themes that differ only in case or
+    whitespace, in the order they were found.
+    """
+    candidates = {}
+    for index, question in enumerate(questions):
+        themes = {}
+        for categories in shards:
+            found = question_categories(categories, questions, index)
+            if isinstance(found, dict):
+                found = [
+                    theme
+                    for themes_of_question in found.values()
+                    if isinstance(themes_of_question, list)
+                    for theme in themes_of_question
+                ]
+            if not isinstance(found, list):
+                continue
+            for theme in found:
+                themes.setdefault(" ".join(str(theme).split()).casefold(), theme)
+        candidates[question] = list(themes.values())
+    return candidates
+
+
+async def createCategoriesChunkedAsync(
+    api_key,
+    questions,
+    student_feedback,
+    use_cheap_model=True,
+    chunk_size=None,
+    concurrency=4,
+    use_cache=True,
+):
+    """
+    Same as createCategoriesAsync, but for cohorts whose feedback does not fit in the context window of the
+    model. The feedback is split into shards of `chunk_size` students, which are categorized concurrently,
+    at most `concurrency` at a time. The themes of the shards are deduplicated, and merged into the themes
+    of each question in a final request.
+
+    Feedback that fits in one prompt is categorized with a single request, like createCategoriesAsync.
+
+    Parameters:
+    - chunk_size (int, optional): The number of students in each shard. Chosen by estimate_chunk_size
+      from the context window of the model if not given.
+    - concurrency (int, optional): The number of shards that are categorized at the same time.
+    The other parameters are the same as for createCategories.
+
+    Returns:
+    - dict: A dictionary with the themes per question based on the students' feedback.
+    """
+    if len(student_feedback) == 0:
+        raise DataProcessingError("The student feedback data is empty.")
+
+    if not questions:
+        raise DataProcessingError("The questions list is empty.")
+
+    size = chunk_size or estimate_chunk_size(student_feedback, use_cheap_model)
+    if len(student_feedback) <= size:
+        return await createCategoriesAsync(
+            api_key, questions, student_feedback, use_cheap_model, use_cache
         )
 
-        output = response.choices[0].message.content
+    semaphore = asyncio.Semaphore(concurrency)
 
-        response_json = json.loads(output)
+    async def categorize(shard):
+        async with semaphore:
+            return await createCategoriesAsync(
+                api_key, questions, shard, use_cheap_model, use_cache
+            )
 
-        return response_json
+    shards = await asyncio.gather(
+        *(
+            categorize(student_feedback[start : start + size])
+            for start in range(0, len(student_feedback), size)
+        )
+    )
 
-    except DataProcessingError:
-        raise
-    except RateLimitError as e:
-        raise OpenAIRequestError(f"Rate limit exceeded: {str(e)}")
-    except OpenAIError as e:
-        raise OpenAIRequestError(f"OpenAI API error: {str(e)}")
-    except json.JSONDecodeError as e:
-        raise DataProcessingError(f"JSON decoding error: {str(e)}")
-    except Exception as e:
-        raise OpenAIRequestError(f"An unexpected error occurred: {str(e)}")
+    with openai_errors():
+        completion = _reduce_completion(
+            _merge_themes(questions, shards), use_cheap_model
+        )
+        return await cached_completion_async(
+            async_openai_client(api_key), completion, use_cache
+        )
@@ -1,9 +1,140 @@
-from openai import OpenAI, OpenAIError, RateLimitError
+import asyncio
 import json
-from api.utils.exceptions import DataProcessingError, OpenAIRequestError
+from api.utils.exceptions import DataProcessingError, openai_errors
+from prompting.cache import cached_completion, cached_completion_async
+from prompting.clients import async_openai_client, openai_client
+from prompting.createCategories import question_categories
 
 
-def sort(api_key, questions, categories, feedbacks, use_cheap_model=True):
+def _completion(questions, categories, feedbacks, use_cheap_model):
+    """
+    Returns the arguments of the chat completion that sorts the feedback into the categories.
+    """
+    if use_cheap_model:
+        model = "gpt-3.5-turbo-1106"
+    else:
+        model = "gpt-4-0125-preview"
+
+    if not questions:
+        raise DataProcessingError("The questions list is empty.")
+
+    if not categories:
+        raise DataProcessingError("The categories list is empty.")
+
+    if len(feedbacks) == 0:
+        raise DataProcessingError("The student feedback data is empty.")
+
+    if "Category" in categories:
+        categories_dict = categories["Category"]
+    else:
+        categories_dict = categories
+
+    categorise_str = json.dumps(categories_dict, indent=2)
+
+    # Convert lists to JSON-formatted strings
+    feedbacks_str = json.dumps(feedbacks, indent=2)
+    questions_str = ", ".join(questions)
+
+    # Prepare prompt
+    prompt = (
+        """
+        You will receive a JSON file with feedback from students based on questions about a lecture. Each student feedback has a unique key that identifies it. Your task is to categorize this feedback based on their content into predefined categories.
+
+        Data format on the student feedback
+        Is a list of dictionaries, where each dictionary contains these keys:
+        - answers: List[str] is a list of strings that represent the answers of the student for each question; answers[0] is answer for question 1, answers[1] is answer for question 2 and so on.
+        - key is a int representing the key of a student's feedback. Here are the students' feedback:
+        Here is the feedback:
+        """
+        + feedbacks_str
+        + """
+        You will be given a number of sets of categories, here are they:
+        """
+        + categorise_str
+        + """
+        Here are the questions that the students answered:
+
+        """
+        + questions_str
+        + """
+        Use the key value from each piece of feedback to represent the feedback in the categorization to avoid too much text.
+
+        Task Instructions:
+        Categorization: Sort the feedback based on the questions provided above into the assigned categories.
+        Format of response: Organize your answers in a structured format as shown below. Include all keys that represent 
+        feedback in the relevant categories. If a piece of feedback does not fit into any of the categories, place the key under 'Other'.
+        It is important that a student's feedback is only placed in one category for each question.
+        The structure should look like this:
+
+        Categories: {
+            Question1: {
+                category1: [
+                        1,
+                        5,
+                        7,
+                        ...
+                ],
+                category2: [
+                        2,
+                        4,
+                        8,
+                        ...
+                ],
+                ...,
+                Other: [
+                        12,
+                        3,
+                        3,
+                        ...
+                    ],
+            },
+            Question2: {
+                category1 [
+                        1,
+                        4,
+                        12
+                ],
+                category2: [
+                        2,
+                        5,
+                        7
+                        ...
+                ],
+                ...
+                Other: [
+                        9,
+                        5,
+                        8,
+                        ...
+                    ],
+            },
+            ...
+        }
+
+
+        Important:
+        Make sure to include all keys under each question in one of the categories, if for example answers[0] does not fit into any 
+        category under question 1, place it under category 'Other'.
+        """
+    )
+
+    return dict(
+        model=model,
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a helpful assistant designed to output JSON. Your job is to help the teacher to sort feedbacks into the provided categorise.",
+            },
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0,
+    )
+
+
+def sort(
+    api_key, questions, categories, feedbacks, use_cheap_model=True, use_cache=True
+):
     """
     Sorts student feedback into predefined categories based on their content.
 
@@ -19,149 +150,186 @@ def sort(api_key, questions, categories, feedbacks, use_cheap_model=True):
                               Each feedback dictionary must have 'answers' (list[str]) and 'key' (int) as keys.
     - use_cheap_model (bool, optional): If True (default), uses a cheaper and less powerful model for processing.
                                         If False, uses a more powerful and expensive model.
+    - use_cache (bool, optional): If True (default), the response is read from the response cache when the same
+                                  request was sent before.
 
     Returns:
     dict: A dictionary representing the sorted feedback according to the categories.
     """
-    try:
-        if use_cheap_model:
-            model = "gpt-3.5-turbo-1106"
-        else:
-            model = "gpt-4-0125-preview"
-
-        if not questions:
-            raise DataProcessingError("The questions list is empty.")
-
-        if not categories:
-            raise DataProcessingError("The categories list is empty.")
-
-        if len(feedbacks) == 0:
-            raise DataProcessingError("The student feedback data is empty.")
-
-        if "Category" in categories:
-            categories_dict = categories["Category"]
-        else:
-            categories_dict = categories
-
-        categorise_str = json.dumps(categories_dict, indent=2)
-
-        # Convert lists to JSON-formatted strings
-        feedbacks_str = json.dumps(feedbacks, indent=2)
-        questions_str = ", ".join(questions)
-
-        # Prepare prompt
-        prompt = (
-            """
-            You will receive a JSON file with feedback from students based on questions about a lecture. Each student feedback has a unique key that identifies it. Your task is to categorize this feedback based on their content into predefined categories.
-
-            Data format on the student feedback
-            Is a list of dictionaries, where each dictionary contains these keys:
-            - answers: List[str] is a list of strings that represent the answers of the student for each question; answers[0] is answer for question 1, answers[1] is answer for question 2 and so on.
-            - key is a int representing the key of a student's feedback. Here are the students' feedback:
-            Here is the feedback:
-            """
-            + feedbacks_str
-            + """
-            You will be given a number of sets of categories, here are they:
-            """
-            + categorise_str
-            + """
-            Here are the questions that the students answered:
-
-            """
-            + questions_str
-            + """
-            Use the key value from each piece of feedback to represent the feedback in the categorization to avoid too much text.
-
-            Task Instructions:
-            Categorization: Sort the feedback based on the questions provided above into the assigned categories.
-            Format of response: Organize your answers in a structured format as shown below. Include all keys that represent 
-            feedback in the relevant categories. If a piece of feedback does not fit into any of the categories, place the key under 'Other'.
-            It is important that a student's feedback is only placed in one category for each question.
-            The structure should look like this:
-
-            Categories: {
-                Question1: {
-                    category1: [
-                            1,
-                            5,
-                            7,
-                            ...
-                    ],
-                    category2: [
-                            2,
-                            4,
-                            8,
-                            ...
-                    ],
-                    ...,
-                    Other: [
-                            12,
-                            3,
-                            3,
-                            ...
-                        ],
-                },
-                Question2: {
-                    category1 [
-                            1,
-                            4,
-                            12
-                    ],
-                    category2: [
-                            2,
-                            5,
-                            7
-                            ...
-                    ],
-                    ...
-                    Other: [
-                            9,
-                            5,
-                            8,
-                            ...
-                        ],
-                },
-                ...
-            }
+    with openai_errors():
+        completion = _completion(questions, categories, feedbacks, use_cheap_model)
+        return cached_completion(openai_client(api_key), completion, use_cache)
 
 
-            Important:
-            Make sure to include all keys under each question in one of the categories, if for example answers[0] does not fit into any 
-            category under question 1, place it under category 'Other'.
-            """
+async def sortAsync(
+    api_key, questions, categories, feedbacks, use_cheap_model=True, use_cache=True
+):
+    """
+    Async version of sort.
+    """
+    with openai_errors():
+        completion = _completion(questions, categories, feedbacks, use_cheap_model)
+        return await cached_completion_async(
+            async_openai_client(api_key), completion, use_cache
         )
 
-        # Initialize OpenAI client
-        client = OpenAI(api_key=api_key)
-
-        # Call the API
-        response = client.chat.completions.create(
-            model=model,
-            response_format={"type": "json_object"},
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant designed to output JSON. Your job is to help the teacher to sort feedbacks into the provided categorise.",
-                },
-                {"role": "user", "content": prompt},
+
+def _question_completion(question, categories, answers, use_cheap_model):
+    """
+    Returns the arguments of the chat completion that sorts the answers to one question into its categories.
+    """
+    if use_cheap_model:
+        model = "gpt-3.5-turbo-1106"
+    else:
+        model = "gpt-4-0125-preview"
+
+    prompt = (
+        """
+        You will receive the answers of students to a question about a lecture. Each answer has a unique key that identifies it. Your task is to categorize the answers based on their content into predefined categories.
+
+        Here is the question that the students answered:
+        """
+        + question
+        + """
+        Here are the answers, as a list of dictionaries with the key of the answer and the answer:
+        """
+        + json.dumps(answers, indent=2)
+        + """
+        Here are the categories:
+        """
+        + json.dumps(categories, indent=2)
+        + """
+        Use the key value of each answer to represent it in the categorization to avoid too much text.
+        It is important that an answer is only placed in one category. If an answer does not fit into any of the categories, place its key under 'Other'.
+        The structure should look like this:
+
+        {
+            category1: [
+                1,
+                5,
+                7,
+                ...
             ],
-            temperature=0,
+            category2: [
+                2,
+                4,
+                8,
+                ...
+            ],
+            ...,
+            Other: [
+                3,
+                12,
+                ...
+            ]
+        }
+        """
+    )
+
+    return dict(
+        model=model,
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a helpful assistant designed to output JSON. Your job is to help the teacher to sort feedbacks into the provided categorise.",
+            },
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0,
+    )
+
+
+def _sorted_keys(response_json, question):
+    """
+    Returns the categories of keys in the response to one question. The model sometimes nests them under the
+    question or "Categories", and writes the keys as strings.
+    """
+    if not isinstance(response_json, dict):
+        raise DataProcessingError(
+            f"The response for the question '{question}' is not a JSON object."
         )
+    while len(response_json) == 1 and isinstance(
+        next(iter(response_json.values())), dict
+    ):
+        response_json = next(iter(response_json.values()))
+
+    sorted_keys = {}
+    for category, keys in response_json.items():
+        if not isinstance(keys, list):
+            raise DataProcessingError(
+                f"The category '{category}' of the question '{question}' is not a list of keys."
+            )
+        sorted_keys[category] = [
+            int(key) if isinstance(key, str) and key.isdigit() else key for key in keys
+        ]
+    return sorted_keys
+
+
+async def sortPerQuestionAsync(
+    api_key,
+    questions,
+    categories,
+    feedbacks,
+    use_cheap_model=True,
+    concurrency=4,
+    retries=1,
+    use_cache=True,
+):
+    """
+    Sorts student feedback into the categories like sort, but with one request per question that only
+    carries the categories and the answers of that question. At most `concurrency` requests are sent at
+    the same time.
+
+    The prompts stay small however many questions there are, and a malformed response is retried `retries`
+    times for its question alone, instead of failing the whole sorting.
+
+    Parameters:
+    - concurrency (int, optional): The number of questions that are sorted at the same time.
+    - retries (int, optional): The number of times a question is sent again if its response is malformed.
+    The other parameters are the same as for sort.
+
+    Returns:
+    dict: The keys of the feedback sorted into categories for every question, {question: {category: [keys]}}.
+    """
+    if not questions:
+        raise DataProcessingError("The questions list is empty.")
 
-        output = response.choices[0].message.content
+    if not categories:
+        raise DataProcessingError("The categories list is empty.")
 
-        response_json = json.loads(output)
+    if len(feedbacks) == 0:
+        raise DataProcessingError("The student feedback data is empty.")
 
-        return response_json
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def sort_question(index, question):
+        completion = _question_completion(
+            question,
+            question_categories(categories, questions, index),
+            [
+                {"key": feedback["key"], "answer": feedback["answers"][index]}
+                for feedback in feedbacks
+                if index < len(feedback["answers"])
+            ],
+            use_cheap_model,
+        )
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    with openai_errors():
+                        # A retry does not read the cache, which may hold the malformed response, and replaces it
+                        response_json = await cached_completion_async(
+                            async_openai_client(api_key),
+                            completion,
+                            use_cache and attempt == 0,
+                        )
+                        return _sorted_keys(response_json, question)
+                except DataProcessingError:
+                    if attempt == retries:
+                        raise
 
-    except DataProcessingError:
-        raise
-    except RateLimitError as e:
-        raise OpenAIRequestError(f"Rate limit exceeded: {str(e)}")
-    except OpenAIError as e:
-        raise OpenAIRequestError(f"OpenAI API error: {str(e)}")
-    except json.JSONDecodeError as e:
-        raise DataProcessingError(f"JSON decoding error: {str(e)}")
-    except Exception as e:
-        raise OpenAIRequestError(f"An unexpected error occurred: {str(e)}")
+    sorted_questions = await asyncio.gather(
+        *(sort_question(index, question) for index, question in enumerate(questions))
+    )
+    return dict(zip(questions, sorted_questions))
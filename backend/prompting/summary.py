@@ -1,11 +1,58 @@
 from typing import Dict, List
-from openai import OpenAI, OpenAIError, RateLimitError
 import json
-from api.utils.exceptions import DataProcessingError, OpenAIRequestError
+from api.utils.exceptions import DataProcessingError, openai_errors
+from prompting.cache import cached_completion, cached_completion_async
+from prompting.clients import async_openai_client, openai_client
+
+
+def _completion(answers, use_cheap_model):
+    """
+    Returns the arguments of the chat completion that summarizes the categorized feedback.
+    """
+    if use_cheap_model:
+        model = "gpt-3.5-turbo-1106"
+    else:
+        model = "gpt-4-0125-preview"
+
+    if not answers:
+        raise DataProcessingError("No student feedback has been provided.")
+
+    answers_str = json.dumps(answers)
+
+    prompt = (
+        """
+        You will receive a JSON file containing a categorized report based on students responding to questions from their teachers. The students' responses are sorted into appropriate categories.
+        Based on this information, we need a paragraph consisting of a summary that provides an overview of the feedbacks. The summary should highlight the key points and insights into the feedbacks and overall categorise.
+        Here is the data you'll have to analyze:
+        """
+        + answers_str
+        + """
+        Provide the summary in this format:
+        {
+            summary: here is the summary
+        }
+        """
+    )
+
+    return dict(
+        model=model,
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a helpful assistant designed to output JSON. Your job is to help the teacher to sort feedbacks into the provided categorise.",
+            },
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0,
+    )
 
 
 def createSummary(
-    api_key, answers: Dict[str, Dict[str, List[str]]], use_cheap_model=True
+    api_key,
+    answers: Dict[str, Dict[str, List[str]]],
+    use_cheap_model=True,
+    use_cache=True,
 ) -> str:
     """
     Generates a summary of student feedback based on categorized responses using the OpenAI API.
@@ -21,6 +68,8 @@ def createSummary(
     - use_cheap_model (bool, optional): Determines which OpenAI model to use for processing the request.
       Defaults to True, using a cheaper, less powerful model. If False, uses a more expensive,
       more powerful model.
+    - use_cache (bool, optional): Determines whether the response is read from the response cache when the
+      same request was sent before. Defaults to True.
 
     Returns:
     str: A string representation of a JSON object containing the generated summary.
@@ -47,61 +96,22 @@ def createSummary(
         "summary": "Here is the summary..."
     }
     """
-    try:
-        if use_cheap_model:
-            model = "gpt-3.5-turbo-1106"
-        else:
-            model = "gpt-4-0125-preview"
-
-        if not answers:
-            raise DataProcessingError("No student feedback has been provided.")
+    with openai_errors():
+        completion = _completion(answers, use_cheap_model)
+        return cached_completion(openai_client(api_key), completion, use_cache)
 
-        answers_str = json.dumps(answers)
 
-        prompt = (
-            """
-            You will receive a JSON file containing a categorized report based on students responding to questions from their teachers. The students' responses are sorted into appropriate categories.
-            Based on this information, we need a paragraph consisting of a summary that provides an overview of the feedbacks. The summary should highlight the key points and insights into the feedbacks and overall categorise.
-            Here is the data you'll have to analyze:
-            """
-            + answers_str
-            + """
-            Provide the summary in this format:
-            {
-                summary: here is the summary
-            }
-            """
-        )
-
-        client = OpenAI(api_key=api_key)
-
-        # Call the API
-        response = client.chat.completions.create(
-            model=model,
-            response_format={"type": "json_object"},
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant designed to output JSON. Your job is to help the teacher to sort feedbacks into the provided categorise.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0,
+async def createSummaryAsync(
+    api_key,
+    answers: Dict[str, Dict[str, List[str]]],
+    use_cheap_model=True,
+    use_cache=True,
+) -> str:
+    """
+    Async version of createSummary.
+    """
+    with openai_errors():
+        completion = _completion(answers, use_cheap_model)
+        return await cached_completion_async(
+            async_openai_client(api_key), completion, use_cache
         )
-
-        output = response.choices[0].message.content
-
-        response_json = json.loads(output)
-
-        return response_json
-
-    except DataProcessingError:
-        raise
-    except RateLimitError as e:
-        raise OpenAIRequestError(f"Rate limit exceeded: {str(e)}")
-    except OpenAIError as e:
-        raise OpenAIRequestError(f"OpenAI API error: {str(e)}")
-    except json.JSONDecodeError as e:
-        raise DataProcessingError(f"JSON decoding error: {str(e)}")
-    except Exception as e:
-        raise OpenAIRequestError(f"An unexpected error occurred: {str(e)}")
@@ -0,0 +1,15 @@
+import pytest
+
+from prompting.cache import responses
+
+
+@pytest.fixture(autouse=True)
+def response_cache(tmp_path, monkeypatch):
+    """
+    Gives every test an empty cache of OpenAI responses with its counters at 0, so a response stored by
+    one test is not returned in another.
+    """
+    monkeypatch.setattr(responses, "path", str(tmp_path / "llm_cache.db"))
+    for counter in ["hits", "misses", "evictions", "errors"]:
+        monkeypatch.setattr(responses, counter, 0)
+    return responses
@@ -0,0 +1,162 @@
+import asyncio
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from prompting import cache
+from prompting.cache import ResponseCache, cached_completion, cached_completion_async
+
+"""
+This test module verifies the cache of OpenAI responses: the keys of the requests, the hit and miss counters,
+the eviction of expired and least recently used responses, and `cached_completion`, which sends a request
+only when its response is not cached.
+"""
+
+
+class AsyncClient:
+    """
+    Awaits the chat completions of a MagicMock client.
+    """
+
+    def __init__(self, client):
+        self.chat = MagicMock()
+        self.chat.completions.create = self.create
+        self.client = client
+
+    async def create(self, **kwargs):
+        return self.client.chat.completions.create(**kwargs)
+
+
+def completion(prompt, model="gpt-3.5-turbo-1106", temperature=0):
+    return dict(
+        model=model,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=temperature,
+    )
+
+
+def test_key():
+    """
+    Tests that the key depends on the model and the prompts, and that only deterministic requests have one.
+    """
+    key = ResponseCache.key(completion("Sort the feedback"))
+
+    assert key == ResponseCache.key(completion("Sort the feedback"))
+    assert key != ResponseCache.key(completion("Summarize the feedback"))
+    assert key != ResponseCache.key(
+        completion("Sort the feedback", model="gpt-4-0125-preview")
+    )
+    assert ResponseCache.key(completion("Sort the feedback", temperature=1)) is None
+
+
+def test_hits_misses_and_ttl(tmp_path, monkeypatch):
+    """
+    Tests that a stored response is returned until it expires, and that hits and misses are counted.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    responses = ResponseCache(str(tmp_path / "cache.db"), ttl=60)
+
+    assert responses.get("key") is None
+    responses.set("key", '{"summary": "Cached"}')
+    assert responses.get("key") == '{"summary": "Cached"}'
+
+    now[0] += 61
+    assert responses.get("key") is None
+    assert responses.stats() == {
+        "hits": 1,
+        "misses": 2,
+        "evictions": 0,
+        "errors": 0,
+    }
+
+    responses.set("other", "{}")
+    assert responses.stats()["evictions"] == 1
+
+
+def test_least_recently_used_evicted(tmp_path, monkeypatch):
+    """
+    Tests that the least recently used responses are evicted when the responses take up more than max_bytes.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    responses = ResponseCache(str(tmp_path / "cache.db"), max_bytes=250)
+
+    for key in ["first", "second"]:
+        responses.set(key, "x" * 100)
+        now[0] += 1
+    assert responses.get("first") is not None
+    now[0] += 1
+    responses.set("third", "x" * 100)
+
+    assert responses.get("second") is None
+    assert responses.get("first") is not None
+    assert responses.get("third") is not None
+    assert responses.evictions == 1
+
+
+def test_cached_completion(response_cache):
+    """
+    Tests that `cached_completion` sends a request only the first time, unless the cache is bypassed, which
+    sends the request again and stores the new response.
+    """
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices[0].message.content = (
+        '{"summary": "First"}'
+    )
+
+    assert cached_completion(client, completion("Summarize")) == {"summary": "First"}
+    assert cached_completion(client, completion("Summarize")) == {"summary": "First"}
+    assert client.chat.completions.create.call_count == 1
+    assert response_cache.hits == 1
+
+    client.chat.completions.create.return_value.choices[0].message.content = (
+        '{"summary": "Second"}'
+    )
+    assert cached_completion(client, completion("Summarize"), use_cache=False) == {
+        "summary": "Second"
+    }
+    assert cached_completion(client, completion("Summarize")) == {"summary": "Second"}
+    assert client.chat.completions.create.call_count == 2
+
+
+def test_malformed_response_not_cached(response_cache):
+    """
+    Tests that a response that is not JSON is not stored.
+    """
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices[0].message.content = "not json"
+
+    for _ in range(2):
+        with pytest.raises(json.JSONDecodeError):
+            cached_completion(client, completion("Summarize"))
+    assert client.chat.completions.create.call_count == 2
+
+
+def test_unwritable_cache(response_cache, monkeypatch, tmp_path):
+    """
+    Tests that the completion is still returned when the cache file cannot be opened, and that the failed
+    read and write are counted as errors.
+    """
+    monkeypatch.setattr(
+        response_cache, "path", str(tmp_path / "missing" / "llm_cache.db")
+    )
+    client = MagicMock()
+    client.chat.completions.create.return_value.choices[0].message.content = (
+        '{"summary": "Not cached"}'
+    )
+
+    assert cached_completion(client, completion("Summarize")) == {
+        "summary": "Not cached"
+    }
+    assert asyncio.run(
+        cached_completion_async(AsyncClient(client), completion("Summarize"))
+    ) == {"summary": "Not cached"}
+    assert client.chat.completions.create.call_count == 2
+    assert response_cache.stats()["errors"] == 4
+    assert response_cache.stats()["misses"] == 2
@@ -0,0 +1,173 @@
+import asyncio
+import gc
+import importlib
+from unittest.mock import patch
+
+import openai
+
+from prompting.clients import ClientRegistry
+
+"""
+This test module verifies that `ClientRegistry` reuses the OpenAI clients, and their connection pools,
+for calls with the same API key and base URL.
+"""
+
+# The HTTP library the OpenAI SDK is built on
+http = importlib.import_module(
+    type(openai.DEFAULT_CONNECTION_LIMITS).__module__.split(".")[0]
+)
+
+COMPLETION = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-3.5-turbo-1106",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": '{"summary": "Test"}'},
+            "finish_reason": "stop",
+        }
+    ],
+}
+
+MESSAGES = [{"role": "user", "content": "Summarize the feedback."}]
+
+
+def mock_http_clients(name, handler):
+    """
+    Patches `openai.<name>` to create the HTTP clients with a transport that answers every request with
+    `handler`, and returns the patch and the list of the created HTTP clients.
+    """
+    http_client_class = getattr(openai, name)
+    created = []
+
+    def create(**kwargs):
+        http_client = http_client_class(**kwargs, transport=http.MockTransport(handler))
+        created.append(http_client)
+        return http_client
+
+    return patch.object(openai, name, create), created
+
+
+def test_client_reused_per_key():
+    """
+    Tests that the same client is returned for the same API key and base URL, and a new one otherwise.
+    """
+    registry = ClientRegistry(timeout=30, connect_timeout=5)
+
+    client = registry.get("key1")
+    assert registry.get("key1") is client
+    assert registry.get("key2") is not client
+    assert registry.get("key1", base_url="http://127.0.0.1:8080/v1") is not client
+    assert client.timeout.read == 30
+    assert client.timeout.connect == 5
+
+
+def test_least_recently_used_client_evicted():
+    """
+    Tests that at most `max_clients` clients are kept, and the least recently used one is evicted.
+    """
+    registry = ClientRegistry(max_clients=2)
+
+    first = registry.get("key1")
+    second = registry.get("key2")
+    assert registry.get("key1") is first
+    registry.get("key3")
+
+    assert registry.get("key1") is first
+    assert registry.get("key2") is not second
+
+
+def test_async_client_reused_per_event_loop():
+    """
+    Tests that the async client is reused within an event loop, and recreated in a new one, since its
+    connections belong to the loop it was created in.
+    """
+    registry = ClientRegistry()
+
+    async def get_twice():
+        client = registry.get_async("key1")
+        assert registry.get_async("key1") is client
+        return client
+
+    first = asyncio.run(get_twice())
+    second = asyncio.run(get_twice())
+    assert first is not second
+    asyncio.run(registry.aclose())
+
+
+def test_evicted_client_finishes_request():
+    """
+    Tests that a client evicted while one of its requests is still running is not closed under it, and
+    that its connections are closed once nobody uses it anymore.
+    """
+    registry = ClientRegistry(max_clients=1)
+
+    def handler(request):
+        # Another caller evicts the client in the middle of the request
+        registry.get("key2")
+        gc.collect()
+        return http.Response(200, json=COMPLETION)
+
+    patched, created = mock_http_clients("DefaultHttpxClient", handler)
+    with patched:
+        client = registry.get("key1")
+        response = client.chat.completions.create(
+            model="gpt-3.5-turbo-1106", messages=MESSAGES
+        )
+        assert response.choices[0].message.content == '{"summary": "Test"}'
+        assert not created[0].is_closed
+
+        del client
+        gc.collect()
+        assert created[0].is_closed
+        assert not created[1].is_closed
+
+
+def test_evicted_async_client_finishes_request():
+    """
+    Tests that an async client evicted while one of its requests is still running is not closed under it,
+    and that its connections are closed in its event loop once nobody uses it anymore.
+    """
+    registry = ClientRegistry(max_clients=1)
+
+    async def handler(request):
+        registry.get_async("key2")
+        gc.collect()
+        await asyncio.sleep(0.01)
+        return http.Response(200, json=COMPLETION)
+
+    async def evict_during_request():
+        client = registry.get_async("key1")
+        response = await client.chat.completions.create(
+            model="gpt-3.5-turbo-1106", messages=MESSAGES
+        )
+        assert response.choices[0].message.content == '{"summary": "Test"}'
+        assert not created[0].is_closed
+
+        del client
+        gc.collect()
+        await asyncio.sleep(0.01)
+        assert created[0].is_closed
+        await registry.aclose()
+
+    patched, created = mock_http_clients("DefaultAsyncHttpxClient", handler)
+    with patched:
+        asyncio.run(evict_during_request())
+    assert created[1].is_closed
+
+
+def test_async_clients_of_closed_loops_dropped():
+    """
+    Tests that the async clients of an event loop that has closed are dropped from the registry when a
+    new client is created, instead of being kept forever.
+    """
+    registry = ClientRegistry()
+
+    async def get():
+        return registry.get_async("key1")
+
+    asyncio.run(get())
+    asyncio.run(get())
+    assert len(registry._async_clients) == 1
@@ -1,22 +1,28 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from openai import OpenAIError, RateLimitError
 import pytest
 from api.utils.exceptions import DataProcessingError, OpenAIRequestError
-from prompting.createCategories import createCategories
+from prompting.createCategories import (
+    createCategories,
+    createCategoriesAsync,
+    createCategoriesChunkedAsync,
+    estimate_chunk_size,
+)
 
 """
 This test module verifies the functionality of the `createCategories` function, where the tests test the function's ability
 to handle successful API calls, rate limit errors, API errors, JSON decoding errors, and unexpected errors. It also tests the
 function's behavior when the list is empty.
 
-Each test function is decorated with `@patch("prompting.createCategories.OpenAI")`
-to mock the `OpenAI` class, allowing the test to manipulate the behavior of the
+Each test function is decorated with `@patch("prompting.createCategories.openai_client")`
+to mock the shared `OpenAI` client, allowing the test to manipulate the behavior of the
 `chat.completions.create` method as needed for each scenario.
 """
 
 
-@patch("prompting.createCategories.OpenAI")
+@patch("prompting.createCategories.openai_client")
 def test_create_categories_success(mock_openai):
     """
     Tests the successful creation of categories
@@ -43,7 +49,7 @@ def test_create_categories_success(mock_openai):
     ), "The function should return the expected output based on mock API response."
 
 
-@patch("prompting.createCategories.OpenAI")
+@patch("prompting.createCategories.openai_client")
 def test_rate_limit_error(mock_openai):
     """
     Tests the function's handling of a `RateLimitError`
@@ -61,7 +67,7 @@ def test_rate_limit_error(mock_openai):
     assert "Rate limit exceeded" in str(excinfo.value)
 
 
-@patch("prompting.createCategories.OpenAI")
+@patch("prompting.createCategories.openai_client")
 def test_openai_api_error(mock_openai):
     """
     Tests the function's response to a general `OpenAIError`.
@@ -77,7 +83,7 @@ def test_openai_api_error(mock_openai):
     assert "API error" in str(excinfo.value)
 
 
-@patch("prompting.createCategories.OpenAI")
+@patch("prompting.createCategories.openai_client")
 def test_json_decoding_error(mock_openai):
     """
     Tests the function's behavior when the API response
@@ -93,7 +99,7 @@ def test_json_decoding_error(mock_openai):
     assert "JSON decoding error" in str(excinfo.value)
 
 
-@patch("prompting.createCategories.OpenAI")
+@patch("prompting.createCategories.openai_client")
 def test_unexpected_error(mock_openai):
     """
     Tests the function's behavior when an unexpected exception
@@ -109,7 +115,7 @@ def test_unexpected_error(mock_openai):
     assert "Unexpected error" in str(excinfo.value)
 
 
-@patch("prompting.createCategories.OpenAI")
+@patch("prompting.createCategories.openai_client")
 def test_empty_feedback(mock_openai):
     """
     Tests the function with empty feedback.
@@ -124,7 +130,7 @@ def test_empty_feedback(mock_openai):
     assert "The student feedback data is empty." in str(excinfo.value)
 
 
-@patch("prompting.createCategories.OpenAI")
+@patch("prompting.createCategories.openai_client")
 def test_empty_questions(mock_openai):
     """
     Tests the function with empty questions.
@@ -139,3 +145,98 @@ def test_empty_questions(mock_openai):
     with pytest.raises(DataProcessingError) as excinfo:
         createCategories(api_key, [], student_feedback)
     assert "The questions list is empty." in str(excinfo.value)
+
+
+@patch("prompting.createCategories.async_openai_client")
+def test_create_categories_async_success(mock_openai):
+    """
+    Tests that `createCategoriesAsync` awaits the shared AsyncOpenAI client and returns the parsed response.
+    """
+    mock_response = MagicMock()
+    mock_response.choices[0].message.content = '{"Category": {"Question1": ["theme1"]}}'
+    client = mock_openai.return_value
+    client.chat.completions.create = AsyncMock(return_value=mock_response)
+
+    questions = ["What did you like about this unit?"]
+    feedback = [{"answers": ["It was informative"], "key": 1}]
+
+    result = asyncio.run(createCategoriesAsync("test_api_key", questions, feedback))
+
+    assert result == {"Category": {"Question1": ["theme1"]}}
+    client.chat.completions.create.assert_awaited_once()
+
+
+@patch("prompting.createCategories.async_openai_client")
+def test_create_categories_async_rate_limit_error(mock_openai):
+    """
+    Tests that `createCategoriesAsync` raises an `OpenAIRequestError` when the rate limit is exceeded.
+    """
+    client = mock_openai.return_value
+    client.chat.completions.create = AsyncMock(
+        side_effect=RateLimitError(
+            message="Rate limit exceeded",
+            response=MagicMock(status_code=429),
+            body="",
+        )
+    )
+
+    questions = ["What did you like about this unit?"]
+    feedback = [{"answers": ["It was informative"], "key": 1}]
+
+    with pytest.raises(OpenAIRequestError) as exc_info:
+        asyncio.run(createCategoriesAsync("test_api_key", questions, feedback))
+    assert "Rate limit exceeded" in str(exc_info.value.message)
+
+
+def test_estimate_chunk_size():
+    """
+    Tests that the chunk size leaves room in the context window, and grows with the context window of
+    the model.
+    """
+    feedback = [{"answers": ["x" * 400, "y" * 400], "key": 1}] * 1000
+
+    cheap = estimate_chunk_size(feedback, use_cheap_model=True)
+    expensive = estimate_chunk_size(feedback, use_cheap_model=False)
+
+    assert 1 <= cheap < len(feedback)
+    assert cheap < expensive
+    assert estimate_chunk_size([{"answers": ["x" * 100000], "key": 1}]) == 1
+
+
+@patch("prompting.createCategories.async_openai_client")
+def test_create_categories_chunked(mock_openai):
+    """
+    Tests that `createCategoriesChunkedAsync` sends feedback that fits in one prompt in a single request,
+    and otherwise categorizes each shard and merges their deduplicated themes in a final request.
+    """
+    shard_response = MagicMock()
+    shard_response.choices[0].message.content = (
+        '{"Category": {"Question1": ["Examples", "examples "]}}'
+    )
+    merged_response = MagicMock()
+    merged_response.choices[0].message.content = (
+        '{"Category": {"What went well?": ["Examples"]}}'
+    )
+    client = mock_openai.return_value
+    client.chat.completions.create = AsyncMock(return_value=shard_response)
+    questions = ["What went well?"]
+    feedback = [{"answers": [f"Answer {key}"], "key": key} for key in range(10)]
+
+    result = asyncio.run(
+        createCategoriesChunkedAsync("test_api_key", questions, feedback)
+    )
+    assert result == {"Category": {"Question1": ["Examples", "examples "]}}
+    assert client.chat.completions.create.await_count == 1
+
+    client.chat.completions.create = AsyncMock(
+        side_effect=[shard_response] * 4 + [merged_response]
+    )
+    result = asyncio.run(
+        createCategoriesChunkedAsync("test_api_key", questions, feedback, chunk_size=3)
+    )
+    assert result == {"Category": {"What went well?": ["Examples"]}}
+    assert client.chat.completions.create.await_count == 5
+    reduce_prompt = client.chat.completions.create.await_args.kwargs["messages"][1][
+        "content"
+    ]
+    assert '"What went well?": [\n    "Examples"\n  ]' in reduce_prompt
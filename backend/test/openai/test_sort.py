@@ -1,24 +1,25 @@
 import json
-from unittest.mock import MagicMock, patch
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from openai import OpenAIError, RateLimitError
 import pytest
 
 from api.utils.exceptions import DataProcessingError, OpenAIRequestError
-from prompting.sort import sort
+from prompting.sort import sort, sortAsync, sortPerQuestionAsync
 
 """
 This test module verifies the functionality of the `sort` function, where the tests test the function's ability
 to handle successful API calls, rate limit errors, API errors, JSON decoding errors, and unexpected errors. It also tests the
 function's behavior when the is empty.
 
-Each test function is decorated with `@patch("prompting.sort.OpenAI")`
-to mock the `OpenAI` class, allowing the test to manipulate the behavior of the
+Each test function is decorated with `@patch("prompting.sort.openai_client")`
+to mock the shared `OpenAI` client, allowing the test to manipulate the behavior of the
 `chat.completions.create` method as needed for each scenario.
 """
 
 
-@patch("prompting.sort.OpenAI")
+@patch("prompting.sort.openai_client")
 def test_sort_success(mock_openai):
     """
     Tests the successful sorting of feedback
@@ -44,7 +45,7 @@ def test_sort_success(mock_openai):
     ), "The function should return the expected output based on mock API response."
 
 
-@patch("prompting.sort.OpenAI")
+@patch("prompting.sort.openai_client")
 def test_rate_limit_error(mock_openai):
     """
     Tests the function's handling of a `RateLimitError`
@@ -62,7 +63,7 @@ def test_rate_limit_error(mock_openai):
     assert "Rate limit exceeded" in str(excinfo.value)
 
 
-@patch("prompting.sort.OpenAI")
+@patch("prompting.sort.openai_client")
 def test_openai_api_error(mock_openai):
     """
     Tests the function's handling of an `OpenAIError`
@@ -78,7 +79,7 @@ def test_openai_api_error(mock_openai):
     assert "API error" in str(excinfo.value)
 
 
-@patch("prompting.sort.OpenAI")
+@patch("prompting.sort.openai_client")
 def test_json_decoding_error(mock_openai):
     """
     Tests the function's handling of a JSON decoding error
@@ -94,7 +95,7 @@ def test_json_decoding_error(mock_openai):
     assert "JSON decoding error" in str(excinfo.value)
 
 
-@patch("prompting.sort.OpenAI")
+@patch("prompting.sort.openai_client")
 def test_unexpected_error(mock_openai):
     """
     Tests the function's response to an unexpected error
@@ -110,7 +111,7 @@ def test_unexpected_error(mock_openai):
     assert "An unexpected error occurred" in str(excinfo.value)
 
 
-@patch("prompting.sort.OpenAI")
+@patch("prompting.sort.openai_client")
 def test_empty_feedbacks(mock_openai):
     """
     Tests the function's response to an empty feedbacks input.
@@ -128,7 +129,7 @@ def test_empty_feedbacks(mock_openai):
     assert "The student feedback data is empty." in str(excinfo.value)
 
 
-@patch("prompting.sort.OpenAI")
+@patch("prompting.sort.openai_client")
 def test_empty_questions(mock_openai):
     """
     Tests the function's response to an empty questions input.
@@ -146,7 +147,7 @@ def test_empty_questions(mock_openai):
     assert "The questions list is empty." in str(excinfo.value)
 
 
-@patch("prompting.sort.OpenAI")
+@patch("prompting.sort.openai_client")
 def test_empty_categories(mock_openai):
     """
     Tests the function's response to an empty categories input.
@@ -162,3 +163,160 @@ def test_empty_categories(mock_openai):
     with pytest.raises(DataProcessingError) as excinfo:
         sort(api_key, questions, {}, feedbacks)
     assert "The categories list is empty." in str(excinfo.value)
+
+
+@patch("prompting.sort.async_openai_client")
+def test_sort_async_success(mock_openai):
+    """
+    Tests that `sortAsync` awaits the shared AsyncOpenAI client and returns the parsed response.
+    """
+    mock_response = MagicMock()
+    mock_response.choices[0].message.content = (
+        '{"Categories": {"Question1": {"category1": [1]}}}'
+    )
+    client = mock_openai.return_value
+    client.chat.completions.create = AsyncMock(return_value=mock_response)
+
+    questions = ["What did you like about this unit?"]
+    categories = {"Category": ["theme1", "theme2"]}
+    feedbacks = [{"answers": ["It was informative"], "key": 1}]
+
+    result = asyncio.run(sortAsync("test_api_key", questions, categories, feedbacks))
+
+    assert result == {"Categories": {"Question1": {"category1": [1]}}}
+    client.chat.completions.create.assert_awaited_once()
+
+
+@patch("prompting.sort.async_openai_client")
+def test_sort_async_rate_limit_error(mock_openai):
+    """
+    Tests that `sortAsync` raises an `OpenAIRequestError` when the rate limit is exceeded.
+    """
+    client = mock_openai.return_value
+    client.chat.completions.create = AsyncMock(
+        side_effect=RateLimitError(
+            message="Rate limit exceeded",
+            response=MagicMock(status_code=429),
+            body="",
+        )
+    )
+
+    questions = ["What did you like about this unit?"]
+    categories = {"Category": ["theme1", "theme2"]}
+    feedbacks = [{"answers": ["It was informative"], "key": 1}]
+
+    with pytest.raises(OpenAIRequestError) as exc_info:
+        asyncio.run(sortAsync("test_api_key", questions, categories, feedbacks))
+    assert "Rate limit exceeded" in str(exc_info.value.message)
+
+
+class PerQuestionClient:
+    """
+    Answers the request for each question with the categories in `responses`, by the first answer in the
+    prompt, after a short delay, and records the greatest number of requests that were sent at the same time.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.prompts = []
+        self.running = 0
+        self.max_running = 0
+        self.chat = MagicMock()
+        self.chat.completions.create = self.create
+
+    async def create(self, **kwargs):
+        prompt = kwargs["messages"][1]["content"]
+        self.prompts.append(prompt)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.05)
+        self.running -= 1
+        answer = next(answer for answer in self.responses if answer in prompt)
+        response = MagicMock()
+        response.choices[0].message.content = self.responses[answer].pop(0)
+        return response
+
+
+@patch("prompting.sort.async_openai_client")
+def test_sort_per_question(mock_openai):
+    """
+    Tests that `sortPerQuestionAsync` sends one request per question with only its categories and answers,
+    at most `concurrency` at a time, and merges them into {question: {category: [keys]}}.
+    """
+    questions = [f"Question {number}?" for number in range(6)]
+    categories = {
+        "Category": {
+            question: [f"Theme {number}", "Other"]
+            for number, question in enumerate(questions)
+        }
+    }
+    feedbacks = [
+        {"answers": [f"Answer {number} of {key}" for number in range(6)], "key": key}
+        for key in (1, 2)
+    ]
+    client = PerQuestionClient(
+        {
+            f"Answer {number} of 1": [
+                # The keys are nested under the question and written as strings
+                json.dumps(
+                    {questions[number]: {f"Theme {number}": ["1"], "Other": [2]}}
+                )
+            ]
+            for number in range(6)
+        }
+    )
+    mock_openai.return_value = client
+
+    result = asyncio.run(
+        sortPerQuestionAsync(
+            "test_api_key", questions, categories, feedbacks, concurrency=2
+        )
+    )
+
+    assert result == {
+        question: {f"Theme {number}": [1], "Other": [2]}
+        for number, question in enumerate(questions)
+    }
+    assert len(client.prompts) == 6
+    assert client.max_running == 2
+    prompt = next(prompt for prompt in client.prompts if "Answer 0 of 1" in prompt)
+    assert "Answer 1 of 1" not in prompt
+    assert "Theme 0" in prompt
+    assert "Theme 1" not in prompt
+
+
+@patch("prompting.sort.async_openai_client")
+def test_sort_per_question_retries_malformed_response(mock_openai):
+    """
+    Tests that a malformed response is sent again for its question alone, and raises a `DataProcessingError`
+    once the retries are used up.
+    """
+    questions = ["What went well?", "What was difficult?"]
+    categories = {"Category": {"Question1": ["Examples"], "Question2": ["Recursion"]}}
+    feedbacks = [{"answers": ["The examples", "Recursion"], "key": 1}]
+    client = PerQuestionClient(
+        {
+            "The examples": ["not json", '{"Examples": [1]}'],
+            "Recursion": ["not json", '{"Recursion": "1"}'],
+        }
+    )
+    mock_openai.return_value = client
+
+    with pytest.raises(DataProcessingError) as exc_info:
+        asyncio.run(
+            sortPerQuestionAsync("test_api_key", questions, categories, feedbacks)
+        )
+    assert "is not a list of keys" in exc_info.value.message
+    assert len(client.prompts) == 4
+
+    client.responses = {
+        "The examples": ["not json", '{"Examples": [1]}'],
+        "Recursion": ['{"Recursion": [1]}'],
+    }
+    result = asyncio.run(
+        sortPerQuestionAsync("test_api_key", questions, categories, feedbacks)
+    )
+    assert result == {
+        "What went well?": {"Examples": [1]},
+        "What was difficult?": {"Recursion": [1]},
+    }
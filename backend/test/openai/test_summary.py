@@ -1,23 +1,24 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from openai import OpenAIError, RateLimitError
 import pytest
 
 from api.utils.exceptions import DataProcessingError, OpenAIRequestError
-from prompting.summary import createSummary
+from prompting.summary import createSummary, createSummaryAsync
 
 """
 This test module verifies the functionality of the `summary` function, where the tests test the function's ability
 to handle successful API calls, rate limit errors, API errors, JSON decoding errors, and unexpected errors. It also tests the
 function's behavior when the is empty.
 
-Each test function is decorated with `@patch("prompting.summary.OpenAI")`
-to mock the `OpenAI` class, allowing the test to manipulate the behavior of the
+Each test function is decorated with `@patch("prompting.summary.openai_client")`
+to mock the shared `OpenAI` client, allowing the test to manipulate the behavior of the
 `chat.completions.create` method as needed for each scenario.
 """
 
 
-@patch("prompting.summary.OpenAI")
+@patch("prompting.summary.openai_client")
 def test_summary_success(mock_openai):
     """
     Tests the successful creation of a summary
@@ -48,7 +49,7 @@ def test_summary_success(mock_openai):
     ), "The function should return the expected output based on mock API response."
 
 
-@patch("prompting.summary.OpenAI")
+@patch("prompting.summary.openai_client")
 def test_rate_limit_error(mock_openai):
     """
     Tests the function's handling of a `RateLimitError`
@@ -72,7 +73,7 @@ def test_rate_limit_error(mock_openai):
     assert "Rate limit exceeded" in str(excinfo.value)
 
 
-@patch("prompting.summary.OpenAI")
+@patch("prompting.summary.openai_client")
 def test_openai_api_error(mock_openai):
     """
     Tests the function's handling of an `OpenAIError`
@@ -94,7 +95,7 @@ def test_openai_api_error(mock_openai):
     assert "API error" in str(excinfo.value)
 
 
-@patch("prompting.summary.OpenAI")
+@patch("prompting.summary.openai_client")
 def test_json_decoding_error(mock_openai):
     """
     Tests the function's behavior when the API response
@@ -116,7 +117,7 @@ def test_json_decoding_error(mock_openai):
     assert "JSON decoding error" in str(excinfo.value)
 
 
-@patch("prompting.summary.OpenAI")
+@patch("prompting.summary.openai_client")
 def test_unexpected_error(mock_openai):
     """
     Tests the function's response to an unexpected error
@@ -138,7 +139,7 @@ def test_unexpected_error(mock_openai):
     assert "Unexpected error" in str(excinfo.value)
 
 
-@patch("prompting.summary.OpenAI")
+@patch("prompting.summary.openai_client")
 def test_empty_answers(mock_openai):
     """
     Tests the function's behavior when the `answers`
@@ -150,3 +151,42 @@ def test_empty_answers(mock_openai):
     with pytest.raises(DataProcessingError) as excinfo:
         createSummary("test_api_key", {})
     assert "No student feedback has been provided." in str(excinfo.value)
+
+
+@patch("prompting.summary.async_openai_client")
+def test_summary_async_success(mock_openai):
+    """
+    Tests that `createSummaryAsync` awaits the shared AsyncOpenAI client and returns the parsed response.
+    """
+    mock_response = MagicMock()
+    mock_response.choices[0].message.content = '{"summary": "Here is the summary..."}'
+    client = mock_openai.return_value
+    client.chat.completions.create = AsyncMock(return_value=mock_response)
+
+    answers = {"Category1": {"Question1": ["Answer1", "Answer2"]}}
+
+    result = asyncio.run(createSummaryAsync("test_api_key", answers))
+
+    assert result == {"summary": "Here is the summary..."}
+    client.chat.completions.create.assert_awaited_once()
+
+
+@patch("prompting.summary.async_openai_client")
+def test_summary_async_rate_limit_error(mock_openai):
+    """
+    Tests that `createSummaryAsync` raises an `OpenAIRequestError` when the rate limit is exceeded.
+    """
+    client = mock_openai.return_value
+    client.chat.completions.create = AsyncMock(
+        side_effect=RateLimitError(
+            message="Rate limit exceeded",
+            response=MagicMock(status_code=429),
+            body="",
+        )
+    )
+
+    answers = {"Category1": {"Question1": ["Answer1", "Answer2"]}}
+
+    with pytest.raises(OpenAIRequestError) as exc_info:
+        asyncio.run(createSummaryAsync("test_api_key", answers))
+    assert "Rate limit exceeded" in str(exc_info.value.message)
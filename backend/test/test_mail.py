@@ -0,0 +1,122 @@
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+from fastapi_mail import ConnectionConfig
+
+from api.utils.mail import MailDispatcher
+
+"""
+This test module verifies the `MailDispatcher` against a local aiosmtpd server, where the tests
+check that every message is delivered, that connections are reused and bounded by the concurrency,
+and that failed messages are reported without stopping the rest.
+"""
+
+
+class RecordingHandler:
+    """
+    aiosmtpd handler that records every delivered message and the connection it arrived on.
+    """
+
+    def __init__(self, rejected=()):
+        self.rejected = set(rejected)
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.rejected:
+            return "550 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        self.sessions.add(session)
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def mail_config(port: int) -> ConnectionConfig:
+    return ConnectionConfig(
+        MAIL_USERNAME="",
+        MAIL_PASSWORD="",
+        MAIL_FROM="test@test.no",
+        MAIL_PORT=port,
+        MAIL_SERVER="127.0.0.1",
+        MAIL_FROM_NAME="Reflection Tool",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=False,
+        VALIDATE_CERTS=False,
+    )
+
+
+@pytest.fixture
+def smtp_server(request):
+    handler = RecordingHandler(rejected=getattr(request, "param", ()))
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+@pytest.mark.asyncio
+async def test_send_all_reuses_connections(smtp_server):
+    """
+    Tests that every message is delivered and that no more connections than the
+    configured concurrency are opened.
+    """
+    dispatcher = MailDispatcher(mail_config(smtp_server.port), concurrency=3)
+    messages = [
+        dispatcher.create_message(f"student{i}@test.no", "TDT4100", f"<p>{i}</p>")
+        for i in range(25)
+    ]
+
+    errors = await dispatcher.send_all(messages)
+
+    assert errors == [None] * 25
+    assert len(smtp_server.handler.messages) == 25
+    assert len(smtp_server.handler.sessions) <= 3
+    assert sorted(m.rcpt_tos[0] for m in smtp_server.handler.messages) == sorted(
+        f"student{i}@test.no" for i in range(25)
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("smtp_server", [["student3@test.no"]], indirect=True)
+async def test_send_all_reports_rejected_message(smtp_server):
+    """
+    Tests that a rejected recipient is reported for that message only.
+    """
+    dispatcher = MailDispatcher(mail_config(smtp_server.port), concurrency=2)
+    messages = [
+        dispatcher.create_message(f"student{i}@test.no", "TDT4100", "<p>Hi</p>")
+        for i in range(6)
+    ]
+
+    errors = await dispatcher.send_all(messages)
+
+    assert errors[3] is not None
+    assert [error for i, error in enumerate(errors) if i != 3] == [None] * 5
+    assert len(smtp_server.handler.messages) == 5
+
+
+@pytest.mark.asyncio
+async def test_send_all_unreachable_server():
+    """
+    Tests that every message is reported as failed when the server cannot be reached.
+    """
+    dispatcher = MailDispatcher(mail_config(free_port()), concurrency=2)
+    messages = [
+        dispatcher.create_message(f"student{i}@test.no", "TDT4100", "<p>Hi</p>")
+        for i in range(3)
+    ]
+
+    errors = await dispatcher.send_all(messages)
+
+    assert all(error is not None for error in errors)
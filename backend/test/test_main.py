@@ -1,19 +1,29 @@
-from unittest.mock import MagicMock, patch
+import asyncio
+import gzip
+import json
+import httpx
+import os
+from contextlib import contextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
-from api.main import (
-    app,
-    is_admin,
-)
-from api import crud
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from api.main import app
+from api.auth import AuthContext
+from api import crud, model, schemas
+from api.utils.mail import MailDispatcher, email_config
+from api.utils.cache import cache
+from api.worker import drain_outbox
+from api.database import async_engine
+from prompting.createCategories import CONTEXT_WINDOWS, estimate_tokens
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import selectinload
 from fastapi import Request
 
 # Setup for the test database
-DATABASE_URL = "sqlite:///./test.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+engine = create_async_engine(DATABASE_URL)
+TestingSessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
 
 client = TestClient(app)
 
@@ -49,10 +59,12 @@ def create_user(uid: str, email: str, admin: bool = False) -> None:
         email (str): The user email.
         admin (bool, optional): Whether the user is an admin. Defaults to False.
     """
-    db = TestingSessionLocal()
-    crud.create_user(db=db, uid=uid, user_email=email, admin=admin)
-    db.commit()
-    db.close()
+
+    async def _create_user():
+        async with TestingSessionLocal() as db:
+            await crud.create_user(db=db, uid=uid, user_email=email, admin=admin)
+
+    asyncio.run(_create_user())
 
 
 def login_user(uid: str, email: str) -> None:
@@ -66,6 +78,30 @@ def login_user(uid: str, email: str) -> None:
     client.get(f"/test/set-test-user?uid={uid}&email={email}")
 
 
+@contextmanager
+def count_queries():
+    """
+    Collects the SQL statements the API sends to the database inside the with block.
+
+    Yields:
+        list[str]: The executed statements, filled in as they are run.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(
+        async_engine.sync_engine, "before_cursor_execute", before_cursor_execute
+    )
+    try:
+        yield statements
+    finally:
+        event.remove(
+            async_engine.sync_engine, "before_cursor_execute", before_cursor_execute
+        )
+
+
 @pytest.mark.asyncio
 def test_user_endpoint():
     """
@@ -148,21 +184,48 @@ def test_create_course_admin():
     - Creating a course by an admin user.
     - Enrolling as a teacher in the course.
     - Verifying that the course was created and the user was enrolled.
+    - The number of statements sent to the database, which does not depend on the number of questions.
     """
     uid = users["admin"]["uid"]
     admin_email = users["admin"]["email"]
     login_user(uid, admin_email)
 
+    with count_queries() as queries:
+        response = client.post(
+            "/create_course",
+            json={
+                "name": "Introduction to lorem ipsum",
+                "id": "TDT1000",
+                "semester": "fall2023",
+            },
+        )
+
+    assert response.status_code == 200
+    # One bulk insert each for the questions, the course, the enrollment and the course questions
+    assert len([query for query in queries if query.startswith("INSERT")]) == 4
+    assert len(queries) <= 6
+
+    # The course already exists, so nothing is saved
     response = client.post(
         "/create_course",
         json={
-            "name": "Introduction to lorem ipsum",
+            "name": "Duplicate",
             "id": "TDT1000",
             "semester": "fall2023",
+            "questions": [{"question": "Orphan", "comment": "Is not saved"}],
         },
     )
+    assert response.status_code == 409
 
-    assert response.status_code == 200
+    async def _orphan_questions():
+        async with TestingSessionLocal() as db:
+            return await db.scalar(
+                select(func.count())
+                .select_from(model.Question)
+                .where(model.Question.question == "Orphan")
+            )
+
+    assert asyncio.run(_orphan_questions()) == 0
 
     response = client.get("/user")
     data = response.json()
@@ -283,6 +346,866 @@ def test_create_reflection():
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+def test_units_total_reflections():
+    """
+    Test case for the number of students that have reflected on a unit, counted by /units.
+    """
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    response = client.post(
+        "/reflection",
+        json={
+            "body": "reflections test",
+            "user_id": "admin",
+            "unit_id": 1,
+            "question_id": 2,
+        },
+    )
+    assert response.status_code == 200
+
+    response = client.get("/units?course_id=TDT1000&course_semester=fall2023")
+    assert response.status_code == 200
+    data = response.json()
+
+    assert len(data) == 1
+    assert data[0]["total_reflections"] == 2
+
+
+@pytest.mark.asyncio
+def test_reflection_counted_once():
+    """
+    Test case for answering a question twice, which is rejected, and for reflections_since_last_report,
+    which counts each user once per unit.
+    """
+
+    async def _reflections_since_last_report(unit_id):
+        async with TestingSessionLocal() as db:
+            return (await crud.get_unit(db, unit_id)).reflections_since_last_report
+
+    login_user(users["test"]["uid"], users["test"]["email"])
+    response = client.post(
+        "/reflection",
+        json={
+            "body": "second answer",
+            "user_id": "test",
+            "unit_id": 1,
+            "question_id": 1,
+        },
+    )
+    assert response.status_code == 403
+    assert response.json()["detail"] == "You have already reflected this question"
+
+    response = client.post(
+        "/reflection",
+        json={
+            "body": "answer to the second question",
+            "user_id": "test",
+            "unit_id": 1,
+            "question_id": 2,
+        },
+    )
+    assert response.status_code == 200
+
+    # One reflection from the test user and one from the admin
+    assert asyncio.run(_reflections_since_last_report(1)) == 2
+
+
+@pytest.mark.asyncio
+def test_user_endpoint_query_count():
+    """
+    Test case for the number of queries made by /user, which should not grow with the number of enrollments.
+    """
+    login_user(users["test"]["uid"], users["test"]["email"])
+    with count_queries() as queries:
+        response = client.get("/user")
+    assert response.status_code == 200
+    queries_with_one_course = len(queries)
+
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    for course_id in ["TDT2000", "TDT2001"]:
+        response = client.post(
+            "/create_course",
+            json={"name": "Query count", "id": course_id, "semester": "fall2023"},
+        )
+        assert response.status_code == 200
+        response = client.post(
+            "/create_unit",
+            json={
+                "hidden": False,
+                "title": "tittel1",
+                "date_available": "2022-08-23 00:00:00",
+                "course_id": course_id,
+                "course_semester": "fall2023",
+            },
+        )
+        assert response.status_code == 200
+
+    login_user(users["test"]["uid"], users["test"]["email"])
+    for course_id in ["TDT2000", "TDT2001"]:
+        response = client.post(
+            "/enroll",
+            json={
+                "course_id": course_id,
+                "course_semester": "fall2023",
+                "role": "student",
+            },
+        )
+        assert response.status_code == 200
+
+    with count_queries() as queries:
+        response = client.get("/user")
+    assert response.status_code == 200
+    data = response.json()
+
+    assert len(data["enrollments"]) == 3
+    for enrollment in data["enrollments"]:
+        if enrollment["course_id"] != "TDT1000":
+            assert enrollment["course_name"] == "Query count"
+            assert len(enrollment["missingUnits"]) == 1
+    assert len(queries) == queries_with_one_course
+    assert len(queries) <= 5
+
+
+@pytest.mark.asyncio
+def test_notification_recipients():
+    """
+    Test case for planning reminder emails: only students get reminded, only about available units they
+    have not reflected on.
+    """
+
+    async def _recipients():
+        async with TestingSessionLocal() as db:
+            return await crud.get_notification_recipients(db, notification_limit=2)
+
+    planned = {
+        (recipient["uid"], recipient["course_id"]): [
+            unit.title for unit in recipient["units"]
+        ]
+        for recipient in asyncio.run(_recipients())
+    }
+    assert planned == {
+        ("test", "TDT2000"): ["tittel1"],
+        ("test", "TDT2001"): ["tittel1"],
+    }
+
+
+class FlakyDispatcher(MailDispatcher):
+    """
+    A MailDispatcher that fails the first `failures` messages and records the subjects of the messages
+    it delivers, without connecting to an SMTP server.
+    """
+
+    def __init__(self, failures: int):
+        super().__init__(email_config)
+        self.failures = failures
+        self.delivered = []
+
+    async def send_all(self, messages):
+        results = []
+        for message in messages:
+            if self.failures > 0:
+                self.failures -= 1
+                results.append(ConnectionRefusedError("SMTP server unavailable"))
+            else:
+                self.delivered.append(message["Subject"])
+                results.append(None)
+        return results
+
+
+@pytest.mark.asyncio
+def test_send_notifications_outbox():
+    """
+    Test case for queueing reminder emails in the notification outbox and sending them with the worker,
+    where the first attempt fails and is retried.
+    """
+
+    async def _planned_units(notification_limit):
+        async with TestingSessionLocal() as db:
+            recipients = await crud.get_notification_recipients(db, notification_limit)
+            return [unit.id for recipient in recipients for unit in recipient["units"]]
+
+    response = client.post("/send-notifications")
+    assert response.status_code == 202
+    assert response.json()["recipients"] == 2
+    job_id = response.json()["job_id"]
+
+    # The notification counts are saved together with the queued email, so a unit is planned again only
+    # while it is under the notification limit
+    response = client.get("/user")
+    unit_id = next(
+        unit["id"]
+        for enrollment in response.json()["enrollments"]
+        if enrollment["course_id"] == "TDT2001"
+        for unit in enrollment["missingUnits"]
+    )
+    assert unit_id in asyncio.run(_planned_units(2))
+    assert unit_id not in asyncio.run(_planned_units(1))
+
+    # Recipient errors are only shown to admins and lecturers
+    assert TestClient(app).get(f"/notification-jobs/{job_id}").status_code == 401
+    assert client.get(f"/notification-jobs/{job_id}").status_code == 403
+
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    response = client.get(f"/notification-jobs/{job_id}")
+    assert response.status_code == 200
+    assert response.json()["pending"] == 2
+    assert response.json()["done"] is False
+
+    # The cooldown applies as soon as the notification round is queued
+    assert client.post("/send-notifications").status_code == 400
+
+    dispatcher = FlakyDispatcher(failures=1)
+    attempted = asyncio.run(
+        drain_outbox(dispatcher, session_factory=TestingSessionLocal, backoff_seconds=0)
+    )
+    assert attempted == 3
+    assert dispatcher.delivered == [
+        "TDT2001 - Missing Reflection",
+        "TDT2000 - Missing Reflection",
+    ]
+
+    response = client.get(f"/notification-jobs/{job_id}")
+    assert response.json()["sent"] == 2
+    assert response.json()["failures"] == []
+    assert response.json()["done"] is True
+
+    assert client.get("/notification-jobs/0").status_code == 404
+
+
+@pytest.mark.asyncio
+def test_create_reflections_batch():
+    """
+    Test case for submitting every answer to a unit in one request, which is saved all-or-nothing.
+    """
+
+    async def _question_ids():
+        async with TestingSessionLocal() as db:
+            questions = await crud.get_course_questions(db, "TDT2000", "fall2023")
+            return sorted(question.id for question in questions)
+
+    async def _unit(unit_id):
+        async with TestingSessionLocal() as db:
+            return await crud.get_unit(db, unit_id)
+
+    login_user(users["test"]["uid"], users["test"]["email"])
+    response = client.get("/units?course_id=TDT2000&course_semester=fall2023")
+    unit_id = response.json()[0]["id"]
+    question_ids = asyncio.run(_question_ids())
+
+    def _submit(question_ids):
+        return client.post(
+            "/reflections",
+            json={
+                "user_id": "test",
+                "unit_id": unit_id,
+                "answers": [
+                    {"question_id": question_id, "body": f"answer {question_id}"}
+                    for question_id in question_ids
+                ],
+            },
+        )
+
+    # Question 1 belongs to another course, so none of the answers are saved
+    assert _submit([question_ids[0], 1]).status_code == 404
+    assert _submit([question_ids[0], question_ids[0]]).status_code == 400
+
+    response = _submit(question_ids)
+    assert response.status_code == 200
+    assert [reflection["question_id"] for reflection in response.json()] == question_ids
+    assert asyncio.run(_unit(unit_id)).reflections_since_last_report == 1
+
+    assert _submit(question_ids).status_code == 403
+    assert asyncio.run(_unit(unit_id)).reflections_since_last_report == 1
+
+
+@pytest.mark.asyncio
+def test_delete_unit_and_course():
+    """
+    Test case for deleting a unit and a course together with their reflections, with one DELETE statement
+    per table.
+    """
+
+    async def _reflections(unit_id):
+        async with TestingSessionLocal() as db:
+            return await crud.get_unit_reflections(db, unit_id)
+
+    async def _course_questions(course_id):
+        async with TestingSessionLocal() as db:
+            return await crud.get_course_questions(db, course_id, "fall2023")
+
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    unit_ids = {
+        course_id: client.get(
+            f"/units?course_id={course_id}&course_semester=fall2023"
+        ).json()[0]["id"]
+        for course_id in ["TDT2000", "TDT2001"]
+    }
+    assert len(asyncio.run(_reflections(unit_ids["TDT2000"]))) == 2
+
+    with count_queries() as queries:
+        response = client.request(
+            "DELETE",
+            f"/delete_unit/{unit_ids['TDT2001']}",
+            json={"course_id": "TDT2001", "course_semester": "fall2023"},
+        )
+    assert response.status_code == 200
+    assert len([query for query in queries if query.startswith("DELETE")]) == 4
+
+    with count_queries() as queries:
+        response = client.request(
+            "DELETE", "/delete_course", json={"id": "TDT2000", "semester": "fall2023"}
+        )
+    assert response.status_code == 200
+    assert len([query for query in queries if query.startswith("DELETE")]) == 9
+
+    assert asyncio.run(_reflections(unit_ids["TDT2000"])) == []
+    assert asyncio.run(_course_questions("TDT2000")) == []
+    assert len(asyncio.run(_course_questions("TDT2001"))) == 2
+
+    login_user(users["test"]["uid"], users["test"]["email"])
+    response = client.get("/user")
+    assert [e["course_id"] for e in response.json()["enrollments"]] == [
+        "TDT1000",
+        "TDT2001",
+    ]
+
+
+@pytest.mark.asyncio
+def test_create_units_schedule():
+    """
+    Test case for creating the units of a semester in one request, with one insert for the units and one
+    for their reports on Postgres, where each unit is paired with its own report.
+    """
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    schedule = [
+        {"title": f"Week {week}", "date_available": f"2023-08-{week + 10:02d}"}
+        for week in range(1, 13)
+    ]
+
+    with count_queries() as queries:
+        response = client.post(
+            "/create_units",
+            json={
+                "course_id": "TDT2001",
+                "course_semester": "fall2023",
+                "units": schedule,
+            },
+        )
+    assert response.status_code == 200
+    # The rows are returned in the order of the schedule. Postgres sorts them by the generated id in a single
+    # statement, SQLite cannot, and inserts them one statement per row instead
+    inserts = 2 if async_engine.dialect.name == "postgresql" else 2 * len(schedule)
+    assert len([query for query in queries if query.startswith("INSERT")]) == inserts
+
+    data = response.json()
+    assert [unit["title"] for unit in data] == [unit["title"] for unit in schedule]
+    for unit in data:
+        assert unit["reports"] == [
+            {
+                "number_of_answers": 0,
+                "unit_id": unit["id"],
+                "course_id": "TDT2001",
+                "course_semester": "fall2023",
+            }
+        ]
+
+    response = client.get("/units?course_id=TDT2001&course_semester=fall2023")
+    assert len(response.json()) == 12
+
+    login_user(users["test"]["uid"], users["test"]["email"])
+    response = client.post(
+        "/create_units",
+        json={"course_id": "TDT2001", "course_semester": "fall2023", "units": schedule},
+    )
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+def test_import_roster():
+    """
+    Test case for importing a CSV roster as enrollments and an NDJSON roster as invitations, where invalid,
+    duplicate and already enrolled rows are reported per line without stopping the import.
+    """
+
+    async def _students(course_id):
+        async with TestingSessionLocal() as db:
+            uids = await db.scalars(
+                select(model.Enrollment.uid).where(
+                    model.Enrollment.course_id == course_id,
+                    model.Enrollment.course_semester == "fall2023",
+                    model.Enrollment.role == "student",
+                )
+            )
+            return sorted(uids)
+
+    roster = "\n".join(
+        [
+            "uid,email,role",
+            "student1,student1@stud.ntnu.no,student",
+            "test,test@test.no,student",
+            "student2,student2@stud.ntnu.no,",
+            ",missing@stud.ntnu.no,student",
+            "student3,student3@stud.ntnu.no,professor",
+            "student1,student1@stud.ntnu.no,student",
+        ]
+    )
+
+    login_user(users["test"]["uid"], users["test"]["email"])
+    response = client.post(
+        "/import_roster?course_id=TDT2001&course_semester=fall2023",
+        content=roster,
+        headers={"Content-Type": "text/csv"},
+    )
+    assert response.status_code == 403
+
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    with count_queries() as queries:
+        response = client.post(
+            "/import_roster?course_id=TDT2001&course_semester=fall2023",
+            content=roster,
+            headers={"Content-Type": "text/csv"},
+        )
+    assert response.status_code == 200
+    # One insert for the users and one for the enrollments
+    assert len([query for query in queries if query.startswith("INSERT")]) == 2
+
+    data = response.json()
+    assert data["imported"] == 2
+    assert data["conflicts"] == 2
+    assert data["invalid"] == 2
+    assert [(row["line"], row["status"]) for row in data["rows"]] == [
+        (3, "conflict"),
+        (5, "invalid"),
+        (6, "invalid"),
+        (7, "conflict"),
+    ]
+    assert asyncio.run(_students("TDT2001")) == ["student1", "student2", "test"]
+
+    invitations = "\n".join(
+        [
+            '{"uid": "student4", "email": "student4@stud.ntnu.no", "role": "teaching assistant"}',
+            "not json",
+        ]
+    )
+    # Importing the same roster again skips the invitations on the unique index instead of duplicating them
+    for imported in [1, 0]:
+        with count_queries() as queries:
+            response = client.post(
+                "/import_roster?course_id=TDT2001&course_semester=fall2023&target=invitation",
+                content=invitations,
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+        assert response.status_code == 200
+        assert [query.split()[0] for query in queries].count("INSERT") == 2
+        assert response.json()["imported"] == imported
+        assert response.json()["invalid"] == 1
+
+    login_user("student4", "student4@stud.ntnu.no")
+    response = client.get("/get_invitations")
+    assert [invitation["role"] for invitation in response.json()] == [
+        "teaching assistant"
+    ]
+
+
+@pytest.mark.asyncio
+def test_clone_course():
+    """
+    Test case for cloning a course with its questions and units into a new semester with shifted dates,
+    with one INSERT ... SELECT per table.
+    """
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    clone = {
+        "id": "TDT2001",
+        "semester": "fall2023",
+        "new_semester": "fall2024",
+        "date_offset_days": 364,
+    }
+
+    with count_queries() as queries:
+        response = client.post("/clone_course", json=clone)
+    assert response.status_code == 200
+    assert response.json()["role"] == "lecturer"
+    # The course, question links, units and reports, and the lecturer enrollment
+    assert len([query for query in queries if query.startswith("INSERT")]) == 5
+
+    original = client.get("/units?course_id=TDT2001&course_semester=fall2023").json()
+    cloned = client.get("/units?course_id=TDT2001&course_semester=fall2024").json()
+    assert [unit["title"] for unit in cloned] == [unit["title"] for unit in original]
+    assert cloned[0]["date_available"] == "2024-08-09"
+    assert original[0]["date_available"] == "2023-08-11"
+    assert all(unit["reflections_since_last_report"] == 0 for unit in cloned)
+
+    async def _report_unit_ids():
+        async with TestingSessionLocal() as db:
+            return sorted(
+                (
+                    await db.scalars(
+                        select(model.Report.unit_id).where(
+                            model.Report.course_semester == "fall2024"
+                        )
+                    )
+                ).all()
+            )
+
+    assert asyncio.run(_report_unit_ids()) == sorted(unit["id"] for unit in cloned)
+
+    response = client.get("/course?course_id=TDT2001&course_semester=fall2024")
+    assert len(response.json()["questions"]) == 2
+
+    assert client.post("/clone_course", json=clone).status_code == 409
+    clone["id"] = "TDT9999"
+    assert client.post("/clone_course", json=clone).status_code == 404
+
+
+@pytest.mark.asyncio
+def test_auth_query_count():
+    """
+    Test case for the number of queries per endpoint, where the user, admin flag and enrollment
+    are looked up once per request with one query.
+    """
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    unit_id = client.get("/units?course_id=TDT2001&course_semester=fall2023").json()[0][
+        "id"
+    ]
+
+    requests = {
+        "/units": lambda: client.get(
+            "/units?course_id=TDT2001&course_semester=fall2023"
+        ),
+        "/unit_data": lambda: client.get(
+            f"/unit_data?course_id=TDT2001&course_semester=fall2023&unit_id={unit_id}"
+        ),
+        "/create_unit": lambda: client.post(
+            "/create_unit",
+            json={
+                "hidden": False,
+                "title": "tittel3",
+                "date_available": "2022-08-23 00:00:00",
+                "course_id": "TDT2001",
+                "course_semester": "fall2023",
+            },
+        ),
+        "/update_unit": lambda: client.patch(
+            f"/update_unit/{unit_id}",
+            json={
+                "hidden": False,
+                "title": "tittel1",
+                "date_available": "2022-08-23 00:00:00",
+                "course_id": "TDT2001",
+                "course_semester": "fall2023",
+            },
+        ),
+    }
+    # The user and enrollment query, plus what the endpoint itself reads and writes, with an empty cache
+    expected_queries = {
+        "/units": 3,
+        "/unit_data": 6,
+        "/create_unit": 4,
+        "/update_unit": 5,
+    }
+    for endpoint, send in requests.items():
+        asyncio.run(cache.clear())
+        with count_queries() as queries:
+            response = send()
+        assert response.status_code == 200, endpoint
+        user_queries = [query for query in queries if "FROM users" in query]
+        assert len(user_queries) == 1, endpoint
+        assert len(queries) == expected_queries[endpoint], endpoint
+
+
+@pytest.mark.asyncio
+def test_cache_hits_and_invalidation():
+    """
+    Test case for serving the user, course, questions and enrollment from the cache on repeated requests,
+    and for invalidating them when the enrollment or the course changes.
+    """
+    login_user(users["test"]["uid"], users["test"]["email"])
+    url = "/units?course_id=TDT2001&course_semester=fall2024"
+    # The first request enrolls the user as a student, the second caches the enrollment
+    unit_id = client.get(url).json()[0]["id"]
+    unit_url = (
+        f"/unit_data?course_id=TDT2001&course_semester=fall2024&unit_id={unit_id}"
+    )
+    client.get(unit_url)
+    hits = cache.stats()["hits"]
+
+    with count_queries() as queries:
+        response = client.get(unit_url)
+    assert response.status_code == 200
+    assert not [
+        query
+        for query in queries
+        if "FROM users" in query or "FROM courses" in query or "FROM questions" in query
+    ]
+    # The user, the enrollment, the course and its questions
+    assert cache.stats()["hits"] == hits + 4
+    assert client.get("/cache_stats").status_code == 403
+
+    response = client.request(
+        "DELETE",
+        "/unenroll_course",
+        json={"course_id": "TDT2001", "course_semester": "fall2024", "role": "student"},
+    )
+    assert response.status_code == 200
+
+    # The enrollment is looked up again, and the user is enrolled again as a student
+    with count_queries() as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert len([query for query in queries if query.startswith("INSERT")]) == 1
+
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    assert client.get("/cache_stats").json()["hits"] > hits
+    response = client.request(
+        "DELETE", "/delete_course", json={"id": "TDT2001", "semester": "fall2024"}
+    )
+    assert response.status_code == 200
+    login_user(users["test"]["uid"], users["test"]["email"])
+    assert client.get(url).status_code == 404
+
+
+@pytest.mark.asyncio
+def test_download_report():
+    """
+    Test case for downloading a report as JSON, CSV and Markdown, streamed without writing a file.
+    """
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    unit_id = client.get("/units?course_id=TDT2001&course_semester=fall2023").json()[0][
+        "id"
+    ]
+
+    async def _save_report():
+        async with TestingSessionLocal() as db:
+            await crud.save_report(
+                db,
+                {
+                    "report_content": {
+                        "What went well?": {
+                            "Recursion": ["The examples", 'The "tail" calls'],
+                        },
+                        "Summary": "Most students liked recursion",
+                    },
+                    "number_of_answers": 2,
+                    "unit_id": unit_id,
+                    "course_id": "TDT2001",
+                    "course_semester": "fall2023",
+                },
+            )
+
+    asyncio.run(_save_report())
+    url = f"/download?course_id=TDT2001&course_semester=fall2023&unit_id={unit_id}"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == (
+        f'attachment; filename="report-TDT2001-fall2023-unit{unit_id}.json"'
+    )
+    assert response.json()["Summary"] == "Most students liked recursion"
+    assert response.json()["report_content"] == {
+        "What went well?": {"Recursion": ["The examples", 'The "tail" calls']}
+    }
+
+    response = client.get(url + "&format=csv")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    assert response.text.splitlines() == [
+        "question,category,answer",
+        "Summary,,Most students liked recursion",
+        "What went well?,Recursion,The examples",
+        'What went well?,Recursion,"The ""tail"" calls"',
+    ]
+
+    response = client.get(url + "&format=markdown")
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].endswith('.md"')
+    assert "## What went well?\n\n### Recursion\n\n- The examples\n" in response.text
+
+    assert client.get(url + "&format=pdf").status_code == 400
+    assert not os.path.exists("report.txt")
+
+
+@pytest.mark.asyncio
+def test_export_course():
+    """
+    Test case for exporting every reflection and report of a course as NDJSON, CSV and gzip.
+    """
+
+    async def _question_ids():
+        async with TestingSessionLocal() as db:
+            questions = await crud.get_course_questions(db, "TDT2001", "fall2023")
+            return sorted(question.id for question in questions)
+
+    login_user(users["test"]["uid"], users["test"]["email"])
+    units = client.get("/units?course_id=TDT2001&course_semester=fall2023").json()
+    question_ids = asyncio.run(_question_ids())
+    response = client.post(
+        "/reflections",
+        json={
+            "user_id": "test",
+            "unit_id": units[0]["id"],
+            "answers": [
+                {"question_id": question_id, "body": f"answer, {question_id}"}
+                for question_id in question_ids
+            ],
+        },
+    )
+    assert response.status_code == 200
+    url = "/export?course_id=TDT2001&course_semester=fall2023"
+    assert client.get(url).status_code == 403
+
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    response = client.get(url + "&include_reports=true")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in response.text.splitlines()]
+    reflections = [record for record in records if record["type"] == "reflection"]
+    assert [reflection["body"] for reflection in reflections] == [
+        f"answer, {question_id}" for question_id in question_ids
+    ]
+    assert reflections[0]["unit_title"] == units[0]["title"]
+    assert reflections[0]["user_id"] == "test"
+    reports = [record for record in records if record["type"] == "report"]
+    assert len(reports) == 1
+    assert reports[0]["Summary"] == "Most students liked recursion"
+
+    response = client.get(url + "&format=csv")
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines[0] == (
+        "type,unit_id,unit_title,question_id,question,user_id,timestamp,category,body"
+    )
+    assert len(lines) == 1 + len(question_ids)
+    assert lines[1].startswith(f"reflection,{units[0]['id']},")
+    assert lines[1].endswith(f',"answer, {question_ids[0]}"')
+
+    response = client.get(url + "&format=csv&include_reports=true&gzip=true")
+    assert response.status_code == 200
+    assert response.headers["content-disposition"].endswith('.csv.gz"')
+    lines = gzip.decompress(response.content).decode().splitlines()
+    assert lines[-1] == (
+        f"report,{units[0]['id']},{units[0]['title']},,What went well?,,,"
+        f'Recursion,"The ""tail"" calls"'
+    )
+
+    assert client.get(url + "&format=xml").status_code == 400
+    assert (
+        client.get("/export?course_id=TDT9999&course_semester=fall2023").status_code
+        == 404
+    )
+
+
+@pytest.mark.asyncio
+def test_conditional_get():
+    """
+    Test case for answering If-None-Match with 304 from the change counters of courses and units,
+    without loading the course or the unit, and for new ETags after they change.
+    """
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    course = "course_id=TDT2001&course_semester=fall2023"
+    unit_id = client.get(f"/units?{course}").json()[0]["id"]
+    urls = {
+        "course": f"/course?{course}",
+        "units": f"/units?{course}",
+        "unit_data": f"/unit_data?{course}&unit_id={unit_id}",
+        "report": f"/report?{course}&unit_id={unit_id}",
+    }
+
+    def _etags():
+        etags = {}
+        for name, url in urls.items():
+            response = client.get(url)
+            assert response.status_code == 200, name
+            assert response.headers["cache-control"] == "private, no-cache"
+            etags[name] = response.headers["etag"]
+        return etags
+
+    etags = _etags()
+    for name, url in urls.items():
+        with count_queries() as queries:
+            response = client.get(url, headers={"If-None-Match": etags[name]})
+        assert response.status_code == 304, name
+        assert response.headers["etag"] == etags[name]
+        assert response.content == b""
+        assert not [
+            query
+            for query in queries
+            if "FROM questions" in query or "FROM reports" in query
+        ], name
+
+    response = client.post(
+        "/create_unit",
+        json={
+            "hidden": False,
+            "title": "tittel4",
+            "date_available": "2022-08-23 00:00:00",
+            "course_id": "TDT2001",
+            "course_semester": "fall2023",
+        },
+    )
+    assert response.status_code == 200
+    changed = _etags()
+    assert changed["course"] != etags["course"]
+    assert changed["units"] != etags["units"]
+    assert changed["unit_data"] == etags["unit_data"]
+
+    async def _save_report():
+        async with TestingSessionLocal() as db:
+            await crud.save_report(
+                db,
+                {
+                    "report_content": {"Summary": "Updated"},
+                    "number_of_answers": 1,
+                    "unit_id": unit_id,
+                    "course_id": "TDT2001",
+                    "course_semester": "fall2023",
+                },
+            )
+
+    asyncio.run(_save_report())
+    etags, changed = changed, _etags()
+    assert all(changed[name] != etags[name] for name in urls)
+    response = client.get(urls["report"], headers={"If-None-Match": etags["report"]})
+    assert response.status_code == 200
+    assert response.json()["report_content"] == {"Summary": "Updated"}
+
+
+@pytest.mark.asyncio
+def test_course_rows_match_schema():
+    """
+    Test case for /course, which is built from column rows without the response_model, returning the same
+    data as validating the course with its relations through schemas.Course.
+    """
+
+    async def _validated_course():
+        async with TestingSessionLocal() as db:
+            course = await db.scalar(
+                select(model.Course)
+                .where(
+                    model.Course.id == "TDT2001", model.Course.semester == "fall2023"
+                )
+                .options(
+                    selectinload(model.Course.questions),
+                    selectinload(model.Course.users),
+                    selectinload(model.Course.reports),
+                )
+            )
+            return schemas.Course.model_validate(
+                course, from_attributes=True
+            ).model_dump(mode="json")
+
+    def _sorted(course):
+        for key in ["questions", "users", "reports"]:
+            course[key] = sorted(course[key], key=json.dumps)
+        return course
+
+    login_user(users["admin"]["uid"], users["admin"]["email"])
+    response = client.get("/course?course_id=TDT2001&course_semester=fall2023")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert len(response.json()["users"]) > 1
+    assert _sorted(response.json()) == _sorted(asyncio.run(_validated_course()))
+
+
 @pytest.mark.asyncio
 def test_analyze_feedback_invalid_data():
     """
@@ -292,6 +1215,218 @@ def test_analyze_feedback_invalid_data():
     assert response.status_code == 422
 
 
+class SlowAsyncOpenAI:
+    """
+    Stands in for the AsyncOpenAI client, and answers every chat completion after `delay` seconds without
+    blocking the event loop.
+    """
+
+    delay = 0.5
+
+    def __init__(self, api_key=None):
+        self.chat = MagicMock()
+        self.chat.completions.create = self.create
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.delay)
+        prompt = kwargs["messages"][1]["content"]
+        if "Categories: {" in prompt:
+            content = {"What went well?": {"Good": [1]}}
+        elif "Category: {" in prompt:
+            content = {"Category": {"Question1": ["Good"]}}
+        else:
+            content = {"summary": "Most students liked the unit."}
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps(content)
+        return response
+
+
+def test_analyze_feedback_does_not_block():
+    """
+    Test that other requests are served while /analyze_feedback waits for the OpenAI API.
+    """
+
+    async def requests():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as client:
+            await client.get(
+                "/test/set-test-user",
+                params={"uid": "test", "email": "test@example.com"},
+            )
+            analysis = asyncio.create_task(
+                client.post(
+                    "/analyze_feedback",
+                    json={
+                        "api_key": "test",
+                        "questions": ["What went well?"],
+                        "student_feedback": [{"answers": ["The examples"]}],
+                        "use_cheap_model": True,
+                    },
+                )
+            )
+            await asyncio.sleep(0.1)
+            user = await client.get("/user")
+            assert not analysis.done()
+            return user, await analysis
+
+    with (
+        patch("prompting.createCategories.async_openai_client", SlowAsyncOpenAI),
+        patch("prompting.sort.async_openai_client", SlowAsyncOpenAI),
+        patch("prompting.summary.async_openai_client", SlowAsyncOpenAI),
+    ):
+        user, analysis = asyncio.run(requests())
+
+    assert user.status_code == 200
+    assert user.json()["uid"] == "test"
+    assert analysis.status_code == 200
+    assert analysis.json() == {
+        "What went well?": {"Good": ["The examples"], "Not included by AI": []},
+        "Summary": "Most students liked the unit.",
+    }
+
+
+@pytest.fixture
+def cohort_feedback():
+    """
+    The feedback of 2500 students to two questions, 5000 answers in total.
+    """
+    return [
+        {
+            "answers": [
+                f"Student {student} liked the worked examples of the lecture",
+                f"Student {student} found the recursion exercises difficult",
+            ]
+        }
+        for student in range(2500)
+    ]
+
+
+class CohortOpenAI:
+    """
+    Stands in for the AsyncOpenAI client when a large cohort is analyzed. It checks that every categorization
+    prompt fits in the context window of the model, and records the prompts of every step.
+    """
+
+    def __init__(self, api_key=None):
+        self.chat = MagicMock()
+        self.chat.completions.create = self.create
+        self.categorize = []
+        self.reduce = []
+        self.requests = 0
+
+    async def create(self, **kwargs):
+        self.requests += 1
+        prompt = kwargs["messages"][1]["content"]
+        if "Here are the students' feedback" in prompt:
+            assert estimate_tokens(prompt) < CONTEXT_WINDOWS[kwargs["model"]]
+            self.categorize.append(prompt)
+            # Every shard finds the same themes, written a bit differently
+            content = {
+                "Category": {
+                    "Question1": ["Worked examples", " worked  examples"],
+                    "Question2": ["Recursion"],
+                }
+            }
+        elif "split into parts" in prompt:
+            self.reduce.append(prompt)
+            content = {
+                "Category": {
+                    "What went well?": ["Worked examples"],
+                    "What was difficult?": ["Recursion"],
+                }
+            }
+        elif "Here is the question" in prompt:
+            category = "Worked examples" if "went well" in prompt else "Recursion"
+            content = {category: [1, 2]}
+        else:
+            content = {"summary": "Students liked the examples."}
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps(content)
+        return response
+
+
+def test_analyze_feedback_large_cohort(cohort_feedback):
+    """
+    Test that /analyze_feedback categorizes the feedback of a cohort that does not fit in the context window
+    in shards, and merges their themes in a final request.
+    """
+    openai_client = CohortOpenAI()
+
+    with (
+        patch(
+            "prompting.createCategories.async_openai_client",
+            return_value=openai_client,
+        ),
+        patch("prompting.sort.async_openai_client", return_value=openai_client),
+        patch("prompting.summary.async_openai_client", return_value=openai_client),
+    ):
+        response = client.post(
+            "/analyze_feedback",
+            json={
+                "api_key": "test",
+                "questions": ["What went well?", "What was difficult?"],
+                "student_feedback": cohort_feedback,
+                "use_cheap_model": True,
+                "sort_per_question": True,
+            },
+        )
+
+    assert response.status_code == 200
+    assert len(openai_client.categorize) > 1
+    assert len(openai_client.reduce) == 1
+    # The themes of the shards are deduplicated before they are merged
+    assert openai_client.reduce[0].count("orked") == 1
+    data = response.json()
+    assert data["What went well?"]["Worked examples"] == [
+        cohort_feedback[0]["answers"][0],
+        cohort_feedback[1]["answers"][0],
+    ]
+    assert len(data["What went well?"]["Not included by AI"]) == 2498
+    assert data["Summary"] == "Students liked the examples."
+
+
+def test_analyze_feedback_response_cache(response_cache):
+    """
+    Test that analyzing the same feedback again reads every response from the cache, unless the request
+    sets bypass_cache.
+    """
+    openai_client = CohortOpenAI()
+    feedback = {
+        "api_key": "test",
+        "questions": ["What went well?", "What was difficult?"],
+        "student_feedback": [{"answers": ["The examples", "Recursion"]}] * 2,
+        "use_cheap_model": True,
+        "sort_per_question": True,
+    }
+
+    with (
+        patch(
+            "prompting.createCategories.async_openai_client",
+            return_value=openai_client,
+        ),
+        patch("prompting.sort.async_openai_client", return_value=openai_client),
+        patch("prompting.summary.async_openai_client", return_value=openai_client),
+    ):
+        first = client.post("/analyze_feedback", json=feedback)
+        assert openai_client.requests == 4
+        assert response_cache.misses == 4
+
+        second = client.post("/analyze_feedback", json=feedback)
+        assert openai_client.requests == 4
+        assert response_cache.hits == 4
+
+        bypassed = client.post(
+            "/analyze_feedback", json={**feedback, "bypass_cache": True}
+        )
+        assert openai_client.requests == 8
+
+    assert first.status_code == 200
+    assert second.json() == first.json()
+    assert bypassed.json() == first.json()
+
+
 @pytest.mark.asyncio
 def test_generate_report_invalid_data():
     """
@@ -301,26 +1436,19 @@ def test_generate_report_invalid_data():
     assert response.status_code == 422
 
 
-mock_db = MagicMock(spec=Session)
+mock_db = MagicMock(spec=AsyncSession)
 mock_request = MagicMock(spec=Request)
 
 
-def config_side_effect(key, cast=None, default=None):
-    if key == "isAdmin":
-        return False
-    return default
-
-
 @pytest.fixture
-def config_patch():
-    with patch("api.main.config") as mock_config:
-        mock_config.side_effect = config_side_effect
-        yield mock_config
+def admin_override_patch():
+    with patch("api.auth.ADMIN_OVERRIDE", False) as admin_override:
+        yield admin_override
 
 
 @pytest.fixture
 def crud_patch():
-    with patch("api.main.crud") as mock_crud:
+    with patch("api.auth.crud", new_callable=AsyncMock) as mock_crud:
         yield mock_crud
 
 
@@ -331,51 +1459,44 @@ def session_get_side_effect(key, default=None):
 
 
 @pytest.mark.asyncio
-def test_is_admin_with_admin_config(config_patch):
-    def local_config_side_effect(key, cast=None, default=None):
-        if key == "isAdmin":
-            return True
-        return default
-
-    config_patch.side_effect = local_config_side_effect
+async def test_is_admin_with_admin_config():
     mock_request.session.get.side_effect = session_get_side_effect
-    assert is_admin(mock_db, mock_request) == True
+    with patch("api.auth.ADMIN_OVERRIDE", True):
+        assert await AuthContext(mock_db, mock_request).is_admin() == True
 
 
 @pytest.mark.asyncio
-def test_is_admin_no_user_logged_in(config_patch):
+async def test_is_admin_no_user_logged_in(admin_override_patch):
     mock_request.session.get.side_effect = lambda key, default=None: default
-    assert is_admin(mock_db, mock_request) == False
+    assert await AuthContext(mock_db, mock_request).is_admin() == False
 
 
 @pytest.mark.asyncio
-def test_is_admin_user_not_in_db(config_patch, crud_patch):
-    config_patch.return_value = MagicMock(return_value=False)
+async def test_is_admin_user_not_in_db(admin_override_patch, crud_patch):
     crud_patch.get_user.return_value = None
     mock_request.session.get.side_effect = lambda key, default=None: (
         {"uid": "testuid"} if key == "user" else default
     )
-    assert is_admin(mock_db, mock_request) == False
+    assert await AuthContext(mock_db, mock_request).is_admin() == False
 
 
 @pytest.mark.asyncio
-def test_is_admin_user_not_admin(config_patch, crud_patch):
-    config_patch.return_value = MagicMock(return_value=False)
+async def test_is_admin_user_not_admin(admin_override_patch, crud_patch):
     crud_patch.get_user.return_value = MagicMock(admin=False)
     mock_request.session.get.side_effect = lambda key, default=None: (
         {"uid": "testuid"} if key == "user" else default
     )
-    assert is_admin(mock_db, mock_request) == False
+    assert await AuthContext(mock_db, mock_request).is_admin() == False
 
 
 @pytest.mark.asyncio
-def test_is_admin_user_is_admin(config_patch, crud_patch):
-    config_patch.return_value = MagicMock(return_value=False)
+async def test_is_admin_user_is_admin(admin_override_patch, crud_patch):
     crud_patch.get_user.return_value = MagicMock(admin=True)
     mock_request.session.get.side_effect = lambda key, default=None: (
         {"uid": "testuid"} if key == "user" else default
     )
-    assert is_admin(mock_db, mock_request) == True
+    assert await AuthContext(mock_db, mock_request).is_admin() == True
+    crud_patch.get_user.assert_awaited_once_with(mock_db, "testuid")
 
 
 @pytest.mark.asyncio